@@ -12,11 +12,21 @@ __doc__ = u"Читает XML-отчёт Navisworks, показывает про
 
 import os
 import re
-from collections import namedtuple
+from bisect import bisect_right
+from collections import namedtuple, deque
 from datetime import datetime
 
 from pyrevit import forms, script
-from Autodesk.Revit.DB import ElementId
+from pyrevit.forms import WPFWindow
+from Autodesk.Revit.DB import (
+    ElementId, ElementIdSetFilter, FilteredElementCollector,
+    Reference, RevitLinkInstance
+)
+from System.Collections.Generic import List
+
+import clash_clusters
+from clash_images import ThumbnailCache, default_cache_dir
+from clash_recovery import RecoveryParser
 
 
 # =============================================================================
@@ -26,6 +36,7 @@ from Autodesk.Revit.DB import ElementId
 # Фильтрация результатов
 FILTER_BY_FILE = True       # Сверка файла из pathlink с текущей моделью
 FILTER_BY_CATEGORY = False  # Дополнительная сверка категории в тексте pathlink
+INCLUDE_LINKED = True       # Искать объекты коллизий в загруженных связях
 
 # Имена атрибутов для поиска ID объекта
 OBJECT_ID_NAMES = frozenset([
@@ -39,6 +50,15 @@ DATE_ATTRIBUTES = (
     'time', 'start', 'lastsaved', 'creationtime', 'modificationtime'
 )
 
+# Кластеризация коллизий по точке конфликта
+CLUSTER_ENABLED = True                      # Выводить кластеры вместо отдельных строк
+CLUSTER_RADIUS = clash_clusters.DEFAULT_RADIUS  # Радиус в единицах отчёта (обычно м)
+CLUSTER_MODE = clash_clusters.MODE_PAIR     # MODE_PAIR или MODE_CATEGORY
+
+# Вывод результатов
+RESULT_VIEW = 'paged'       # 'paged' — постраничное окно, 'output' — таблицы в окне вывода
+PAGE_SIZE = 200             # Строк на странице постраничного окна
+
 # CSS-стиль для подсветки категорий
 BADGE_STYLE = u'background:#2f3b4a; color:#fff; padding:1px 6px; border-radius:3px; font-weight:600;'
 
@@ -59,6 +79,9 @@ class Patterns:
     # Имя файла модели
     MODEL_FILE = re.compile(u'.+\\.(nwc|nwd|nwf|rvt)$', re.IGNORECASE)
 
+    # Нормализация ключей: всё, кроме букв и цифр
+    NON_ALNUM = re.compile(u'[^0-9a-zA-Zа-яА-Я]+', re.UNICODE)
+
     # Атрибут даты в XML-тексте
     DATE_ATTR = re.compile(
         r'\b(?:date|created|generated|export(?:date|ed)?|timestamp|time|'
@@ -66,28 +89,6 @@ class Patterns:
         re.IGNORECASE
     )
 
-    # Fallback-парсер: блоки и атрибуты
-    CLASHTEST_BLOCK = re.compile(r'<clashtest\b[^>]*>.*?</clashtest>', re.DOTALL | re.IGNORECASE)
-    TEST_BLOCK = re.compile(r'<test\b[^>]*>.*?</test>', re.DOTALL | re.IGNORECASE)
-    CLASHRESULT_BLOCK = re.compile(r'<clashresult\b[^>]*>.*?</clashresult>', re.DOTALL | re.IGNORECASE)
-    CLASHOBJECT_BLOCK = re.compile(r'<clashobject\b[^>]*>.*?</clashobject>', re.DOTALL | re.IGNORECASE)
-
-    ATTR_NAME = re.compile(r'\bname=\"([^\"]+)\"', re.IGNORECASE)
-    ATTR_TESTNAME = re.compile(r'\btestname=\"([^\"]+)\"', re.IGNORECASE)
-    ATTR_HREF = re.compile(r'\bhref=\"([^\"]*)\"', re.IGNORECASE)
-
-    SMARTTAG_PAIR = re.compile(
-        r'<smarttag>.*?<name>(.*?)</name>.*?<value>(.*?)</value>.*?</smarttag>',
-        re.DOTALL | re.IGNORECASE
-    )
-    OBJECTATTR_PAIR = re.compile(
-        r'<objectattribute>.*?<name>(.*?)</name>.*?<value>(.*?)</value>.*?</objectattribute>',
-        re.DOTALL | re.IGNORECASE
-    )
-    PATHLINK_BLOCK = re.compile(r'<pathlink>.*?</pathlink>', re.DOTALL | re.IGNORECASE)
-    NODE_TEXT = re.compile(r'<node>(.*?)</node>', re.DOTALL | re.IGNORECASE)
-    HTML_TAGS = re.compile(r'<[^>]+>')
-
 
 # =============================================================================
 # СТРУКТУРЫ ДАННЫХ
@@ -112,6 +113,102 @@ uidoc = __revit__.ActiveUIDocument
 doc = uidoc.Document
 
 
+# =============================================================================
+# ПОИСК КАТЕГОРИЙ В ТЕКСТЕ
+# =============================================================================
+
+class CategoryMatcher:
+    """Индекс нормализованных имён категорий для поиска в сегментах пути.
+
+    Прямое вхождение (категория внутри сегмента) ищется автоматом Ахо-Корасик
+    за один проход по сегменту. Обратное (сегмент внутри имени категории) —
+    одним поиском подстроки в склейке всех имён с разделителем, которого нет
+    в нормализованном тексте. Оба поиска линейны по длине сегмента.
+    """
+
+    SEPARATOR = u'\x00'
+
+    def __init__(self, keys, min_length=4):
+        self.min_length = min_length
+        self._keys = sorted(k for k in set(keys) if k and len(k) >= min_length)
+        self._build_automaton()
+        self._build_joined()
+        self._memo = {}
+
+    def _build_automaton(self):
+        """Строит бор с суффиксными ссылками."""
+        goto = [{}]
+        output = [None]
+        for key in self._keys:
+            state = 0
+            for char in key:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    output.append(None)
+                state = nxt
+            if output[state] is None:
+                output[state] = key
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(char, 0) if goto[f].get(char) != nxt else 0
+                if output[nxt] is None:
+                    output[nxt] = output[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def _build_joined(self):
+        """Склеивает имена категорий для поиска сегмента внутри имени."""
+        self._offsets = []
+        pos = 0
+        for key in self._keys:
+            self._offsets.append(pos)
+            pos += len(key) + 1
+        self._joined = self.SEPARATOR.join(self._keys)
+
+    def _contained_key(self, text):
+        """Первая категория, целиком входящая в text."""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+    def _containing_key(self, text):
+        """Категория, в имя которой входит text."""
+        index = self._joined.find(text)
+        if index < 0:
+            return None
+        return self._keys[bisect_right(self._offsets, index) - 1]
+
+    def find(self, segment_normalized):
+        """Ищет категорию в нормализованном сегменте пути (результат запоминается)."""
+        if not segment_normalized or len(segment_normalized) < self.min_length:
+            return None
+        if segment_normalized in self._memo:
+            return self._memo[segment_normalized]
+
+        found = self._contained_key(segment_normalized) or self._containing_key(segment_normalized)
+        self._memo[segment_normalized] = found
+        return found
+
+
 # =============================================================================
 # КЭШ ЭЛЕМЕНТОВ И КАТЕГОРИЙ
 # =============================================================================
@@ -122,29 +219,73 @@ class ElementCache:
     def __init__(self, document):
         self._doc = document
         self._cache = {}
+        self._category_names = {}
+        self._normalized = {}
         self._category_keys = self._build_category_keys()
+        self._category_matcher = None
         self._doc_title_key = self._normalize_key(document.Title)
+        self._model_match_cache = {}
 
     def _normalize_key(self, text):
-        """Нормализует строку для сравнения."""
+        """Нормализует строку для сравнения (результат запоминается)."""
         if not text:
             return u""
-        return re.sub(u'[^0-9a-zA-Zа-яА-Я]+', u'', text, flags=re.UNICODE).lower()
+        key = self._normalized.get(text)
+        if key is None:
+            key = Patterns.NON_ALNUM.sub(u'', text).lower()
+            self._normalized[text] = key
+        return key
 
     def _build_category_keys(self):
-        """Собирает нормализованные имена категорий документа."""
+        """Собирает нормализованные имена категорий документа и карту id -> имя."""
         keys = set()
         try:
             for cat in self._doc.Settings.Categories:
                 try:
                     if cat.Name:
                         keys.add(self._normalize_key(cat.Name))
+                        self._category_names[cat.Id.IntegerValue] = cat.Name
                 except Exception:
                     pass
         except Exception:
             pass
         return keys
 
+    def _category_of(self, element):
+        """Имя категории элемента по заранее собранной карте."""
+        category = element.Category
+        if category is None:
+            return u""
+        name = self._category_names.get(category.Id.IntegerValue)
+        if name is None:
+            name = category.Name or u""
+            self._category_names[category.Id.IntegerValue] = name
+        return name
+
+    def prefetch(self, element_ids):
+        """Загружает элементы одним проходом коллектора (ElementIdSetFilter)."""
+        missing = set(eid for eid in element_ids if eid is not None and eid not in self._cache)
+        if not missing:
+            return
+
+        id_list = List[ElementId]()
+        for eid in missing:
+            id_list.Add(ElementId(eid))
+
+        try:
+            collector = FilteredElementCollector(self._doc).WherePasses(ElementIdSetFilter(id_list))
+            for element in collector:
+                try:
+                    self._cache[element.Id.IntegerValue] = (element, self._category_of(element))
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+        # Не найденные ID запоминаем как пустые, чтобы не искать повторно
+        for eid in missing:
+            self._cache.setdefault(eid, (None, u""))
+
     def get_element_and_category(self, element_id):
         """Возвращает (element, category_name) для заданного ID."""
         if element_id in self._cache:
@@ -152,9 +293,7 @@ class ElementCache:
 
         try:
             element = self._doc.GetElement(ElementId(element_id))
-            category = u""
-            if element and element.Category:
-                category = element.Category.Name or u""
+            category = self._category_of(element) if element else u""
         except Exception:
             element, category = None, u""
 
@@ -162,13 +301,23 @@ class ElementCache:
         return element, category
 
     def matches_current_model(self, path_text):
-        """Проверяет, относится ли путь к текущей модели."""
+        """Проверяет, относится ли путь к текущей модели (результат кэшируется по тексту пути)."""
+        cached = self._model_match_cache.get(path_text)
+        if cached is not None:
+            return cached
+
         filename = self._extract_filename(path_text)
         if not filename:
-            return True
+            result = True
+        else:
+            filename_key = self._normalize_key(filename)
+            result = filename_key in self._doc_title_key or self._doc_title_key in filename_key
+
+        self._model_match_cache[path_text] = result
+        return result
 
-        filename_key = self._normalize_key(filename)
-        return filename_key in self._doc_title_key or self._doc_title_key in filename_key
+    def extract_filename(self, path_text):
+        return self._extract_filename(path_text)
 
     def _extract_filename(self, path_text):
         """Извлекает имя файла модели из пути."""
@@ -183,15 +332,9 @@ class ElementCache:
 
     def find_category_in_path(self, segment_normalized):
         """Ищет категорию документа в сегменте пути."""
-        if not segment_normalized or len(segment_normalized) < 4:
-            return None
-
-        for cat_key in self._category_keys:
-            if not cat_key or len(cat_key) < 4:
-                continue
-            if cat_key in segment_normalized or segment_normalized in cat_key:
-                return cat_key
-        return None
+        if self._category_matcher is None:
+            self._category_matcher = CategoryMatcher(self._category_keys)
+        return self._category_matcher.find(segment_normalized)
 
     @property
     def doc_title_key(self):
@@ -205,6 +348,129 @@ class ElementCache:
 element_cache = ElementCache(doc)
 
 
+# =============================================================================
+# ИНДЕКС СВЯЗАННЫХ МОДЕЛЕЙ
+# =============================================================================
+
+class LinkedModel:
+    """Загруженная связь: экземпляр, документ и ленивый кэш элементов."""
+
+    def __init__(self, instance, document):
+        self.instance = instance
+        self.document = document
+        self.name = document.Title
+        self._cache = None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = ElementCache(self.document)
+        return self._cache
+
+
+class LinkIndex:
+    """Индекс связей: имя файла из pathlink -> LinkedModel.
+
+    Имена связей нормализуются один раз при построении, результаты поиска
+    по имени файла запоминаются.
+    """
+
+    def __init__(self, document, host_cache):
+        self._host_cache = host_cache
+        self._links = {}
+        self._lookup = {}
+        self._collect(document)
+
+    def _collect(self, document):
+        try:
+            instances = FilteredElementCollector(document).OfClass(RevitLinkInstance)
+        except Exception:
+            return
+        for instance in instances:
+            try:
+                link_doc = instance.GetLinkDocument()
+            except Exception:
+                link_doc = None
+            if link_doc is None:
+                continue
+            key = self._host_cache.normalize_key(link_doc.Title)
+            if key and key not in self._links:
+                self._links[key] = LinkedModel(instance, link_doc)
+
+    def __len__(self):
+        return len(self._links)
+
+    def find(self, path_text):
+        """Возвращает LinkedModel для пути pathlink или None."""
+        filename = self._host_cache.extract_filename(path_text)
+        if not filename:
+            return None
+
+        filename_key = self._host_cache.normalize_key(filename)
+        if filename_key in self._lookup:
+            return self._lookup[filename_key]
+
+        link = self._links.get(filename_key)
+        if link is None:
+            # Частичное совпадение имени принимаем, только если оно однозначно:
+            # "АР" входит и в "АР_корпус1", и в "АР_корпус2"
+            matches = [candidate for key, candidate in self._links.items()
+                       if key in filename_key or filename_key in key]
+            link = matches[0] if len(matches) == 1 else None
+
+        self._lookup[filename_key] = link
+        return link
+
+    def find_exact(self, path_text):
+        """LinkedModel, имя которой точно совпадает с именем файла pathlink, или None."""
+        filename = self._host_cache.extract_filename(path_text)
+        if not filename:
+            return None
+        return self._links.get(self._host_cache.normalize_key(filename))
+
+
+def select_clash_rows(items):
+    """Выделяет элементы строк; элементы связей — через ссылки на связанные элементы.
+
+    Возвращает число выделенных элементов.
+    """
+    host_ids = List[ElementId]()
+    refs = List[Reference]()
+    instance_ids = List[ElementId]()
+    has_linked = False
+    for item in items:
+        element = item.get('element')
+        if element is None:
+            continue
+        link = item.get('link')
+        try:
+            if link is None:
+                host_ids.Add(element.Id)
+                refs.Add(Reference(element))
+            else:
+                has_linked = True
+                refs.Add(Reference(element).CreateLinkReference(link.instance))
+                if link.instance.Id not in instance_ids:
+                    instance_ids.Add(link.instance.Id)
+        except Exception:
+            pass
+
+    if not has_linked:
+        if host_ids.Count:
+            uidoc.Selection.SetElementIds(host_ids)
+        return host_ids.Count
+
+    try:
+        uidoc.Selection.SetReferences(refs)
+        return refs.Count
+    except Exception:
+        # До Revit 2023 нет выбора по ссылкам: выделяем сами экземпляры связей
+        for instance_id in instance_ids:
+            host_ids.Add(instance_id)
+        uidoc.Selection.SetElementIds(host_ids)
+        return host_ids.Count
+
+
 # =============================================================================
 # ЧТЕНИЕ И ОЧИСТКА XML
 # =============================================================================
@@ -291,8 +557,8 @@ class NavisworksReportParser:
         try:
             return self._parse_with_xml_parser()
         except Exception as e:
-            out.print_md(u":warning: XML-парсер не справился (`{}`). Использую fallback...".format(e))
-            return self._parse_with_regex()
+            out.print_md(u":warning: XML-парсер не справился (`{}`). Использую восстанавливающий разбор...".format(e))
+            return self._parse_with_recovery()
 
     def _parse_with_xml_parser(self):
         """Основной парсер на базе XML."""
@@ -334,6 +600,7 @@ class NavisworksReportParser:
         test_name = self._get_test_name(clash_result, parent_map)
         clash_name = clash_result.get('name') or u'Без имени'
         image_path = self._resolve_image_path(clash_result.get('href'))
+        point = self._extract_clash_point(clash_result)
 
         objects = []
         for clash_object in clash_result.findall('./clashobjects/clashobject'):
@@ -345,7 +612,7 @@ class NavisworksReportParser:
             return
 
         rows = groups.setdefault(test_name, [])
-        self._add_rows(rows, clash_name, image_path, objects)
+        self._add_rows(rows, clash_name, image_path, objects, point)
 
     def _get_test_name(self, clash_result, parent_map):
         """Определяет имя теста для clashresult."""
@@ -365,6 +632,13 @@ class NavisworksReportParser:
 
         return u'(Без названия проверки)'
 
+    def _extract_clash_point(self, clash_result):
+        """Извлекает координаты точки конфликта (clashpoint/pos3f)."""
+        pos = clash_result.find('./clashpoint/pos3f')
+        if pos is None:
+            return None
+        return clash_clusters.parse_point(pos.get('x'), pos.get('y'), pos.get('z'))
+
     def _parse_clash_object(self, element):
         """Парсит clashobject и возвращает ClashObject."""
         element_id = self._extract_object_id(element)
@@ -420,7 +694,7 @@ class NavisworksReportParser:
         href = href.replace('\\', '/').lstrip('./')
         return os.path.normpath(os.path.join(self.base_dir, href))
 
-    def _add_rows(self, rows, clash_name, image_path, objects):
+    def _add_rows(self, rows, clash_name, image_path, objects, point=None):
         """Добавляет строки для пары объектов."""
         if len(objects) >= 2:
             obj_a, obj_b = objects[0], objects[1]
@@ -428,109 +702,52 @@ class NavisworksReportParser:
             rows.append({
                 'name': clash_name, 'img': image_path,
                 'id': obj_a.element_id, 'id_other': obj_b.element_id,
-                'path': obj_a.path, 'path_other': obj_b.path
+                'path': obj_a.path, 'path_other': obj_b.path,
+                'point': point
             })
             rows.append({
                 'name': clash_name, 'img': image_path,
                 'id': obj_b.element_id, 'id_other': obj_a.element_id,
-                'path': obj_b.path, 'path_other': obj_a.path
+                'path': obj_b.path, 'path_other': obj_a.path,
+                'point': point
             })
         else:
             obj = objects[0]
             rows.append({
                 'name': clash_name, 'img': image_path,
                 'id': obj.element_id, 'id_other': None,
-                'path': obj.path, 'path_other': u''
+                'path': obj.path, 'path_other': u'',
+                'point': point
             })
 
-    def _parse_with_regex(self):
-        """Fallback-парсер на базе регулярных выражений."""
+    def _parse_with_recovery(self):
+        """Fallback: однопроходный разбор по тегам, пропускающий повреждённые фрагменты."""
         text = XmlReader.sanitize(XmlReader.read_file(self.xml_path))
+        parser = RecoveryParser(OBJECT_ID_NAMES)
         groups = {}
 
-        # Ищем блоки тестов
-        blocks = list(Patterns.CLASHTEST_BLOCK.finditer(text))
-        if not blocks:
-            blocks = list(Patterns.TEST_BLOCK.finditer(text))
-        if not blocks:
-            # Обрабатываем весь текст как один блок
-            blocks = [type('FakeMatch', (), {'group': lambda self, n=0: text})()]
+        for clash in parser.parse(text):
+            objects = []
+            for obj in clash.objects:
+                element_id = (obj.element_id or u'').strip()
+                if element_id.isdigit():
+                    objects.append(ClashObject(element_id=int(element_id), path=u' / '.join(obj.nodes)))
 
-        for block_match in blocks:
-            block_text = block_match.group(0) if hasattr(block_match, 'group') else str(block_match)
+            if not objects:
+                continue
 
-            # Определяем имя теста
-            name_match = Patterns.ATTR_NAME.search(block_text)
-            default_test_name = name_match.group(1) if name_match else u'(Без названия проверки)'
-            groups.setdefault(default_test_name, [])
+            rows = groups.setdefault(clash.test_name, [])
+            self._add_rows(
+                rows, clash.name or u'Без имени', self._resolve_image_path(clash.href),
+                objects, clash.point
+            )
 
-            # Парсим результаты
-            for result_match in Patterns.CLASHRESULT_BLOCK.finditer(block_text):
-                self._process_regex_result(result_match.group(0), groups, default_test_name)
+        # Пустые проверки тоже показываем
+        for name in parser.test_names:
+            groups.setdefault(name, [])
 
         return groups
 
-    def _process_regex_result(self, result_text, groups, default_test_name):
-        """Обрабатывает clashresult через regex."""
-        # Имя теста
-        testname_match = Patterns.ATTR_TESTNAME.search(result_text)
-        test_name = testname_match.group(1) if testname_match else default_test_name
-
-        # Путь к изображению
-        href_match = Patterns.ATTR_HREF.search(result_text)
-        image_path = self._resolve_image_path(href_match.group(1) if href_match else u'')
-
-        # Имя коллизии
-        name_match = Patterns.ATTR_NAME.search(result_text)
-        clash_name = name_match.group(1) if name_match else u'Без имени'
-
-        # Парсим объекты
-        objects = []
-        for obj_match in Patterns.CLASHOBJECT_BLOCK.finditer(result_text):
-            obj = self._parse_regex_object(obj_match.group(0))
-            if obj:
-                objects.append(obj)
-
-        if not objects:
-            return
-
-        rows = groups.setdefault(test_name, [])
-        self._add_rows(rows, clash_name, image_path, objects)
-
-    def _parse_regex_object(self, obj_text):
-        """Парсит clashobject через regex."""
-        element_id = None
-
-        # Ищем в smarttags
-        for name, value in Patterns.SMARTTAG_PAIR.findall(obj_text):
-            if (name or u'').strip().lower() in OBJECT_ID_NAMES:
-                v = (value or u'').strip()
-                if v.isdigit():
-                    element_id = int(v)
-                    break
-
-        # Ищем в objectattribute
-        if element_id is None:
-            for name, value in Patterns.OBJECTATTR_PAIR.findall(obj_text):
-                if (name or u'').strip().lower() in OBJECT_ID_NAMES:
-                    v = (value or u'').strip()
-                    if v.isdigit():
-                        element_id = int(v)
-                        break
-
-        if element_id is None:
-            return None
-
-        # Извлекаем путь
-        path = u''
-        pathlink_match = Patterns.PATHLINK_BLOCK.search(obj_text)
-        if pathlink_match:
-            nodes = Patterns.NODE_TEXT.findall(pathlink_match.group(0))
-            parts = [Patterns.HTML_TAGS.sub(u'', n).strip() for n in nodes if n.strip()]
-            path = u' / '.join(parts)
-
-        return ClashObject(element_id=element_id, path=path)
-
 
 # =============================================================================
 # ИЗВЛЕЧЕНИЕ ДАТЫ ОТЧЁТА
@@ -583,8 +800,56 @@ def extract_report_datetime(xml_path):
 class ResultFilter:
     """Фильтрация и аннотация результатов."""
 
-    def __init__(self, cache):
+    def __init__(self, cache, link_index=None):
         self.cache = cache
+        self.link_index = link_index
+
+    def _owner(self, path_text):
+        """Возвращает (cache, link) документа, которому принадлежит путь pathlink."""
+        if not FILTER_BY_FILE:
+            return self.cache, None
+        # Точное имя связи важнее частичного совпадения с моделью:
+        # связь "Проект_ОВ_корпус2" содержит в имени "Проект_ОВ"
+        if self.link_index:
+            link = self.link_index.find_exact(path_text)
+            if link is not None:
+                return link.cache, link
+        if self.cache.matches_current_model(path_text):
+            return self.cache, None
+        if self.link_index:
+            link = self.link_index.find(path_text)
+            if link is not None:
+                return link.cache, link
+        return None, None
+
+    def _resolve_owner(self, item):
+        """Определяет документ строки; для неопознанных путей — прежняя сверка с текущей моделью."""
+        cache, link = self._owner(item.get('path', u''))
+        if cache is None and self.cache.matches_current_model(item.get('path_other', u'')):
+            return self.cache, None
+        return cache, link
+
+    def prefetch(self, groups):
+        """Загружает все элементы отчёта пакетными запросами (по одному на документ)."""
+        ids_by_cache = {}
+        for rows in groups.values():
+            for item in rows:
+                for id_key, path_key in (('id', 'path'), ('id_other', 'path_other')):
+                    value = item.get(id_key)
+                    if not value:
+                        continue
+                    if id_key == 'id':
+                        cache, _ = self._resolve_owner(item)
+                    else:
+                        cache, _ = self._owner(item.get(path_key, u''))
+                    if cache is None:
+                        continue
+                    try:
+                        ids_by_cache.setdefault(cache, set()).add(int(value))
+                    except Exception:
+                        pass
+        for cache, ids in ids_by_cache.items():
+            cache.prefetch(ids)
 
     def filter_and_annotate(self, items):
         """Фильтрует строки и добавляет информацию о категориях."""
@@ -600,21 +865,16 @@ class ResultFilter:
     def _process_item(self, item):
         """Обрабатывает одну строку."""
         try:
+            cache, link = self._resolve_owner(item)
+            if cache is None:
+                return None
+
             element_id = int(item['id'])
-            element, category = self.cache.get_element_and_category(element_id)
+            element, category = cache.get_element_and_category(element_id)
 
             if not element:
                 return None
 
-            # Фильтр по файлу
-            if FILTER_BY_FILE:
-                path_matches = (
-                    self.cache.matches_current_model(item.get('path', u'')) or
-                    self.cache.matches_current_model(item.get('path_other', u''))
-                )
-                if not path_matches:
-                    return None
-
             # Фильтр по категории
             if FILTER_BY_CATEGORY and category:
                 cat_lower = category.strip().lower()
@@ -626,11 +886,14 @@ class ResultFilter:
             # Создаём аннотированную копию
             result = dict(item)
             result['cat'] = category
+            result['element'] = element
+            result['link'] = link
 
             # Категория второго элемента
             other_id = item.get('id_other')
-            if other_id:
-                other_element, other_category = self.cache.get_element_and_category(int(other_id))
+            other_cache, _ = self._owner(item.get('path_other', u''))
+            if other_id and other_cache is not None:
+                other_element, other_category = other_cache.get_element_and_category(int(other_id))
                 result['cat_other'] = other_category if other_element else u""
             else:
                 result['cat_other'] = u""
@@ -650,38 +913,62 @@ class PathHighlighter:
 
     def __init__(self, cache):
         self.cache = cache
+        self._located = {}
 
     def highlight(self, path_text, category_name):
         """Подсвечивает категорию в пути."""
         if not path_text:
             return u'—'
 
-        segments = [s.strip() for s in path_text.split(u'/')]
-        highlighted = False
+        segments, index = self._locate(path_text, category_name)
+        if index is None:
+            return u' / '.join(segments)
+
+        segments = list(segments)
+        segments[index] = self._wrap_in_badge(segments[index])
+        return u' / '.join(segments)
+
+    def category_segment(self, path_text):
+        """Возвращает сегмент пути с категорией (или весь путь, если не найден)."""
+        if not path_text:
+            return u'—'
+
+        segments, index = self._locate(path_text, u'')
+        if index is None:
+            return u' / '.join(segments)
+        return segments[index]
 
-        # 1. Пробуем подсветить по имени категории
+    def _locate(self, path_text, category_name):
+        """Возвращает (segments, index) сегмента с категорией; результат запоминается."""
+        memo_key = (path_text, category_name or u'')
+        located = self._located.get(memo_key)
+        if located is not None:
+            return located
+
+        segments = tuple(s.strip() for s in path_text.split(u'/'))
+        index = None
+
+        # 1. Пробуем найти по имени категории
         if category_name:
             category_key = self.cache.normalize_key(category_name.strip())
             if category_key:
                 for i, segment in enumerate(segments):
                     if category_key in self.cache.normalize_key(segment):
-                        segments[i] = self._wrap_in_badge(segment)
-                        highlighted = True
+                        index = i
                         break
 
         # 2. Если не нашли - ищем по списку категорий документа
-        if not highlighted:
+        if index is None:
             start_index = self._find_start_after_filename(segments)
             for i in range(start_index, len(segments)):
-                if '<span' in segments[i]:
-                    continue
-
                 segment_key = self.cache.normalize_key(segments[i])
                 if self.cache.find_category_in_path(segment_key):
-                    segments[i] = self._wrap_in_badge(segments[i])
+                    index = i
                     break
 
-        return u' / '.join(segments)
+        located = (segments, index)
+        self._located[memo_key] = located
+        return located
 
     def _find_start_after_filename(self, segments):
         """Находит индекс сегмента после имени файла."""
@@ -751,19 +1038,81 @@ class StatisticsBuilder:
 
         # Если вторая категория не определена - пробуем извлечь из пути
         if not cat2:
-            highlighted = self.highlighter.highlight(item.get('path_other') or u'', u'')
-            # Извлекаем текст из span
-            match = re.search(u'<span[^>]*>([^<]+)</span>', highlighted)
-            if match:
-                cat2 = match.group(1)
-            else:
-                cat2 = re.sub(u'<[^>]*>', u'', highlighted)
+            cat2 = self.highlighter.category_segment(item.get('path_other') or u'')
 
         if cat1 or cat2:
             return tuple(sorted([cat1 or u'—', cat2 or u'—']))
         return None
 
 
+# =============================================================================
+# КЛАСТЕРИЗАЦИЯ
+# =============================================================================
+
+ClashCluster = namedtuple('ClashCluster', [
+    'rows', 'names', 'element_ids', 'linked_ids', 'category', 'other_category', 'point'
+])
+
+
+class ClashClusterer:
+    """Группировка близких коллизий одной пары элементов/категорий."""
+
+    def __init__(self, radius=CLUSTER_RADIUS, mode=CLUSTER_MODE):
+        self.radius = radius
+        self.mode = mode
+
+    def build(self, rows):
+        """Возвращает список ClashCluster для строк одной проверки."""
+        groups = clash_clusters.cluster_rows(
+            rows, self._point_of, self._key_of, self.radius
+        )
+        return [self._make_cluster(group) for group in groups]
+
+    def singles(self, rows):
+        """Каждая строка — отдельный кластер (кластеризация выключена)."""
+        return [self._make_cluster([row]) for row in rows]
+
+    def _point_of(self, item):
+        return item.get('point')
+
+    def _key_of(self, item):
+        if self.mode == clash_clusters.MODE_CATEGORY:
+            return clash_clusters.category_key(item.get('cat'), item.get('cat_other'))
+        return clash_clusters.pair_key(item.get('id'), item.get('id_other'))
+
+    def _make_cluster(self, group):
+        names = []
+        seen_names = set()
+        element_ids = []
+        linked_ids = []
+        seen_ids = set()
+        for item in group:
+            name = item.get('name') or u''
+            if name not in seen_names:
+                seen_names.add(name)
+                names.append(name)
+            link = item.get('link')
+            element_key = (link.name if link else None, int(item['id']))
+            if element_key in seen_ids:
+                continue
+            seen_ids.add(element_key)
+            if link is None:
+                element_ids.append(element_key[1])
+            else:
+                linked_ids.append(element_key)
+
+        first = group[0]
+        return ClashCluster(
+            rows=group,
+            names=names,
+            element_ids=element_ids,
+            linked_ids=linked_ids,
+            category=first.get('cat') or u'',
+            other_category=first.get('cat_other') or u'',
+            point=clash_clusters.cluster_centroid([r.get('point') for r in group])
+        )
+
+
 # =============================================================================
 # ВЫВОД РЕЗУЛЬТАТОВ
 # =============================================================================
@@ -771,9 +1120,10 @@ class StatisticsBuilder:
 class ResultPrinter:
     """Вывод результатов в UI."""
 
-    def __init__(self, output, highlighter):
+    def __init__(self, output, highlighter, thumbnails=None):
         self.out = output
         self.highlighter = highlighter
+        self.thumbnails = thumbnails
 
     def print_report_date(self, date_value, date_source):
         """Печатает дату отчёта."""
@@ -825,7 +1175,7 @@ class ResultPrinter:
                 self._format_image(item.get('img')),
                 title,
                 item.get('name') or u'',
-                self.out.linkify(ElementId(int(item['id']))),
+                self._format_id(item),
                 path1 or u'—',
                 path2 or u'—'
             ])
@@ -839,16 +1189,298 @@ class ResultPrinter:
             title=None
         )
 
-    def print_footer(self):
+    def print_clusters(self, title, clusters):
+        """Печатает таблицу кластеров: один кластер — одна строка."""
+        total_rows = sum(len(c.rows) for c in clusters)
+        self.out.print_md(u"\n---\n### Проверка: **{}**  _(кластеров: {}, строк: {})_".format(
+            title, len(clusters), total_rows
+        ))
+
+        if not clusters:
+            self.out.print_md(u"—")
+            return
+
+        table_data = []
+        for i, cluster in enumerate(clusters, 1):
+            first = cluster.rows[0]
+            path1 = self.highlighter.highlight(first.get('path') or u'', cluster.category)
+            path2 = self.highlighter.highlight(first.get('path_other') or u'', cluster.other_category)
+
+            table_data.append([
+                i,
+                self._format_image(first.get('img')),
+                self._format_names(cluster.names),
+                len(cluster.names),
+                self._format_cluster_ids(cluster),
+                self._format_point(cluster.point),
+                path1 or u'—',
+                path2 or u'—'
+            ])
+
+        self.out.print_table(
+            table_data=table_data,
+            columns=[
+                u'№', u'Снимок', u'Пересечения', u'Кол-во',
+                u'ID (все)', u'Центр', u'Путь элемента', u'Путь второго элемента'
+            ],
+            title=None
+        )
+
+    def print_footer(self, linked_count=0):
         """Печатает подвал."""
         self.out.print_md(u"_Клик по **ID** выделяет элемент. Можно кликать подряд._")
+        if linked_count:
+            self.out.print_md(u"_Элементов из связей: {}. Они отмечены именем связи "
+                              u"и выделяются через ссылки на связанные элементы._".format(linked_count))
+
+    def _format_id(self, item):
+        """ID элемента: ссылка для текущей модели, текст с именем связи для связей."""
+        link = item.get('link')
+        if link is None:
+            return self.out.linkify(ElementId(int(item['id'])))
+        return self._format_linked_id(link.name, item['id'])
+
+    def _format_cluster_ids(self, cluster):
+        """ID элементов кластера: ссылка на все элементы модели + элементы связей."""
+        parts = []
+        if cluster.element_ids:
+            parts.append(self.out.linkify([ElementId(eid) for eid in cluster.element_ids]))
+        for link_name, element_id in cluster.linked_ids:
+            parts.append(self._format_linked_id(link_name, element_id))
+        return u'<br>'.join(parts) or u'—'
+
+    def _format_linked_id(self, link_name, element_id):
+        return u'{} <i>({})</i>'.format(element_id, link_name)
+
+    def _format_names(self, names, limit=3):
+        """Сокращает список имён коллизий кластера."""
+        shown = u', '.join(names[:limit])
+        if len(names) > limit:
+            shown += u' … (+{})'.format(len(names) - limit)
+        return shown
+
+    def _format_point(self, point):
+        """Форматирует координаты центра кластера."""
+        if not point:
+            return u'—'
+        return u'{:.2f}; {:.2f}; {:.2f}'.format(*point)
 
     def _format_image(self, path, width=96):
-        """Форматирует ячейку с изображением."""
+        """Форматирует ячейку с превью; полный снимок открывается по ссылке."""
         if not path or not os.path.exists(path):
             return u'—'
         uri = u'file:///' + path.replace('\\', '/')
-        return u'<img src="{}" width="{}" />'.format(uri, int(width))
+        thumb = self.thumbnails.thumbnail_for(path) if self.thumbnails else None
+        src = u'file:///' + thumb.replace('\\', '/') if thumb else uri
+        return u'<a href="{}"><img src="{}" width="{}" /></a>'.format(uri, src, int(width))
+
+
+# =============================================================================
+# ПОСТРАНИЧНЫЙ ПРОСМОТР
+# =============================================================================
+
+class ClashViewItem(object):
+    """Строка таблицы окна; создаётся только для видимой страницы."""
+
+    def __init__(self, number, test_name, cluster, thumbnails=None):
+        self._number = number
+        self._test_name = test_name
+        self.cluster = cluster
+        self._thumbnails = thumbnails
+
+    @property
+    def No(self):
+        return self._number
+
+    @property
+    def Test(self):
+        return self._test_name
+
+    @property
+    def Name(self):
+        names = self.cluster.names
+        shown = u', '.join(names[:3])
+        if len(names) > 3:
+            shown += u' … (+{})'.format(len(names) - 3)
+        return shown
+
+    @property
+    def Count(self):
+        return len(self.cluster.names)
+
+    @property
+    def Ids(self):
+        parts = [u'{}'.format(eid) for eid in self.cluster.element_ids]
+        parts.extend(u'{} ({})'.format(eid, name) for name, eid in self.cluster.linked_ids)
+        return u', '.join(parts)
+
+    @property
+    def Category(self):
+        return self.cluster.category
+
+    @property
+    def OtherCategory(self):
+        return self.cluster.other_category
+
+    @property
+    def Path(self):
+        return self.cluster.rows[0].get('path') or u''
+
+    @property
+    def OtherPath(self):
+        return self.cluster.rows[0].get('path_other') or u''
+
+    @property
+    def Thumb(self):
+        """Превью снимка из кэша (строится при первом показе строки)."""
+        path = self.cluster.rows[0].get('img')
+        if not path or not os.path.exists(path):
+            return None
+        thumb = self._thumbnails.thumbnail_for(path) if self._thumbnails else None
+        return thumb or path
+
+
+class ClashResultsWindow(WPFWindow):
+    """Постраничный просмотр коллизий.
+
+    Все записи держатся в памяти как (проверка, кластер); фильтр и сортировка
+    меняют только список индексов, а объекты для таблицы создаются лишь для
+    текущей страницы — время показа не зависит от размера отчёта.
+    """
+
+    ALL_TESTS = u'Все проверки'
+    SORT_KEYS = (
+        (u'Порядок отчёта', lambda e: e[0]),
+        (u'Проверка', lambda e: e[1].lower()),
+        (u'Кол-во', lambda e: len(e[2].names)),
+        (u'Категория', lambda e: (e[2].category or u'').lower()),
+        (u'Пересечение', lambda e: (e[2].names[0] if e[2].names else u'').lower()),
+    )
+
+    def __init__(self, entries, page_size=PAGE_SIZE, thumbnails=None):
+        WPFWindow.__init__(self, 'ClashResultsWindow.xaml')
+        # entries: [(порядковый номер, имя проверки, ClashCluster), ...]
+        self._entries = entries
+        self._thumbnails = thumbnails
+        self._page_size = page_size
+        self._search_text = {}
+        self._visible = list(range(len(entries)))
+        self._page = 0
+        self._ready = False
+
+        tests = sorted(set(e[1] for e in entries), key=lambda s: s.lower())
+        self.cb_test.ItemsSource = [self.ALL_TESTS] + tests
+        self.cb_test.SelectedIndex = 0
+        self.cb_sort.ItemsSource = [name for name, _ in self.SORT_KEYS]
+        self.cb_sort.SelectedIndex = 0
+
+        self._ready = True
+        self._render()
+
+    # ---------- данные ----------
+
+    def _search_key(self, index):
+        """Текст для поиска по записи (строится при первом обращении)."""
+        text = self._search_text.get(index)
+        if text is None:
+            _, test_name, cluster = self._entries[index]
+            first = cluster.rows[0]
+            parts = [test_name, cluster.category, cluster.other_category,
+                     first.get('path') or u'', first.get('path_other') or u'']
+            parts.extend(cluster.names)
+            parts.extend(u'{}'.format(eid) for eid in cluster.element_ids)
+            parts.extend(u'{}'.format(eid) for _, eid in cluster.linked_ids)
+            text = u'\n'.join(parts).lower()
+            self._search_text[index] = text
+        return text
+
+    def _apply_filter(self):
+        test = self.cb_test.SelectedItem
+        needle = (self.tb_filter.Text or u'').strip().lower()
+        visible = []
+        for index, entry in enumerate(self._entries):
+            if test and test != self.ALL_TESTS and entry[1] != test:
+                continue
+            if needle and needle not in self._search_key(index):
+                continue
+            visible.append(index)
+        self._visible = visible
+        self._apply_sort()
+
+    def _apply_sort(self):
+        sort_index = max(self.cb_sort.SelectedIndex, 0)
+        key_func = self.SORT_KEYS[sort_index][1]
+        entries = self._entries
+        self._visible.sort(key=lambda i: key_func(entries[i]),
+                           reverse=bool(self.chk_desc.IsChecked))
+        self._page = 0
+
+    # ---------- отображение ----------
+
+    def _page_count(self):
+        return max(1, (len(self._visible) + self._page_size - 1) // self._page_size)
+
+    def _render(self):
+        start = self._page * self._page_size
+        items = []
+        for index in self._visible[start:start + self._page_size]:
+            number, test_name, cluster = self._entries[index]
+            items.append(ClashViewItem(number, test_name, cluster, self._thumbnails))
+        self.dg_rows.ItemsSource = items
+        self.tb_page.Text = u'Стр. {} из {}  (записей: {})'.format(
+            self._page + 1, self._page_count(), len(self._visible)
+        )
+
+    def _selected_clusters(self):
+        return [item.cluster for item in (self.dg_rows.SelectedItems or [])]
+
+    # ---------- обработчики ----------
+
+    def filter_changed(self, sender, e):
+        if not self._ready:
+            return
+        self._apply_filter()
+        self._render()
+
+    def sort_changed(self, sender, e):
+        if not self._ready:
+            return
+        self._apply_sort()
+        self._render()
+
+    def first_page(self, sender, e):
+        self._page = 0
+        self._render()
+
+    def prev_page(self, sender, e):
+        if self._page > 0:
+            self._page -= 1
+            self._render()
+
+    def next_page(self, sender, e):
+        if self._page + 1 < self._page_count():
+            self._page += 1
+            self._render()
+
+    def last_page(self, sender, e):
+        self._page = self._page_count() - 1
+        self._render()
+
+    def select_click(self, sender, e):
+        rows = [row for cluster in self._selected_clusters() for row in cluster.rows]
+        if rows:
+            select_clash_rows(rows)
+
+    def image_click(self, sender, e):
+        for cluster in self._selected_clusters():
+            path = cluster.rows[0].get('img')
+            if path and os.path.exists(path):
+                os.startfile(path)
+                return
+        forms.alert(u"Для выбранной строки нет снимка.", title=u"Пересечения")
+
+    def close_click(self, sender, e):
+        self.Close()
 
 
 # =============================================================================
@@ -887,15 +1519,19 @@ def main():
 
     # Инициализация компонентов
     highlighter = PathHighlighter(element_cache)
-    result_filter = ResultFilter(element_cache)
+    link_index = LinkIndex(doc, element_cache) if INCLUDE_LINKED else None
+    result_filter = ResultFilter(element_cache, link_index)
     stats_builder = StatisticsBuilder(highlighter)
-    printer = ResultPrinter(out, highlighter)
+    thumbnails = ThumbnailCache(default_cache_dir(xml_path))
+    printer = ResultPrinter(out, highlighter, thumbnails)
+    clusterer = ClashClusterer()
 
     # Дата отчёта
     report_date, date_source = extract_report_datetime(xml_path)
     printer.print_report_date(report_date, date_source)
 
-    # Фильтрация
+    # Фильтрация (элементы загружаются одним проходом по уникальным ID)
+    result_filter.prefetch(groups)
     filtered_groups = {
         test: result_filter.filter_and_annotate(rows)
         for test, rows in groups.items()
@@ -906,10 +1542,35 @@ def main():
     printer.print_summary(filtered_groups, stats)
     printer.print_total(filtered_groups)
 
-    for test_name in sorted(filtered_groups.keys(), key=lambda s: s.lower()):
-        printer.print_group(test_name, filtered_groups[test_name])
+    if RESULT_VIEW == 'paged':
+        entries = []
+        for test_name in sorted(filtered_groups.keys(), key=lambda s: s.lower()):
+            rows = filtered_groups[test_name]
+            clusters = clusterer.build(rows) if CLUSTER_ENABLED else clusterer.singles(rows)
+            for cluster in clusters:
+                entries.append((len(entries) + 1, test_name, cluster))
+        if entries:
+            ClashResultsWindow(entries, thumbnails=thumbnails).ShowDialog()
+            thumbnails.save()
+        return
 
-    printer.print_footer()
+    for test_name in sorted(filtered_groups.keys(), key=lambda s: s.lower()):
+        if CLUSTER_ENABLED:
+            printer.print_clusters(test_name, clusterer.build(filtered_groups[test_name]))
+        else:
+            printer.print_group(test_name, filtered_groups[test_name])
+
+    linked_items = [
+        item for rows in filtered_groups.values() for item in rows
+        if item.get('link') is not None
+    ]
+    printer.print_footer(len(linked_items))
+    thumbnails.save()
+
+    if linked_items and forms.alert(
+            u"Найдено элементов в связях: {}.\nВыделить их в модели?".format(len(linked_items)),
+            title=u"Пересечения", yes=True, no=True):
+        select_clash_rows(linked_items)
 
 
 if __name__ == "__main__":
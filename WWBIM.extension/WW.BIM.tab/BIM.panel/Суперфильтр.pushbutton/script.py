@@ -4,15 +4,33 @@
 from __future__ import print_function, division
 
 import clr
+import math
+import re
+import time
 from collections import OrderedDict, defaultdict
 
 from Autodesk.Revit.DB import (
     FilteredElementCollector, ElementId, StorageType, View,
-    Category, CategoryType, BuiltInCategory, BuiltInParameter, ParameterElement
+    Category, CategoryType, BuiltInCategory, BuiltInParameter, ParameterElement, ElementType,
+    ElementFilter, ElementParameterFilter, LogicalAndFilter, LogicalOrFilter,
+    ParameterValueProvider, FilterStringRule, FilterStringEquals, FilterIntegerRule,
+    FilterDoubleRule, FilterElementIdRule, FilterNumericEquals, FilterInverseRule,
+    FilterNumericGreaterOrEqual, FilterNumericLessOrEqual, FilterStringContains,
+    FilterStringBeginsWith, FilterRule
 )
 from Autodesk.Revit.Exceptions import InvalidOperationException
+from System.Collections.Generic import List
 from pyrevit import revit, script
 
+from superfilter_index import (
+    get_snapshot, OPS, RANGE_OPS, TEXT_OPS, NUMERIC_EPS,
+    parse_range, range_to_internal, in_range, text_matches
+)
+from superfilter_queries import (
+    SavedQuery, ResultCache, SCOPE_MODEL, load_queries, save_queries,
+    resolve_conditions, document_fingerprint
+)
+
 doc = revit.doc
 uidoc = revit.uidoc
 active_view = doc.ActiveView
@@ -79,6 +97,8 @@ _preselected_element = get_preselected_element()
 # ---------------- Helpers ----------------
 OST_CAMERAS_INT = int(BuiltInCategory.OST_Cameras)
 _PROJECT_DEF_NAMES = None  # кэш имён определений параметров проекта
+_PROJECT_DEF_IDS = {}      # имя -> {Id ParameterElement} (общие и параметры проекта)
+_PARAM_DEFS = defaultdict(set)  # имя параметра -> {(Id параметра, StorageType)} по образцам
 
 def ensure_view_supported(view):
     if view is None or view.IsTemplate:
@@ -104,19 +124,20 @@ def _is_camera(el):
         pass
     return False
 
-def _eid_to_disp(eid):
+def _eid_to_disp(eid, document=None):
     if not isinstance(eid, ElementId):
         return _to_unicode(eid)
+    document = document or doc
     # Проверяем категорию
     try:
-        cat = Category.GetCategory(doc, eid)
+        cat = Category.GetCategory(document, eid)
         if cat is not None:
             return _to_unicode(cat.Name)
     except:
         pass
     # Получаем элемент
     try:
-        refel = doc.GetElement(eid)
+        refel = document.GetElement(eid)
         if refel:
             # Для типоразмеров (FamilySymbol) формируем "Семейство: Тип"
             fam_name = None
@@ -139,20 +160,32 @@ def _eid_to_disp(eid):
         pass
     return u'Id:{0}'.format(eid.IntegerValue)
 
-def collect_candidates(only_visible=True):
+def _is_candidate(el):
+    """Элемент модели (не тип и не камера)"""
+    try:
+        if isinstance(el, ElementType) or _is_camera(el):
+            return False
+        cat = el.Category
+        return bool(cat and cat.CategoryType == CategoryType.Model)
+    except:
+        return False
+
+def collect_candidates(only_visible=True, element_filter=None, document=None):
+    document = document or doc
     if only_visible:
-        col = FilteredElementCollector(doc, active_view.Id)
+        col = FilteredElementCollector(document, active_view.Id)
     else:
-        col = FilteredElementCollector(doc)
+        col = FilteredElementCollector(document)
     col = col.WhereElementIsNotElementType()
-    result = []
-    for el in col:
-        if _is_camera(el):
-            continue
-        cat = el.Category
-        if cat and cat.CategoryType == CategoryType.Model:
-            result.append(el)
-    return result
+    if element_filter is not None:
+        col = col.WherePasses(element_filter)
+    return [el for el in col if _is_candidate(el)]
+
+def view_scope_ids(view=None):
+    """Id элементов вида (нативный проход, без чтения элементов)"""
+    view = view or active_view
+    ids = FilteredElementCollector(view.Document, view.Id).WhereElementIsNotElementType().ToElementIds()
+    return set(eid.IntegerValue for eid in ids)
 
 def _is_builtin_param(p):
     try:
@@ -188,6 +221,7 @@ def _ensure_project_def_names():
                 nm = d.Name
                 if nm:
                     names.add(nm)
+                    _PROJECT_DEF_IDS.setdefault(nm, set()).add(pe.Id.IntegerValue)
             except:
                 pass
     except:
@@ -228,8 +262,7 @@ def _include_param(p, include_family):
         return False
     return True
 
-def build_param_index(only_visible=True, include_type=True, include_family=False, sample_per_cat=30):
-    elems = collect_candidates(only_visible)
+def build_param_index(elems, include_type=True, include_family=False, sample_per_cat=30):
     by_cat = defaultdict(list)
     for el in elems:
         try:
@@ -258,6 +291,7 @@ def build_param_index(only_visible=True, include_type=True, include_family=False
                     if not defn:
                         continue
                     pname = defn.Name
+                    _register_param(pname, p)
                     if pname not in param_index:
                         param_index[pname] = p.StorageType
                 if include_type:
@@ -273,6 +307,7 @@ def build_param_index(only_visible=True, include_type=True, include_family=False
                                 if not defn:
                                     continue
                                 pname = defn.Name
+                                _register_param(pname, p)
                                 if pname not in param_index:
                                     param_index[pname] = p.StorageType
     finally:
@@ -281,75 +316,24 @@ def build_param_index(only_visible=True, include_type=True, include_family=False
     names = sorted(param_index.keys(), key=lambda s: s.lower())
     return names, param_index
 
-def collect_values_for_param(pname, storage, only_visible=True, include_type=True, include_family=False):
-    elems = collect_candidates(only_visible)
+def collect_values_for_param(pname, storage, index, include_type=True, scope=None):
+    """Значения параметра для выпадающего списка (из индекса значений)"""
+    col = index.column(pname, include_type)
     values = OrderedDict()
-    has_empty_box = [False]
-
-    def add_p(p):
-        if not _include_param(p, include_family):
-            return
-        st = p.StorageType
-        if st != storage:
-            return
-        try:
-            if st == StorageType.String:
-                sval = p.AsString()
-                if (sval is None) or (sval == u''):
-                    has_empty_box[0] = True
-                else:
-                    if sval not in values:
-                        values[sval] = sval
-            elif st == StorageType.Integer:
-                if not getattr(p, 'HasValue', True):
-                    has_empty_box[0] = True
-                else:
-                    ival = p.AsInteger()
-                    disp = p.AsValueString() if p.AsValueString() else unicode(ival)
-                    if disp not in values:
-                        values[disp] = ival
-            elif st == StorageType.Double:
-                if not getattr(p, 'HasValue', True):
-                    has_empty_box[0] = True
-                else:
-                    dval = p.AsDouble()
-                    disp = p.AsValueString() if p.AsValueString() else unicode(dval)
-                    if disp not in values:
-                        values[disp] = dval
-            elif st == StorageType.ElementId:
-                eid = p.AsElementId()
-                if eid == ElementId.InvalidElementId:
-                    has_empty_box[0] = True
-                else:
-                    disp = _eid_to_disp(eid)
-                    if disp not in values:
-                        values[disp] = eid
-            else:
-                has_empty_box[0] = True
-        except:
-            pass
-
-    out = script.get_output()
-    try:
-        pb = out.create_progress_bar(len(elems), title=u'Собираю значения: {0}'.format(pname))
-    except:
-        pb = None
-
-    try:
-        for el in elems:
-            if pb: pb.update()
-            p = el.LookupParameter(pname)
-            if p: add_p(p)
-            if include_type and (p is None or getattr(p, 'StorageType', None) != storage):
-                try:
-                    typ = doc.GetElement(el.GetTypeId())
-                    if typ:
-                        pt = typ.LookupParameter(pname)
-                        if pt: add_p(pt)
-                except:
-                    pass
-    finally:
-        if pb: pb.close()
+    for key in col.listed:
+        if col.storages.get(key) != storage:
+            continue
+        ids = col.by_value.get(key)
+        if not ids or (scope is not None and ids.isdisjoint(scope)):
+            continue
+        if storage == StorageType.ElementId:
+            raw = ElementId(key)
+            disp = _eid_to_disp(raw)
+        else:
+            raw = key
+            disp = col.display.get(key)
+        if disp not in values:
+            values[disp] = raw
 
     disp_list = list(values.keys())
     try:
@@ -357,19 +341,50 @@ def collect_values_for_param(pname, storage, only_visible=True, include_type=Tru
     except:
         disp_list.sort()
 
-    return disp_list, values, has_empty_box[0]
+    return disp_list, values, bool(col.empty)
+
+_TYPE_CACHE = {}  # Id типа -> элемент типа
+
+def _get_type(elem):
+    tid = elem.GetTypeId()
+    key = tid.IntegerValue
+    if key not in _TYPE_CACHE:
+        _TYPE_CACHE[key] = doc.GetElement(tid) if key != -1 else None
+    return _TYPE_CACHE[key]
 
 def get_param(elem, pname, lookup_in_type=True):
     p = elem.LookupParameter(pname)
     if p is None and lookup_in_type:
         try:
-            et = doc.GetElement(elem.GetTypeId())
+            et = _get_type(elem)
             if et:
                 p = et.LookupParameter(pname)
         except:
             p = None
     return p
 
+def _param_display(p):
+    """Текст значения параметра (как в выпадающем списке)"""
+    st = p.StorageType
+    if st == StorageType.String:
+        val = p.AsString()
+        return _to_unicode(val if val is not None else (p.AsValueString() or u''))
+    if st == StorageType.ElementId:
+        eid = p.AsElementId()
+        return None if eid == ElementId.InvalidElementId else _eid_to_disp(eid)
+    if not getattr(p, 'HasValue', True):
+        return None
+    val = p.AsValueString()
+    if val:
+        return _to_unicode(val)
+    return _to_unicode(p.AsInteger() if st == StorageType.Integer else p.AsDouble())
+
+def _key_display(key, storage, document=None):
+    """Текст ключа индекса, который колонка не хранит (ElementId)"""
+    if storage == StorageType.ElementId:
+        return _eid_to_disp(ElementId(key), document)
+    return None
+
 def match_condition(elem, pname, op, raw_value, lookup_in_type):
     p = get_param(elem, pname, lookup_in_type)
     if op == u'пусто':
@@ -382,6 +397,16 @@ def match_condition(elem, pname, op, raw_value, lookup_in_type):
 
     st = p.StorageType
     try:
+        if op in RANGE_OPS:
+            if not raw_value or not getattr(p, 'HasValue', True):
+                return False
+            if st == StorageType.Integer:
+                return in_range(int(p.AsInteger()), raw_value)
+            if st == StorageType.Double:
+                return in_range(float(p.AsDouble()), raw_value)
+            return False
+        if op in TEXT_OPS:
+            return text_matches(op, _param_display(p), raw_value)
         if st == StorageType.String:
             left = p.AsString()
             if left is None:
@@ -406,15 +431,251 @@ def match_condition(elem, pname, op, raw_value, lookup_in_type):
         return False
     return False
 
+def matches_conditions(elem, conditions, lookup_in_type, use_or):
+    """Проверка элемента по всем условиям в Python (с ранним выходом)"""
+    for (pname, op, raw) in conditions:
+        ok = match_condition(elem, pname, op, raw, lookup_in_type)
+        if use_or and ok:
+            return True
+        if (not use_or) and (not ok):
+            return False
+    return not use_or
+
+# ---------------- Нативные фильтры Revit ----------------
+# Условия, которые выражаются правилами ElementParameterFilter, проверяются
+# внутри коллектора. Правила строятся как надмножество условия (строки без
+# учёта регистра, числа с допуском), поэтому прошедшие элементы всё равно
+# перепроверяются в Python — но только они, а не вся модель.
+NATIVE_DOUBLE_EPS = NUMERIC_EPS
+NATIVE_MAX_TYPES = 500      # больше типов — дешевле проверить условие в Python
+
+def _register_param(pname, p):
+    try:
+        _PARAM_DEFS[pname].add((p.Id.IntegerValue, p.StorageType))
+    except:
+        pass
+
+def _native_param(pname):
+    """(ElementId параметра, StorageType), если определение однозначно во всём документе.
+
+    Образцы индекса видят не все семейства, поэтому Id с образцов
+    принимается, только если его подтверждает документ: встроенный
+    параметр без одноимённых ParameterElement или единственный общий /
+    проектный ParameterElement с этим именем. Иначе (параметры семейств,
+    одноимённые определения) — None, условие проверяется в Python.
+    """
+    defs = _PARAM_DEFS.get(pname)
+    if not defs or len(defs) != 1:
+        return None
+    pid, storage = list(defs)[0]
+    if pid == -1:
+        return None
+    _ensure_project_def_names()
+    doc_ids = _PROJECT_DEF_IDS.get(pname, set())
+    if pid < 0:
+        if doc_ids:
+            return None
+    elif doc_ids != set([pid]):
+        return None
+    return ElementId(pid), storage
+
+def _string_rule(provider, evaluator, value):
+    try:
+        return FilterStringRule(provider, evaluator, value)
+    except TypeError:
+        # Revit 2020-2021: только конструктор с caseSensitive
+        return FilterStringRule(provider, evaluator, value, False)
+
+def _range_rules(provider, storage, rng):
+    """Правила диапазона (с запасом: границы включительно и с допуском)"""
+    lo, hi, strict = rng
+    rules = []
+    if storage == StorageType.Double:
+        if lo is not None:
+            rules.append(FilterDoubleRule(provider, FilterNumericGreaterOrEqual(), float(lo), NATIVE_DOUBLE_EPS))
+        if hi is not None:
+            rules.append(FilterDoubleRule(provider, FilterNumericLessOrEqual(), float(hi), NATIVE_DOUBLE_EPS))
+    elif storage == StorageType.Integer:
+        if lo is not None:
+            rules.append(FilterIntegerRule(provider, FilterNumericGreaterOrEqual(), int(math.floor(lo))))
+        if hi is not None:
+            rules.append(FilterIntegerRule(provider, FilterNumericLessOrEqual(), int(math.ceil(hi))))
+    return rules or None
+
+def _make_rules(pid, storage, op, raw):
+    """Список правил (объединяются по И) или None"""
+    provider = ParameterValueProvider(pid)
+    if op in RANGE_OPS:
+        return _range_rules(provider, storage, raw) if raw else None
+    if op in (u'содержит', u'начинается с'):
+        if storage != StorageType.String or not raw:
+            return None
+        evaluator = FilterStringContains() if op == u'содержит' else FilterStringBeginsWith()
+        return [_string_rule(provider, evaluator, _to_unicode(raw))]
+    if op not in (u'=', u'!='):
+        return None
+    if storage == StorageType.String:
+        # Сравнение строк в Revit без учёта регистра: '!=' не было бы надмножеством
+        if op != u'=' or not raw:
+            return None
+        return [_string_rule(provider, FilterStringEquals(), _to_unicode(raw))]
+    if storage == StorageType.Integer:
+        rule = FilterIntegerRule(provider, FilterNumericEquals(), int(raw))
+    elif storage == StorageType.Double:
+        rule = FilterDoubleRule(provider, FilterNumericEquals(), float(raw), NATIVE_DOUBLE_EPS)
+    elif storage == StorageType.ElementId:
+        if not isinstance(raw, ElementId):
+            return None
+        rule = FilterElementIdRule(provider, FilterNumericEquals(), raw)
+    else:
+        return None
+    if op == u'!=':
+        rule = FilterInverseRule(rule)
+    return [rule]
+
+def _or_filter(filters):
+    if len(filters) == 1:
+        return filters[0]
+    return LogicalOrFilter(List[ElementFilter](filters))
+
+def _condition_filter(cond, lookup_in_type):
+    """Нативный фильтр одного условия или None"""
+    pname, op, raw = cond
+    native = _native_param(pname)
+    if native is None:
+        return None
+    try:
+        rules = _make_rules(native[0], native[1], op, raw)
+        if not rules:
+            return None
+        inst_filter = ElementParameterFilter(List[FilterRule](rules))
+        if not lookup_in_type:
+            return inst_filter
+        # Параметр может быть у типа: экземпляры прошедших правило типов
+        type_ids = FilteredElementCollector(doc).WhereElementIsElementType()\
+                                                .WherePasses(inst_filter).ToElementIds()
+        if type_ids.Count > NATIVE_MAX_TYPES:
+            return None
+        type_provider = ParameterValueProvider(ElementId(BuiltInParameter.ELEM_TYPE_PARAM))
+        filters = [inst_filter]
+        for tid in type_ids:
+            filters.append(ElementParameterFilter(
+                FilterElementIdRule(type_provider, FilterNumericEquals(), tid)))
+        return _or_filter(filters)
+    except:
+        return None
+
+def compile_native_filter(conditions, lookup_in_type, use_or):
+    """Дерево И/ИЛИ из нативных фильтров (надмножество результата) или None"""
+    parts = []
+    for cond in conditions:
+        f = _condition_filter(cond, lookup_in_type)
+        if f is None:
+            if use_or:
+                # Ветку ИЛИ, не выразимую нативно, коллектор отбросил бы
+                return None
+            continue
+        parts.append(f)
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    if use_or:
+        return _or_filter(parts)
+    return LogicalAndFilter(List[ElementFilter](parts))
+
+def collect_matching(conditions, only_visible, lookup_in_type, use_or, limit=None, title=None):
+    """Элементы, подходящие под условия: нативный отбор + проверка в Python"""
+    elems = collect_candidates(only_visible, compile_native_filter(conditions, lookup_in_type, use_or))
+    matched = []
+    out = script.get_output()
+    try:
+        pb = out.create_progress_bar(len(elems), title=title or u'Фильтрую элементы...')
+    except:
+        pb = None
+    try:
+        for el in elems:
+            if pb: pb.update()
+            if matches_conditions(el, conditions, lookup_in_type, use_or):
+                matched.append(el)
+                if limit and len(matched) >= limit:
+                    break
+    finally:
+        if pb: pb.close()
+    return matched
+
+# ---------------- Сохранённые запросы ----------------
+def run_query(document, query, view=None, cache=None):
+    """Id элементов по сохранённому запросу: (список Id, взят ли из кэша).
+
+    view=None — вся модель. Результат берётся из кэша, если документ не
+    менялся с прошлого выполнения; иначе считается по индексу документа.
+    """
+    key = SCOPE_MODEL if view is None else u'view:{0}'.format(view.Id.IntegerValue)
+    fingerprint = document_fingerprint(document)
+    if cache is not None:
+        ids = cache.get(document, query, key, fingerprint)
+        if ids is not None:
+            return ids, True
+
+    display = lambda k, st: _key_display(k, st, document)
+    snapshot = get_snapshot(document, lambda: collect_candidates(False, document=document), _is_candidate)
+    conditions = resolve_conditions(snapshot.index, query.rows, display)
+    ids = []
+    if conditions:
+        scope = view_scope_ids(view) if view is not None else None
+        ids = sorted(snapshot.index.matching_ids(conditions, query.use_or, True, scope, display))
+    if cache is not None:
+        cache.put(document, query, key, fingerprint, ids)
+    return ids, False
+
+def run_batch():
+    """Выполнение набора запросов по всем открытым проектам (вся модель)"""
+    from pyrevit import forms
+    queries = load_queries()
+    if not queries:
+        forms.alert(u'Нет сохранённых запросов.', title=u'Суперфильтр')
+        return
+    names = forms.SelectFromList.show(list(queries.keys()), title=u'Запросы для пакетного выполнения',
+                                      multiselect=True, button_name=u'Выполнить')
+    if not names:
+        return
+    docs = [d for d in doc.Application.Documents if not d.IsLinked and not d.IsFamilyDocument]
+
+    out = script.get_output()
+    cache = ResultCache()
+    table = []
+    try:
+        pb = out.create_progress_bar(len(docs) * len(names), title=u'Выполняю запросы...')
+    except:
+        pb = None
+    try:
+        for d in docs:
+            for name in names:
+                if pb: pb.update()
+                started = time.time()
+                try:
+                    ids, cached = run_query(d, queries[name], None, cache)
+                except Exception as ex:
+                    table.append([d.Title, name, u'—', u'ошибка: {0}'.format(ex)])
+                    continue
+                source = u'кэш' if cached else u'{0:.1f} с'.format(time.time() - started)
+                table.append([d.Title, name, len(ids), source])
+    finally:
+        if pb: pb.close()
+        cache.save()
+    out.print_table(table, [u'Документ', u'Запрос', u'Элементов', u'Источник'],
+                    title=u'Суперфильтр: пакетное выполнение')
+
 # ---------------- WinForms UI ----------------
 clr.AddReference('System.Windows.Forms')
 clr.AddReference('System.Drawing')
 from System.Windows.Forms import (Form, Label, ComboBox, CheckBox, Button, DialogResult,
                                  FormBorderStyle, ComboBoxStyle, AutoCompleteMode, AutoCompleteSource,
-                                 Panel, BorderStyle, FlatStyle, GroupBox, AnchorStyles, FormStartPosition)
+                                 Panel, BorderStyle, FlatStyle, GroupBox, AnchorStyles, FormStartPosition,
+                                 Timer)
 from System.Drawing import Size, Point, Color, Font, FontStyle, ContentAlignment
 
-OPS = [u'=', u'!=', u'пусто', u'не пусто']
 
 # Цвета в стиле референса
 COLOR_ACCENT_BLUE = Color.FromArgb(0, 122, 204)      # Голубой акцент
@@ -424,6 +685,19 @@ COLOR_BTN_SECONDARY = Color.FromArgb(96, 125, 139)   # Серо-голубой 
 COLOR_HEADER_BG = Color.FromArgb(245, 245, 245)      # Светлый фон заголовков
 COLOR_ROW_ALT = Color.FromArgb(250, 250, 255)        # Альтернативный цвет строки
 
+# Операторы со значением, вводимым вручную
+FREE_TEXT_OPS = RANGE_OPS + TEXT_OPS
+INFO_DEFAULT = u'Выберите параметры и значения для фильтрации элементов на виде.'
+INFO_RANGE = u'Число в единицах проекта; для «между» — две границы: 50..110 или 50-110.'
+INFO_TEXT = u'Текст без учёта регистра; для «рег. выражение» — шаблон Python (re).'
+
+# Фоновый подсчёт: Revit API однопоточный, поэтому подсчёт идёт порциями
+# по таймеру WinForms в потоке окна и не блокирует его между порциями
+COUNT_DEBOUNCE_SEC = 0.25   # пауза после последнего изменения условий
+COUNT_SLICE_SEC = 0.04      # время одной порции
+COUNT_CHUNK = 1000          # элементов в шаге построения колонок
+COUNT_REPORT_EVERY = 20000  # как часто (в элементах) показывать промежуточный итог
+
 class FilterForm(Form):
     def __init__(self):
         self.Text = u'Суперфильтр'
@@ -495,6 +769,24 @@ class FilterForm(Form):
         self.btnLoadFamily.Click += self._on_load_family
         self.pnlHeader.Controls.Add(self.btnLoadFamily)
 
+        self.lblQuery = Label()
+        self.lblQuery.Text = u'Запрос:'
+        self.lblQuery.Location = Point(285, y+5)
+        self.lblQuery.Size = Size(55, 18)
+        self.lblQuery.Font = Font(self.Font.FontFamily, 9, FontStyle.Bold)
+        self.pnlHeader.Controls.Add(self.lblQuery)
+
+        self.cmbQuery = ComboBox()
+        self.cmbQuery.DropDownStyle = ComboBoxStyle.DropDownList
+        self.cmbQuery.Location = Point(345, y+2)
+        self.cmbQuery.Size = Size(200, 24)
+        self.cmbQuery.SelectedIndexChanged += self._on_query_selected
+        self.pnlHeader.Controls.Add(self.cmbQuery)
+
+        self.btnSaveQuery = self._header_button(u'Сохранить', 555, y, self._on_save_query)
+        self.btnRunQuery = self._header_button(u'Выполнить', 660, y, self._on_run_query)
+        self.btnBatch = self._header_button(u'Пакет…', 765, y, self._on_batch)
+
         # Группа условий фильтрации
         y = 90
         self.grpConditions = GroupBox()
@@ -571,7 +863,7 @@ class FilterForm(Form):
         self.pnlBottom.Controls.Add(self.lblCount)
 
         self.lblInfo = Label()
-        self.lblInfo.Text = u'Выберите параметры и значения для фильтрации элементов на виде.'
+        self.lblInfo.Text = INFO_DEFAULT
         self.lblInfo.Location = Point(15, 45)
         self.lblInfo.Size = Size(600, 20)
         self.lblInfo.ForeColor = Color.Gray
@@ -604,13 +896,38 @@ class FilterForm(Form):
         self.include_family = False
         self.param_names = []
         self.param_index = {}
+        self.index = None
+        self.scope = None
         self.values_cache = {}
         self.values_loaded = set()
         self.last_count = 0  # Последнее посчитанное количество
         self.last_conditions = []  # Последние условия для подсчёта
 
+        self._filling = False         # заполнение списка запросов без реакции на выбор
+        self._count_job = None        # генератор текущего подсчёта
+        self._count_not_before = 0.0
+        self._count_timer = Timer()
+        self._count_timer.Interval = 15
+        self._count_timer.Tick += self._on_count_tick
+        self.FormClosed += self._on_form_closed
+
         self._rebuild_index()
         self._prefill_from_selection()  # Предзаполнение из выделенного элемента
+        self.queries = load_queries()
+        self._refresh_queries()
+
+    def _header_button(self, text, x, y, handler):
+        btn = Button()
+        btn.Text = text
+        btn.Location = Point(x, y)
+        btn.Size = Size(100, 28)
+        btn.FlatStyle = FlatStyle.Flat
+        btn.BackColor = COLOR_BTN_SECONDARY
+        btn.ForeColor = Color.White
+        btn.FlatAppearance.BorderSize = 0
+        btn.Click += handler
+        self.pnlHeader.Controls.Add(btn)
+        return btn
 
     def _add_row(self, idx, y):
         # Панель строки с чередующимся фоном
@@ -662,6 +979,7 @@ class FilterForm(Form):
         cmbV.Font = Font(self.Font.FontFamily, 9, FontStyle.Regular)
         cmbV.DropDown += self._on_value_dropdown
         cmbV.SelectedIndexChanged += self._on_value_changed
+        cmbV.TextChanged += self._on_value_text_changed
         cmbV.Tag = idx-1
         rowPanel.Controls.Add(cmbV)
 
@@ -676,11 +994,19 @@ class FilterForm(Form):
         self._rebuild_index()
 
     def _rebuild_index(self):
+        self._cancel_count()
         self.values_cache.clear()
         self.values_loaded.clear()
         only_vis = bool(self.cbOnlyVis.Checked)
         include_types = bool(self.cbIncludeTypes.Checked)
-        names, pindex = build_param_index(only_vis, include_types, self.include_family, sample_per_cat=20)
+        include_family = self.include_family
+        # Снимок всей модели живёт между запусками; вид — лишь маска Id
+        snapshot = get_snapshot(doc, lambda: collect_candidates(False), _is_candidate)
+        self.index = snapshot.index
+        self.index.set_include(lambda p: _include_param(p, include_family), include_family)
+        self.scope = view_scope_ids() if only_vis else None
+        names, pindex = build_param_index(self.index.elements(self.scope), include_types,
+                                          include_family, sample_per_cat=20)
         self.param_names = names
         self.param_index = pindex
 
@@ -740,13 +1066,12 @@ class FilterForm(Form):
             return
         if pname in self.values_loaded:
             return
-        only_vis = bool(self.cbOnlyVis.Checked)
         include_types = bool(self.cbIncludeTypes.Checked)
         storage = self.param_index.get(pname, None)
         if storage is None:
             return
         disp_list, mapping, has_empty = collect_values_for_param(
-            pname, storage, only_vis, include_types, self.include_family
+            pname, storage, self.index, include_types, self.scope
         )
         self.values_cache[pname] = {'disp_list': disp_list, 'map': mapping, 'has_empty': has_empty}
         self.values_loaded.add(pname)
@@ -772,13 +1097,12 @@ class FilterForm(Form):
             return
         if pname in self.values_loaded:
             return
-        only_vis = bool(self.cbOnlyVis.Checked)
         include_types = bool(self.cbIncludeTypes.Checked)
         storage = self.param_index.get(pname, None)
         if storage is None:
             return
         disp_list, mapping, has_empty = collect_values_for_param(
-            pname, storage, only_vis, include_types, self.include_family
+            pname, storage, self.index, include_types, self.scope
         )
         self.values_cache[pname] = {'disp_list': disp_list, 'map': mapping, 'has_empty': has_empty}
         self.values_loaded.add(pname)
@@ -793,23 +1117,103 @@ class FilterForm(Form):
 
     def _on_value_changed(self, sender, args):
         """Callback при изменении значения - автоподсчёт"""
+        row = int(sender.Tag)
+        if _to_unicode(self.rows[row][1].Text) in FREE_TEXT_OPS:
+            return  # подсчёт сделает _on_value_text_changed
         self._update_count()
 
+    def _on_value_text_changed(self, sender, args):
+        """Ручной ввод значения для диапазонов и текстовых условий"""
+        row = int(sender.Tag)
+        if _to_unicode(self.rows[row][1].Text) in FREE_TEXT_OPS:
+            self._update_count()
+
     def _update_count(self):
-        """Автоматический подсчёт элементов при изменении условий"""
+        """Запуск подсчёта при изменении условий (предыдущий подсчёт отменяется)"""
         conds = self._get_conditions()
         if not conds:
+            self._cancel_count()
             self.lblCount.Text = u''
             return
-        
-        only_vis = bool(self.cbOnlyVis.Checked)
+
         lookup_in_type = True
         use_or = (_to_unicode(self.cmbLogic.Text) == u'ИЛИ')
-        
-        count = self._count_matches(conds, only_vis, lookup_in_type, use_or)
+
+        self._count_job = self._count_steps(conds, lookup_in_type, use_or)
+        self._count_not_before = time.time() + COUNT_DEBOUNCE_SEC
+        self.lblCount.Text = u'Подсчёт…'
+        self.lblCount.ForeColor = Color.Gray
+        self._count_timer.Start()
+
+    def _cancel_count(self):
+        self._count_job = None
+        self._count_timer.Stop()
+
+    def _count_steps(self, conditions, lookup_in_type, use_or):
+        """Генератор подсчёта: (доля готовности, промежуточное число или None).
+
+        Колонки индекса достраиваются порциями; прерванная достройка
+        продолжается при следующем подсчёте. Последний шаг — (1.0, итог).
+        """
+        index = self.index
+        names = []
+        for (pname, op, raw) in conditions:
+            if pname not in names:
+                names.append(pname)
+        order = index.element_order()
+        total = float(len(order) or 1)
+        processed = set()
+        done = reported = 0
+        for pos in index.build_steps(names, lookup_in_type, COUNT_CHUNK):
+            processed.update(order[done:pos])
+            done = pos
+            partial = None
+            if pos - reported >= COUNT_REPORT_EVERY:
+                reported = pos
+                scope = processed if self.scope is None else (processed & self.scope)
+                partial = len(index.matching_ids(conditions, use_or, lookup_in_type, scope,
+                                                 _key_display, partial=True))
+            yield pos / total, partial
+        count = len(index.matching_ids(conditions, use_or, lookup_in_type, self.scope, _key_display))
+        self.last_conditions = conditions
+        yield 1.0, count
+
+    def _on_count_tick(self, sender, args):
+        job = self._count_job
+        if job is None:
+            self._count_timer.Stop()
+            return
+        if time.time() < self._count_not_before:
+            return
+        deadline = time.time() + COUNT_SLICE_SEC
+        progress, partial = 0.0, None
+        try:
+            while True:
+                progress, count = next(job)
+                if count is not None:
+                    partial = count
+                if progress >= 1.0 or time.time() >= deadline:
+                    break
+        except StopIteration:
+            self._cancel_count()
+            return
+        except Exception as ex:
+            self._cancel_count()
+            self.lblCount.Text = u'Ошибка подсчёта: {0}'.format(ex)
+            self.lblCount.ForeColor = COLOR_ACCENT_PINK
+            return
+
+        if progress >= 1.0:
+            self._cancel_count()
+            self._show_count(partial)
+        else:
+            text = u'Подсчёт… {0:.0%}'.format(progress)
+            if partial is not None:
+                text += u' — пока найдено: {0}'.format(partial)
+            self.lblCount.Text = text
+
+    def _show_count(self, count):
         self.last_count = count
-        self.last_conditions = conds
-        
         if count == 0:
             self.lblCount.Text = u'Элементов не найдено'
             self.lblCount.ForeColor = Color.Gray
@@ -817,11 +1221,45 @@ class FilterForm(Form):
             self.lblCount.Text = u'Будет выбрано элементов: {0}'.format(count)
             self.lblCount.ForeColor = COLOR_ACCENT_BLUE
 
+    def _on_form_closed(self, sender, args):
+        self._cancel_count()
+        self._count_timer.Dispose()
+
     def _sync_value_enabled(self, row):
         cmbP, cmbO, cmbV = self.rows[row]
         op = _to_unicode(cmbO.Text)
         need_val = op not in (u'пусто', u'не пусто')
         cmbV.Enabled = need_val
+        style = ComboBoxStyle.DropDown if op in FREE_TEXT_OPS else ComboBoxStyle.DropDownList
+        if cmbV.DropDownStyle != style:
+            cmbV.DropDownStyle = style
+            cmbV.SelectedIndex = -1
+        if op in RANGE_OPS:
+            self.lblInfo.Text = INFO_RANGE
+        elif op in TEXT_OPS:
+            self.lblInfo.Text = INFO_TEXT
+        else:
+            self.lblInfo.Text = INFO_DEFAULT
+
+    def _parse_free_value(self, pname, op, text):
+        """Значение условия, введённое вручную, или None, если оно некорректно"""
+        if not text:
+            return None
+        if op in TEXT_OPS:
+            if op == u'рег. выражение':
+                try:
+                    re.compile(text)
+                except re.error:
+                    return None
+            return text
+        storage = self.param_index.get(pname, None)
+        rng = parse_range(op, text)
+        if rng is None or storage not in (StorageType.Integer, StorageType.Double):
+            return None
+        if storage == StorageType.Double:
+            # Ввод в единицах проекта -> внутренние единицы параметра
+            rng = range_to_internal(rng, self.index.column_unit(pname, True))
+        return rng
 
     def _get_conditions(self):
         """Получить список условий из формы"""
@@ -833,6 +1271,10 @@ class FilterForm(Form):
                 continue
             if op in (u'пусто', u'не пусто'):
                 raw = None
+            elif op in FREE_TEXT_OPS:
+                raw = self._parse_free_value(pname, op, _to_unicode(cmbV.Text).strip())
+                if raw is None:
+                    continue
             else:
                 disp = _to_unicode(cmbV.Text)
                 if disp == u'' or disp is None:
@@ -840,10 +1282,9 @@ class FilterForm(Form):
                 cache = self.values_cache.get(pname)
                 if cache is None:
                     storage = self.param_index.get(pname, None)
-                    only_vis = bool(self.cbOnlyVis.Checked)
                     include_types = bool(self.cbIncludeTypes.Checked)
                     disp_list, mapping, has_empty = collect_values_for_param(
-                        pname, storage, only_vis, include_types, self.include_family
+                        pname, storage, self.index, include_types, self.scope
                     )
                     cache = {'disp_list': disp_list, 'map': mapping, 'has_empty': has_empty}
                     self.values_cache[pname] = cache
@@ -851,34 +1292,100 @@ class FilterForm(Form):
             conds.append((pname, op, raw))
         return conds
 
-    def _count_matches(self, conditions, only_vis, lookup_in_type, use_or):
-        """Подсчитать количество подходящих элементов"""
-        elems = collect_candidates(only_vis)
-        count = 0
-        out = script.get_output()
-        try:
-            pb = out.create_progress_bar(len(elems), title=u'Подсчёт элементов...')
-        except:
-            pb = None
+    def _refresh_queries(self, select=None):
+        self._filling = True
         try:
-            for el in elems:
-                if pb: pb.update()
-                if _is_camera(el):
-                    continue
-                flags = []
-                for (pname, op, raw) in conditions:
-                    ok = match_condition(el, pname, op, raw, lookup_in_type)
-                    flags.append(ok)
-                    if use_or and ok:
-                        break
-                    if (not use_or) and (not ok):
-                        break
-                res = any(flags) if use_or else all(flags)
-                if res:
-                    count += 1
+            self.cmbQuery.Items.Clear()
+            for name in self.queries:
+                self.cmbQuery.Items.Add(name)
+            if select in self.queries:
+                self.cmbQuery.SelectedItem = select
         finally:
-            if pb: pb.close()
-        return count
+            self._filling = False
+        self.btnRunQuery.Enabled = self.cmbQuery.SelectedIndex >= 0
+
+    def _selected_query(self):
+        if self.cmbQuery.SelectedIndex < 0:
+            return None
+        return self.queries.get(_to_unicode(self.cmbQuery.SelectedItem))
+
+    def _on_query_selected(self, sender, args):
+        """Заполнение строк условий из сохранённого запроса"""
+        query = self._selected_query()
+        self.btnRunQuery.Enabled = query is not None
+        if query is None or self._filling:
+            return
+        # Область меняем первой: её смена перестраивает индекс и очищает строки
+        if bool(self.cbOnlyVis.Checked) != query.only_visible:
+            self.cbOnlyVis.Checked = query.only_visible
+        self.cmbLogic.SelectedItem = query.logic if query.logic in (u'ИЛИ', u'И') else u'ИЛИ'
+        for i, (cmbP, cmbO, cmbV) in enumerate(self.rows):
+            pname, op, text = query.rows[i] if i < len(query.rows) else (u'', OPS[0], u'')
+            cmbP.Text = pname
+            if not pname:
+                cmbP.SelectedIndex = -1
+                cmbV.Items.Clear()
+            cmbO.SelectedItem = op if op in OPS else OPS[0]
+            self._sync_value_enabled(i)
+            if op in FREE_TEXT_OPS:
+                cmbV.Text = text
+            elif pname and text:
+                self._load_values_for_row(i)
+                cmbV.SelectedIndex = -1
+                for j in range(cmbV.Items.Count):
+                    if _to_unicode(cmbV.Items[j]) == text:
+                        cmbV.SelectedIndex = j
+                        break
+        self._update_count()
+
+    def _row_texts(self):
+        """Строки условий в виде (параметр, оператор, текст значения)"""
+        rows = []
+        for cmbP, cmbO, cmbV in self.rows:
+            pname = _to_unicode(cmbP.Text).strip()
+            op = _to_unicode(cmbO.Text).strip()
+            text = u'' if op in (u'пусто', u'не пусто') else _to_unicode(cmbV.Text).strip()
+            if pname and (text or op in (u'пусто', u'не пусто')):
+                rows.append((pname, op, text))
+        return rows
+
+    def _on_save_query(self, sender, args):
+        from pyrevit import forms
+        rows = self._row_texts()
+        if not rows:
+            forms.alert(u'Не выбрано ни одного условия.', title=u'Суперфильтр')
+            return
+        current = self._selected_query()
+        name = forms.ask_for_string(default=current.name if current else u'',
+                                    prompt=u'Имя запроса:', title=u'Суперфильтр')
+        name = _to_unicode(name or u'').strip()
+        if not name:
+            return
+        if name in self.queries and (current is None or current.name != name):
+            if not forms.alert(u'Запрос «{0}» уже есть. Заменить?'.format(name),
+                               title=u'Суперфильтр', yes=True, no=True):
+                return
+        self.queries[name] = SavedQuery(name, rows, _to_unicode(self.cmbLogic.Text),
+                                        bool(self.cbOnlyVis.Checked))
+        try:
+            save_queries(self.queries)
+        except Exception as ex:
+            forms.alert(u'Не удалось сохранить запросы:\n{0}'.format(ex), title=u'Суперфильтр')
+            return
+        self._refresh_queries(select=name)
+
+    def _on_run_query(self, sender, args):
+        query = self._selected_query()
+        if query is None:
+            return
+        self.values = {'query': query}
+        self.DialogResult = DialogResult.OK
+        self.Close()
+
+    def _on_batch(self, sender, args):
+        self.values = {'batch': True}
+        self.DialogResult = DialogResult.OK
+        self.Close()
 
     def _on_select_5(self, sender, args):
         """Обработчик кнопки выбора 5 элементов"""
@@ -924,50 +1431,32 @@ def main():
         return
     ui = frm.values
 
-    conditions = ui['conditions']
-    only_vis = ui['onlyvis']
-    lookup_in_type = ui['search_types']
-    use_or = (ui['logic'] == u'ИЛИ')
-    limit = ui.get('limit', None)
-
-    elems = collect_candidates(only_vis)
-    matched_ids = []
-
-    out = script.get_output()
-    try:
-        pb = out.create_progress_bar(len(elems), title=u'Фильтрую элементы...')
-    except:
-        pb = None
+    if ui.get('batch'):
+        run_batch()
+        return
 
-    try:
-        for el in elems:
-            if pb: pb.update()
-            if _is_camera(el):
-                continue
-            flags = []
-            for (pname, op, raw) in conditions:
-                ok = match_condition(el, pname, op, raw, lookup_in_type)
-                flags.append(ok)
-                if use_or and ok:
-                    break
-                if (not use_or) and (not ok):
-                    break
-            res = any(flags) if use_or else all(flags)
-            if res:
-                matched_ids.append(el.Id)
-                # Если установлен лимит и достигнут - прерываем поиск
-                if limit and len(matched_ids) >= limit:
-                    break
-    finally:
-        if pb: pb.close()
+    limit = None
+    cached = False
+    query = ui.get('query')
+    if query is not None:
+        cache = ResultCache()
+        ids, cached = run_query(doc, query, active_view if query.only_visible else None, cache)
+        cache.save()
+        matched_ids = [ElementId(i) for i in ids]
+    else:
+        conditions = ui['conditions']
+        only_vis = ui['onlyvis']
+        lookup_in_type = ui['search_types']
+        use_or = (ui['logic'] == u'ИЛИ')
+        limit = ui.get('limit', None)
+        matched_ids = [el.Id for el in collect_matching(conditions, only_vis, lookup_in_type, use_or, limit)]
 
     if not matched_ids:
         from pyrevit import forms
         forms.alert(u'Элементы не найдены по выбранным условиям.', title=u'Суперфильтр')
         return
 
-    from System.Collections.Generic import List as CsList
-    sel_ids = CsList[ElementId](matched_ids)
+    sel_ids = List[ElementId](matched_ids)
     uidoc.Selection.SetElementIds(sel_ids)
     try:
         uidoc.ShowElements(sel_ids)
@@ -978,6 +1467,8 @@ def main():
     msg = u'Найдено и выбрано элементов: {0}'.format(len(matched_ids))
     if limit:
         msg += u' (ограничение: {0})'.format(limit)
+    if cached:
+        msg += u'\nРезультат из кэша: модель не менялась с прошлого выполнения.'
     forms.alert(msg, title=u'Суперфильтр', warn_icon=False)
 
 if __name__ == '__main__':
@@ -26,14 +26,14 @@ doc = uidoc.Document
 output = script.get_output()
 
 
-def get_target_element():
-    """Возвращает элемент: либо заранее выбранный, либо выбранный пользователем."""
+def get_target_elements():
+    """Возвращает элементы: заранее выбранные или один, выбранный пользователем."""
     sel_ids = uidoc.Selection.GetElementIds()
-    if sel_ids and sel_ids.Count == 1:
-        elem_id = list(sel_ids)[0]
-        elem = doc.GetElement(elem_id)
-        if elem is not None:
-            return elem
+    if sel_ids and sel_ids.Count > 0:
+        elems = [doc.GetElement(eid) for eid in sel_ids]
+        elems = [e for e in elems if e is not None]
+        if elems:
+            return elems
 
     try:
         ref = uidoc.Selection.PickObject(
@@ -41,11 +41,13 @@ def get_target_element():
             "Выберите элемент для проверки на видах"
         )
         if ref:
-            return doc.GetElement(ref.ElementId)
+            elem = doc.GetElement(ref.ElementId)
+            if elem is not None:
+                return [elem]
     except:
-        return None
+        return []
 
-    return None
+    return []
 
 
 def build_view_sheet_map():
@@ -76,102 +78,114 @@ def build_view_sheet_map():
     return result
 
 
-def has_tag_for_element(view, element_id):
-    """Проверяет, есть ли на виде хоть одна марка, ссылающаяся на элемент."""
-    try:
-        tag_collector = FilteredElementCollector(doc, view.Id).OfClass(IndependentTag)
-    except:
-        return False
-
-    for tag in tag_collector:
-        # Основной способ: GetTaggedElementIds (Revit 2020+)
-        try:
-            link_ids = tag.GetTaggedElementIds()
-        except:
-            link_ids = None
-
-        if link_ids:
-            for link_id in link_ids:
-                try:
-                    host_id = link_id.HostElementId
-                except:
-                    host_id = ElementId.InvalidElementId
-                if host_id == element_id:
-                    return True
-
-        # Запасной вариант: свойство TaggedElementId (на случай старых версий)
+class AnnotationIndex(object):
+    """
+    Обратный индекс аннотаций документа: Id элемента -> виды-владельцы его
+    марок, размеров и высотных отметок. Строится одним проходом по каждому
+    классу аннотаций вместо коллектора на каждый вид; хранятся только
+    ссылки на проверяемые элементы.
+    """
+    def __init__(self, target_ids):
+        self.targets = set(target_ids)
+        self.tags = {}        # Id элемента -> set(Id вида)
+        self.dimensions = {}
+        self.spots = {}
+        self._index_tags()
+        self._index_references(Dimension, self.dimensions)
+        self._index_references(SpotDimension, self.spots)
+
+    def _add(self, mapping, host_id, owner_id):
+        key = host_id.IntegerValue
+        if key in self.targets:
+            mapping.setdefault(key, set()).add(owner_id)
+
+    def _index_tags(self):
         try:
-            link_id = tag.TaggedElementId  # type: LinkElementId
-            if link_id is not None:
-                host_id = link_id.HostElementId
-                if host_id == element_id:
-                    return True
+            tags = FilteredElementCollector(doc).OfClass(IndependentTag)
         except:
-            pass
-
-    return False
-
+            return
+        for tag in tags:
+            try:
+                owner_id = tag.OwnerViewId.IntegerValue
+            except:
+                continue
 
-def has_dimension_for_element(view, element_id):
-    """Проверяет, есть ли на виде хоть один размер, ссылающийся на элемент."""
-    try:
-        dim_collector = FilteredElementCollector(doc, view.Id).OfClass(Dimension)
-    except:
-        return False
+            # Основной способ: GetTaggedElementIds (Revit 2020+)
+            try:
+                link_ids = tag.GetTaggedElementIds()
+            except:
+                link_ids = None
 
-    for dim in dim_collector:
-        try:
-            # Получаем References размера
-            refs = dim.References
-            if refs:
-                for ref in refs:
+            if link_ids:
+                for link_id in link_ids:
                     try:
-                        # Reference может ссылаться на элемент напрямую
-                        ref_elem_id = ref.ElementId
-                        if ref_elem_id == element_id:
-                            return True
+                        self._add(self.tags, link_id.HostElementId, owner_id)
                     except:
                         pass
-        except:
-            pass
-
-    return False
 
+            # Запасной вариант: свойство TaggedElementId (на случай старых версий)
+            try:
+                link_id = tag.TaggedElementId  # type: LinkElementId
+                if link_id is not None:
+                    self._add(self.tags, link_id.HostElementId, owner_id)
+            except:
+                pass
 
-def has_spot_elevation_for_element(view, element_id):
-    """Проверяет, есть ли на виде высотная отметка, ссылающаяся на элемент."""
-    try:
-        spot_collector = FilteredElementCollector(doc, view.Id).OfClass(SpotDimension)
-    except:
-        return False
+    def _index_references(self, cls, mapping):
+        """Размеры и высотные отметки: элементы из References."""
+        try:
+            annotations = FilteredElementCollector(doc).OfClass(cls)
+        except:
+            return
+        for ann in annotations:
+            try:
+                owner_id = ann.OwnerViewId.IntegerValue
+                refs = ann.References
+            except:
+                continue
+            if not refs:
+                continue
+            for ref in refs:
+                try:
+                    # Reference может ссылаться на элемент напрямую
+                    self._add(mapping, ref.ElementId, owner_id)
+                except:
+                    pass
 
-    for spot in spot_collector:
+    @staticmethod
+    def _on_view(mapping, element_id, view_ids):
+        owners = mapping.get(element_id.IntegerValue)
+        if not owners:
+            return False
+        return any(vid in owners for vid in view_ids)
+
+    def flags(self, element_id, view):
+        """(марка, размер, высотная отметка) элемента на виде."""
+        view_ids = [view.Id.IntegerValue]
+        # Зависимый вид показывает аннотации основного
         try:
-            # SpotDimension имеет свойство References
-            refs = spot.References
-            if refs:
-                for ref in refs:
-                    try:
-                        ref_elem_id = ref.ElementId
-                        if ref_elem_id == element_id:
-                            return True
-                    except:
-                        pass
+            primary_id = view.GetPrimaryViewId()
+            if primary_id != ElementId.InvalidElementId:
+                view_ids.append(primary_id.IntegerValue)
         except:
             pass
-
-    return False
-
-
-def find_views_for_element(element, only_on_sheets=False, view_sheet_map=None):
-    """Возвращает список кортежей (view, is_tagged, is_dimensioned, has_spot_elev), где элемент присутствует на виде."""
-    if element is None:
-        return []
-
-    element_id = element.Id
+        return (self._on_view(self.tags, element_id, view_ids),
+                self._on_view(self.dimensions, element_id, view_ids),
+                self._on_view(self.spots, element_id, view_ids))
+
+
+def find_views_for_elements(elements, only_on_sheets=False, view_sheet_map=None):
+    """
+    Возвращает словарь {ElementId.IntegerValue: [(view, is_tagged, is_dimensioned, has_spot_elev), ...]}
+    по видам, где элемент присутствует. На каждый вид — один коллектор сразу по всем элементам.
+    """
+    result = dict((el.Id.IntegerValue, []) for el in elements)
+    if not elements:
+        return result
 
     id_list = Clist[ElementId]()
-    id_list.Add(element_id)
+    for el in elements:
+        id_list.Add(el.Id)
     id_filter = ElementIdSetFilter(id_list)
 
     all_views_list = list(FilteredElementCollector(doc).OfClass(View))
@@ -188,9 +202,9 @@ def find_views_for_element(element, only_on_sheets=False, view_sheet_map=None):
     
     total = len(views)
     if total == 0:
-        return []
+        return result
 
-    result = []
+    annotations = AnnotationIndex(result.keys())
 
     with forms.ProgressBar(
         title=u"Поиск видов: {value} из {max_value}",
@@ -203,7 +217,7 @@ def find_views_for_element(element, only_on_sheets=False, view_sheet_map=None):
                 output.print_md(u"---")
                 output.print_md(u"## ⚠ Проверка отменена пользователем")
                 output.print_md(u"")
-                return []
+                return dict((key, []) for key in result)
 
             # обновляем прогресс
             pb.update_progress(idx + 1, total)
@@ -238,46 +252,16 @@ def find_views_for_element(element, only_on_sheets=False, view_sheet_map=None):
             except:
                 continue
 
-            # есть ли элемент в этом виде вообще
-            found = False
+            # какие из проверяемых элементов есть на этом виде
             try:
-                if collector.GetElementCount() > 0:
-                    found = True
+                found_ids = collector.ToElementIds()
             except:
-                pass
-
-            if not found:
-                try:
-                    it = collector.GetElementIterator()
-                    it.Reset()
-                    if it.MoveNext():
-                        found = True
-                except:
-                    pass
-
-            if not found:
                 continue
 
-            # элемент присутствует на виде — проверяем наличие марки, размеров и высотных отметок
-            is_tagged = False
-            is_dimensioned = False
-            has_spot_elev = False
-            try:
-                is_tagged = has_tag_for_element(view, element_id)
-            except:
-                is_tagged = False
-            
-            try:
-                is_dimensioned = has_dimension_for_element(view, element_id)
-            except:
-                is_dimensioned = False
-            
-            try:
-                has_spot_elev = has_spot_elevation_for_element(view, element_id)
-            except:
-                has_spot_elev = False
-
-            result.append((view, is_tagged, is_dimensioned, has_spot_elev))
+            # элемент присутствует на виде — марка, размеры и высотные отметки из индекса
+            for found_id in found_ids:
+                is_tagged, is_dimensioned, has_spot_elev = annotations.flags(found_id, view)
+                result[found_id.IntegerValue].append((view, is_tagged, is_dimensioned, has_spot_elev))
 
     return result
 
@@ -288,7 +272,8 @@ def show_views_table(views_info, view_sheet_map, element):
         output.print_md(u"---")
         output.print_md(u"## ❌ Результат проверки")
         output.print_md(u"")
-        output.print_md(u"<span style='color:#e74c3c; font-size:14px;'>**Элемент не найден ни на одном виде проекта.**</span>")
+        output.print_md(u"<span style='color:#e74c3c; font-size:14px;'>**Элемент {} не найден ни на одном виде проекта.**</span>".format(
+            output.linkify(element.Id)))
         output.print_md(u"")
         return
 
@@ -399,11 +384,11 @@ def show_views_table(views_info, view_sheet_map, element):
 
 
 def main():
-    element = get_target_element()
-    if element is None:
+    elements = get_target_elements()
+    if not elements:
         TaskDialog.Show(
             "Проверка видов",
-            "Не удалось получить элемент. Выберите один элемент и запустите скрипт снова."
+            "Не удалось получить элемент. Выберите элементы и запустите скрипт снова."
         )
         return
 
@@ -424,8 +409,9 @@ def main():
             return
         only_on_sheets = result  # True = да, False = нет
     
-    views_info = find_views_for_element(element, only_on_sheets, view_sheet_map)
-    show_views_table(views_info, view_sheet_map, element)
+    views_by_element = find_views_for_elements(elements, only_on_sheets, view_sheet_map)
+    for element in elements:
+        show_views_table(views_by_element[element.Id.IntegerValue], view_sheet_map, element)
 
 
 if __name__ == "__main__":
@@ -11,6 +11,8 @@ uidoc = revit.uidoc
 
 import math
 
+from element_geometry import get_geometry
+
 def _to_mm(feet_value):
     try:
         return DB.UnitUtils.ConvertFromInternalUnits(feet_value, DB.UnitTypeId.Millimeters)
@@ -59,121 +61,13 @@ def set_mm(elem, pname, mm):
         return True
     return False
 
-# -------- SOLID/MESH extents (robust) --------
-def _geo_options():
-    opt = DB.Options()
-    try:
-        opt.DetailLevel = DB.ViewDetailLevel.Fine
-    except: pass
-    opt.ComputeReferences = True
-    opt.IncludeNonVisibleObjects = True
-    try:
-        opt.View = doc.ActiveView
-    except: pass
-    return opt
-
-def _acc_pt(pt, tr, acc):
-    try:
-        p = tr.OfPoint(pt) if tr else pt
-    except: p = pt
-    z = p.Z
-    if acc[0] is None or z < acc[0]:
-        acc[0] = z
-    if acc[1] is None or z > acc[1]:
-        acc[1] = z
-
-def _consume_mesh(mesh, tr, acc):
-    if not mesh: return
-    try:
-        count = mesh.NumVertices
-        for i in range(count):
-            _acc_pt(mesh.get_Vertex(i), tr, acc)
-    except:
-        try:
-            for v in mesh.Vertices:
-                _acc_pt(v, tr, acc)
-        except: pass
-
-def _consume_edges(edges, tr, acc):
-    if not edges: return
-    eit = edges.GetEnumerator()
-    while eit.MoveNext():
-        e = eit.Current
-        try:
-            pts = e.Tessellate()
-        except:
-            pts = []
-        for p in pts:
-            _acc_pt(p, tr, acc)
-
-def _consume_solid(solid, tr, acc):
-    # Не отбрасываем solids с нулевым Volume — у них всё равно есть грани/рёбра
-    try:
-        faces = solid.Faces
-        if faces:
-            it = faces.GetEnumerator()
-            while it.MoveNext():
-                f = it.Current
-                try:
-                    m = f.Triangulate()
-                    _consume_mesh(m, tr, acc)
-                except:
-                    pass
-        # подстраховка: пройдёмся по рёбрам
-        try:
-            _consume_edges(solid.Edges, tr, acc)
-        except: pass
-    except: pass
-
-def _walk(go, tr, acc):
-    # порядок проверок важен
-    if isinstance(go, DB.Solid):
-        _consume_solid(go, tr, acc); return
-    if isinstance(go, DB.Mesh):
-        _consume_mesh(go, tr, acc); return
-    if isinstance(go, DB.GeometryInstance):
-        new_t = tr
-        try:
-            t = go.Transform
-            new_t = (new_t.Multiply(t) if new_t else t)
-        except: pass
-        # сначала символ-геометрия (стабильнее), затем инстанс
-        sub = None
-        try:
-            sub = go.GetSymbolGeometry()
-        except: pass
-        if sub is None:
-            try:
-                sub = go.GetInstanceGeometry()
-            except: sub = None
-        if sub:
-            it = sub.GetEnumerator()
-            while it.MoveNext():
-                _walk(it.Current, new_t, acc)
-        return
-    if isinstance(go, DB.GeometryElement):
-        it = go.GetEnumerator()
-        while it.MoveNext():
-            _walk(it.Current, tr, acc)
-        return
-    # последнее средство: попробуем взять свой bbox
-    try:
-        bb = go.get_BoundingBox()
-        if bb:
-            _acc_pt(bb.Min, tr, acc)
-            _acc_pt(bb.Max, tr, acc)
-    except: pass
-
+# -------- SOLID/MESH extents (общий кэш геометрии) --------
 def get_top_bottom_solid(elem):
     try:
-        geo = elem.get_Geometry(_geo_options())
-        if not geo:
-            return None, None
-        acc = [None, None]  # minZ, maxZ
-        _walk(geo, DB.Transform.Identity, acc)
-        if acc[0] is None or acc[1] is None:
+        ext = get_geometry(elem, references=True, non_visible=True, view=doc.ActiveView).extents()
+        if not ext:
             return None, None
-        return acc[1], acc[0]  # top, bottom
+        return ext[1], ext[0]  # top, bottom
     except:
         return None, None
 
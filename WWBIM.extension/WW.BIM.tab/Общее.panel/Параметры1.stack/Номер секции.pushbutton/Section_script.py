@@ -1,16 +1,18 @@
 # -*- coding: utf-8 -*-
 
 from pyrevit import revit, script, forms
-import Autodesk.Revit.DB as DB
 from System.Collections.Generic import List
 from Autodesk.Revit.DB import (
     BuiltInCategory, ElementId, FilteredElementCollector,
     ElementIntersectsSolidFilter, ElementMulticategoryFilter,
-    BooleanOperationsUtils, BooleanOperationsType, SolidUtils,
-    FamilyInstance, BuiltInParameter, StorageType, RevitLinkInstance
+    SolidUtils,
+    FamilyInstance, BuiltInParameter, StorageType, RevitLinkInstance,
+    BoundingBoxIntersectsFilter, Outline, XYZ
 )
 from Autodesk.Revit.UI.Selection import ObjectType, ISelectionFilter
 
+from element_geometry import get_geometry
+
 # ---------- env ----------
 doc   = revit.doc
 uidoc = revit.uidoc
@@ -19,6 +21,7 @@ out.close_others(all_open_outputs=True)
 
 SECTION_PARAM = u"ADSK_Номер секции"
 VOL_CAT       = BuiltInCategory.OST_GenericModel
+BBOX_TOL      = 1e-3    # запас габаритов при отборе кандидатов, фут
 
 # ====== целевые категории: ОГС + МЕП ======
 TARGET_CATS = [
@@ -114,20 +117,7 @@ def set_string_param(el, name, value):
 def solids_of_element(el):
     """Вернёт единый Solid элемента (объединение), либо пустой список."""
     try:
-        opt = DB.Options()
-        opt.DetailLevel = DB.ViewDetailLevel.Fine
-        opt.IncludeNonVisibleObjects = True
-        geo = el.get_Geometry(opt)
-        if not geo: return []
-        def _acc(giter, cur):
-            for g in giter:
-                if isinstance(g, DB.Solid) and g.Volume > 1e-9:
-                    cur = g if cur is None else BooleanOperationsUtils.ExecuteBooleanOperation(
-                        cur, g, BooleanOperationsType.Union)
-                elif isinstance(g, DB.GeometryInstance):
-                    cur = _acc(g.GetInstanceGeometry(), cur)
-            return cur
-        union = _acc(geo, None)
+        union = get_geometry(el, non_visible=True).union()
         return [union] if union else []
     except:
         return []
@@ -138,6 +128,59 @@ def multicategory_filter():
         ids.Add(ElementId(int(bic)))
     return ElementMulticategoryFilter(ids)
 
+def solid_bounds(solid):
+    """(xmin, ymin, zmin, xmax, ymax, zmax) тела в координатах модели"""
+    bb = solid.GetBoundingBox()
+    tr = bb.Transform
+    pts = [tr.OfPoint(XYZ(x, y, z))
+           for x in (bb.Min.X, bb.Max.X) for y in (bb.Min.Y, bb.Max.Y) for z in (bb.Min.Z, bb.Max.Z)]
+    return (min(p.X for p in pts) - BBOX_TOL, min(p.Y for p in pts) - BBOX_TOL, min(p.Z for p in pts) - BBOX_TOL,
+            max(p.X for p in pts) + BBOX_TOL, max(p.Y for p in pts) + BBOX_TOL, max(p.Z for p in pts) + BBOX_TOL)
+
+class VolumeIndex(object):
+    """Сетка XY над габаритами объёмов: объёмы-кандидаты для габарита элемента.
+
+    Кандидаты отдаются в порядке выбора объёмов — от него зависит, какая
+    секция записывается, а какая уходит в конфликты.
+    """
+    def __init__(self, volumes):
+        self.volumes = volumes
+        sizes = sorted(max(v["bounds"][3] - v["bounds"][0], v["bounds"][4] - v["bounds"][1]) for v in volumes)
+        self.cell = max(sizes[len(sizes) // 2], 1.0)
+        self.cells = {}
+        for order, v in enumerate(volumes):
+            b = v["bounds"]
+            for key in self._cells(b[0], b[1], b[3], b[4]):
+                self.cells.setdefault(key, []).append(order)
+
+    def _cells(self, xmin, ymin, xmax, ymax):
+        i0, i1 = int(xmin // self.cell), int(xmax // self.cell)
+        j0, j1 = int(ymin // self.cell), int(ymax // self.cell)
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def outline(self):
+        """Общий габарит всех объёмов для нативного предотбора"""
+        bs = [v["bounds"] for v in self.volumes]
+        return Outline(XYZ(min(b[0] for b in bs), min(b[1] for b in bs), min(b[2] for b in bs)),
+                       XYZ(max(b[3] for b in bs), max(b[4] for b in bs), max(b[5] for b in bs)))
+
+    def candidates(self, bb):
+        if bb is None:
+            return list(self.volumes)
+        keys = self._cells(bb.Min.X, bb.Min.Y, bb.Max.X, bb.Max.Y)
+        if len(keys) > len(self.cells):
+            orders = set(o for lst in self.cells.values() for o in lst)
+        else:
+            orders = set(o for key in keys for o in self.cells.get(key, ()))
+        found = []
+        for order in sorted(orders):
+            v = self.volumes[order]
+            b = v["bounds"]
+            if (b[0] <= bb.Max.X and b[3] >= bb.Min.X and b[1] <= bb.Max.Y and b[4] >= bb.Min.Y and
+                    b[2] <= bb.Max.Z and b[5] >= bb.Min.Z):
+                found.append(v)
+        return found
+
 def iter_with_subcomponents(root):
     """Сам элемент + все вложенные FamilyInstance подкомпоненты (без дублей)."""
     stack = [root]
@@ -258,43 +301,53 @@ if not volumes:
     forms.alert(u"Нет корректных объёмов для обработки.", title=__title__)
     script.exit()
 
-# подготавливаем фильтры
-mcat_filter = multicategory_filter()
+# Один проход по модели: элементы нужных категорий в общем габарите объёмов,
+# для каждого — только объёмы, чьи габариты его задевают, и точная проверка телом
+for v in volumes:
+    v["bounds"] = solid_bounds(v["solid"])
+    v["filter"] = ElementIntersectsSolidFilter(v["solid"])
+vindex = VolumeIndex(volumes)
+
+col = (FilteredElementCollector(doc)
+       .WhereElementIsNotElementType()
+       .WherePasses(multicategory_filter())
+       .WherePasses(BoundingBoxIntersectsFilter(vindex.outline())))
+
 assigned = {}   # eid -> section (для отслеживания конфликтов)
 fails    = []   # проблемы записи в элементы
 conflict = []   # элемент попал в разные объёмы (разные секции)
-
-with revit.Transaction(u"Заполнение «%s» по объёмам" % SECTION_PARAM):
-    for v in volumes:
-        solid = v["solid"]
-        sec   = v["section"]
-
-        # набор кандидатов: нужные категории + пересечение с solid
-        col = (FilteredElementCollector(doc)
-               .WhereElementIsNotElementType()
-               .WherePasses(mcat_filter)
-               .WherePasses(ElementIntersectsSolidFilter(solid)))
-
-        for el in col:
-            # пропустим экземпляры связей на всякий случай
-            if isinstance(el, RevitLinkInstance):
-                continue
-
-            eid = el.Id.IntegerValue
-            # если уже присвоена другая секция — фиксируем конфликт, не перетираем
-            if eid in assigned and assigned[eid] != sec:
+writes   = []   # (элемент, секция) — только там, где значение отличается
+planned  = {}   # eid цели -> секция, уже поставленная в очередь записи
+
+for el in col:
+    # пропустим экземпляры связей на всякий случай
+    if isinstance(el, RevitLinkInstance):
+        continue
+    eid = el.Id.IntegerValue
+    for v in vindex.candidates(el.get_BoundingBox(None)):
+        if not v["filter"].PassesFilter(el):
+            continue
+        sec = v["section"]
+        # если уже присвоена другая секция — фиксируем конфликт, не перетираем
+        if eid in assigned:
+            if assigned[eid] != sec:
                 conflict.append([out.linkify(el.Id), family_label(el), u"%s → %s" % (assigned[eid], sec)])
+            continue
+        for tgt in iter_with_subcomponents(el):
+            tid = tgt.Id.IntegerValue
+            if planned.get(tid) == sec:
                 continue
-
-            ok_any = True
-            for tgt in iter_with_subcomponents(el):
-                ok, reason = set_string_param(tgt, SECTION_PARAM, sec)
-                if not ok:
-                    ok_any = False
-                    fails.append([out.linkify(tgt.Id), family_label(tgt), (reason or u"")])
-
-            if ok_any:
-                assigned[eid] = sec
+            planned[tid] = sec
+            if get_string_param(tgt, SECTION_PARAM) != sec:
+                writes.append((tgt, sec))
+        assigned[eid] = sec
+
+if writes:
+    with revit.Transaction(u"Заполнение «%s» по объёмам" % SECTION_PARAM):
+        for tgt, sec in writes:
+            ok, reason = set_string_param(tgt, SECTION_PARAM, sec)
+            if not ok:
+                fails.append([out.linkify(tgt.Id), family_label(tgt), (reason or u"")])
 
 # ----- отчёты (только по проблемам) -----
 if skipped:
@@ -3,10 +3,19 @@
 # PyRevit / IronPython (RevitAPI)
 from __future__ import print_function
 
+import heapq
+import math
+from bisect import bisect_left, bisect_right
+
 from pyrevit import revit, forms, script
 from Autodesk.Revit.DB import *
 from System import Math
 
+from room_polygons import EdgeSlabs, INSIDE, NEAR
+from room_geometry_cache import GeometryCache
+from room_assign_state import AssignmentState, digest
+from element_geometry import get_geometry
+
 OUT = script.get_output()
 
 MODE_IOS = u"ИОС — MEP элементы + помещения из AR-ссылки"
@@ -18,6 +27,12 @@ STEP_FT             = 1.0
 EPS                 = 1e-9
 XY_EDGE_TOL         = 1e-3
 BBOX_PAD            = 0.5
+GRID_MIN_CELL_FT    = 3.0      # минимальный размер ячейки сетки помещений
+GRID_MAX_ROOM_CELLS = 4096     # помещение крупнее — проверяется для любой точки
+FACE_GRID_PAD       = 0.01     # запас габарита грани перекрытия в плане
+API_NEAR_FT         = 0.25     # снаружи ближе этого к контуру — решает IsPointInRoom
+# Меняется вместе с тем, что влияет на извлечённую геометрию: старый кэш не подойдёт
+GEOMETRY_CACHE_FORMAT = u"1|finish|{0}".format(BBOX_PAD)
 DEBUG               = False
 
 MEP_CATEGORIES = [
@@ -89,6 +104,49 @@ def set_elem_param_str(elem, pname, text_value):
     except:
         return False
 
+def get_elem_param_str(elem, pname):
+    try:
+        p = elem.LookupParameter(pname)
+        return to_str(p.AsString()) if p else None
+    except:
+        return None
+
+def _r(v):
+    return round(v, 5)
+
+def element_location_key(el):
+    """Хеш положения и формы элемента (тип, Location, габарит, площадь/объём)"""
+    parts = []
+    try:
+        parts.append(el.GetTypeId().IntegerValue)
+    except:
+        pass
+    try:
+        loc = el.Location
+        if isinstance(loc, LocationPoint):
+            p = loc.Point
+            parts.append([_r(p.X), _r(p.Y), _r(p.Z)])
+            try:
+                parts.append(_r(loc.Rotation))
+            except:
+                pass
+        elif isinstance(loc, LocationCurve):
+            parts.append([[_r(p.X), _r(p.Y), _r(p.Z)] for p in _curve_points(loc.Curve)])
+    except:
+        pass
+    bb = el.get_BoundingBox(None)
+    if bb is None:
+        return None
+    parts.append([_r(bb.Min.X), _r(bb.Min.Y), _r(bb.Min.Z), _r(bb.Max.X), _r(bb.Max.Y), _r(bb.Max.Z)])
+    for bip in (BuiltInParameter.HOST_AREA_COMPUTED, BuiltInParameter.HOST_VOLUME_COMPUTED):
+        try:
+            p = el.get_Parameter(bip)
+            if p and p.HasValue:
+                parts.append(_r(p.AsDouble()))
+        except:
+            pass
+    return digest(parts)
+
 def collect_mep_elements(doc):
     elems = []
     for bic in MEP_CATEGORIES:
@@ -107,55 +165,61 @@ def collect_floors(doc):
         return []
 
 def _curve_points(curv):
+    """Точки кривой контура: дуги разбиваются, отрезок — два конца"""
+    try:
+        return list(curv.Tessellate())
+    except:
+        pass
     try:
-        return curv.GetEndPoint(0), curv.GetEndPoint(1)
+        return [curv.GetEndPoint(0), curv.GetEndPoint(1)]
     except:
         try:
-            return curv.Evaluate(0.0, True), curv.Evaluate(1.0, True)
+            return [curv.Evaluate(0.0, True), curv.Evaluate(1.0, True)]
         except:
-            return None, None
-
-def _point_seg_dist2(px, py, ax, ay, bx, by):
-    vx = bx - ax; vy = by - ay
-    wx = px - ax; wy = py - ay
-    c1 = vx*wx + vy*wy
-    if c1 <= 0.0:
-        dx = px - ax; dy = py - ay
-        return dx*dx + dy*dy
-    c2 = vx*vx + vy*vy
-    if c2 <= c1:
-        dx = px - bx; dy = py - by
-        return dx*dx + dy*dy
-    t = c1 / c2
-    projx = ax + t*vx; projy = ay + t*vy
-    dx = px - projx; dy = py - projy
-    return dx*dx + dy*dy
+            return []
+
+def _loop_points(curves):
+    """Точки (x, y, z) замкнутой цепочки кривых; направление кривых выравнивается"""
+    pts = []
+    for crv in curves:
+        cpts = _curve_points(crv)
+        if len(cpts) < 2:
+            continue
+        if pts:
+            lx, ly, lz = pts[-1]
+            d_first = (cpts[0].X - lx) ** 2 + (cpts[0].Y - ly) ** 2
+            d_last = (cpts[-1].X - lx) ** 2 + (cpts[-1].Y - ly) ** 2
+            if d_last < d_first:
+                cpts = cpts[::-1]
+            cpts = cpts[1:]
+        pts.extend((p.X, p.Y, p.Z) for p in cpts)
+    return pts
+
+def _flat_xy(loops):
+    return [[c for pt in loop for c in pt[:2]] for loop in loops]
+
+def _unflat_xy(flat_loops):
+    return [list(zip(fl[0::2], fl[1::2])) for fl in flat_loops]
 
 class RoomWrap(object):
-    __slots__ = ("room", "loops", "bbmin", "bbmax", "baseZ", "topZ0")
-    def __init__(self, link_doc, room):
+    __slots__ = ("room", "loops", "edges", "bbmin", "bbmax", "baseZ", "topZ0")
+    def __init__(self, link_doc, room, record=None):
         self.room = room
+        if record is not None:
+            self._from_record(record)
+            return
         self.loops = []
         opt = SpatialElementBoundaryOptions()
         opt.SpatialElementBoundaryLocation = SpatialElementBoundaryLocation.Finish
         try:
             seglists = room.GetBoundarySegments(opt)
             for seglist in seglists:
-                pts = []
-                for seg in seglist:
-                    crv = seg.GetCurve()
-                    a, b = _curve_points(crv)
-                    if a is None or b is None:
-                        continue
-                    if not pts:
-                        pts.append(a)
-                    pts.append(b)
+                pts = _loop_points([seg.GetCurve() for seg in seglist])
                 if len(pts) >= 3:
-                    if abs(pts[0].X - pts[-1].X) > EPS or abs(pts[0].Y - pts[-1].Y) > EPS:
-                        pts.append(pts[0])
-                    self.loops.append(pts)
+                    self.loops.append([(x, y) for x, y, z in pts])
         except:
             self.loops = []
+        self.edges = EdgeSlabs(self.loops, XY_EDGE_TOL, API_NEAR_FT)
 
         bb = room.get_BoundingBox(None)
         if bb:
@@ -167,28 +231,83 @@ class RoomWrap(object):
 
         self.baseZ, self.topZ0 = room_base_and_top_z(link_doc, room)
 
+    def to_record(self):
+        return [_flat_xy(self.loops),
+                [self.bbmin.X, self.bbmin.Y, self.bbmax.X, self.bbmax.Y],
+                self.baseZ, self.topZ0]
+
+    def _from_record(self, record):
+        flat_loops, bb, self.baseZ, self.topZ0 = record
+        self.loops = _unflat_xy(flat_loops)
+        self.edges = EdgeSlabs(self.loops, XY_EDGE_TOL, API_NEAR_FT)
+        self.bbmin = XYZ(bb[0], bb[1], -1e9)
+        self.bbmax = XYZ(bb[2], bb[3],  1e9)
+
     def bbox_contains_xy(self, pt):
         return (self.bbmin.X <= pt.X <= self.bbmax.X and
                 self.bbmin.Y <= pt.Y <= self.bbmax.Y)
 
     def contains_xy_fallback(self, pt):
-        tol2 = XY_EDGE_TOL * XY_EDGE_TOL
-        x = pt.X; y = pt.Y
-        for loop in self.loops:
-            for i in range(len(loop) - 1):
-                a = loop[i]; b = loop[i+1]
-                if _point_seg_dist2(x, y, a.X, a.Y, b.X, b.Y) <= tol2:
-                    return True
-        inside = False
-        for loop in self.loops:
-            ln = len(loop)
-            for i in range(ln - 1):
-                a = loop[i]; b = loop[i+1]
-                if (a.Y > y) != (b.Y > y):
-                    xinters = (b.X - a.X) * (y - a.Y) / (b.Y - a.Y + 0.0) + a.X
-                    if x < xinters:
-                        inside = not inside
-        return inside
+        return self.edges.classify(pt.X, pt.Y) == INSIDE
+
+class RoomGrid(object):
+    """Равномерная сетка XY над габаритами помещений (координаты модели помещений).
+
+    Ячейка — медианный размер помещения в плане, поэтому на точку приходится
+    несколько кандидатов вместо всех помещений модели. Кандидаты отдаются
+    в исходном порядке помещений.
+    """
+    def __init__(self, wraps):
+        self.cells = {}
+        self.everywhere = []     # без габарита или слишком крупные
+        sizes = sorted(max(rw.bbmax.X - rw.bbmin.X, rw.bbmax.Y - rw.bbmin.Y)
+                       for rw in wraps if self._bounded(rw))
+        self.cell = max(GRID_MIN_CELL_FT, sizes[len(sizes) // 2] if sizes else 0.0)
+        for order, rw in enumerate(wraps):
+            if not self._bounded(rw):
+                self.everywhere.append((order, rw))
+                continue
+            i0, j0 = self._cell_of(rw.bbmin.X, rw.bbmin.Y)
+            i1, j1 = self._cell_of(rw.bbmax.X, rw.bbmax.Y)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > GRID_MAX_ROOM_CELLS:
+                self.everywhere.append((order, rw))
+                continue
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self.cells.setdefault((i, j), []).append((order, rw))
+
+    @staticmethod
+    def _bounded(rw):
+        return rw.bbmin.X > -1e8 and rw.bbmax.X < 1e8
+
+    def _cell_of(self, x, y):
+        return int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+
+    def candidates_in_box(self, xmin, ymin, xmax, ymax):
+        """Помещения, габарит которых пересекает прямоугольник плана"""
+        i0, j0 = self._cell_of(xmin, ymin)
+        i1, j1 = self._cell_of(xmax, ymax)
+        found = dict(self.everywhere)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > GRID_MAX_ROOM_CELLS:
+            found.update(self._all_cell_items())
+        else:
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    found.update(self.cells.get((i, j), ()))
+        return [rw for order, rw in sorted(found.items())
+                if rw.bbmin.X <= xmax and rw.bbmax.X >= xmin and
+                rw.bbmin.Y <= ymax and rw.bbmax.Y >= ymin]
+
+    def _all_cell_items(self):
+        for items in self.cells.values():
+            for item in items:
+                yield item
+
+    def candidates(self, x, y):
+        found = self.cells.get(self._cell_of(x, y), [])
+        if self.everywhere:
+            found = sorted(found + self.everywhere, key=lambda item: item[0])
+        return [rw for order, rw in found]
 
 def room_base_and_top_z(link_doc, room):
     baseZ = 0.0
@@ -206,11 +325,90 @@ def room_base_and_top_z(link_doc, room):
         topZ0 = baseZ
     return baseZ, topZ0
 
-def collect_faces_for_doc(doc_any):
+def build_room_wraps(link_doc, rooms, cache=None):
+    """RoomWrap для помещений; контуры берутся из кэша связи, если он есть"""
+    records = cache.section("rooms") if cache is not None else {}
+    wraps = []
+    for r in rooms:
+        key = str(r.Id.IntegerValue)
+        rw = RoomWrap(link_doc, r, records.get(key))
+        if cache is not None and key not in records:
+            cache.put("rooms", key, rw.to_record())
+        wraps.append(rw)
+    return wraps
+
+class SlabFace(object):
+    """Плоская грань перекрытия: плоскость и контуры в плане (без объектов API)"""
+    __slots__ = ("normal", "origin", "loops", "zmin", "zmax", "edges")
+    def __init__(self, normal, origin, loops, zmin, zmax):
+        self.normal = normal    # (nx, ny, nz)
+        self.origin = origin    # (x, y, z)
+        self.loops = loops      # [[(x, y), ...], ...]
+        self.zmin = zmin
+        self.zmax = zmax
+        self.edges = EdgeSlabs(loops, XY_EDGE_TOL)
+
+    @staticmethod
+    def from_planar_face(pf):
+        try:
+            try:
+                curve_loops = list(pf.GetEdgesAsCurveLoops())
+            except:
+                curve_loops = [[edge.AsCurve() for edge in loop] for loop in pf.EdgeLoops]
+            loops, zs = [], []
+            for cl in curve_loops:
+                pts = _loop_points(cl)
+                if len(pts) >= 3:
+                    loops.append([(x, y) for x, y, z in pts])
+                    zs.extend(z for x, y, z in pts)
+        except:
+            return None
+        if not loops:
+            return None
+        n = pf.FaceNormal
+        o = pf.Origin
+        return SlabFace((n.X, n.Y, n.Z), (o.X, o.Y, o.Z), loops, min(zs), max(zs))
+
+    def to_record(self):
+        return [list(self.normal), list(self.origin), self.zmin, self.zmax, _flat_xy(self.loops)]
+
+    @staticmethod
+    def from_record(record):
+        normal, origin, zmin, zmax, flat_loops = record
+        return SlabFace(tuple(normal), tuple(origin), _unflat_xy(flat_loops), zmin, zmax)
+
+    def bounds(self):
+        """(xmin, ymin, xmax, ymax, zmin, zmax) с запасом в плане"""
+        xs = [x for loop in self.loops for x, y in loop]
+        ys = [y for loop in self.loops for x, y in loop]
+        return (min(xs) - FACE_GRID_PAD, min(ys) - FACE_GRID_PAD,
+                max(xs) + FACE_GRID_PAD, max(ys) + FACE_GRID_PAD, self.zmin, self.zmax)
+
+    def z_at(self, x, y):
+        """Высота плоскости грани над точкой плана или None, если точка вне грани"""
+        nx, ny, nz = self.normal
+        if abs(nz) < EPS:
+            return None
+        if self.edges.classify(x, y) != INSIDE:
+            return None
+        ox, oy, oz = self.origin
+        return oz - (nx * (x - ox) + ny * (y - oy)) / nz
+
+def collect_faces_for_doc(doc_any, cache=None):
+    """(верхние, нижние) грани перекрытий документа как SlabFace"""
+    if cache is not None:
+        faces = cache.section("faces")
+        if "top" in faces and "bottom" in faces:
+            return ([SlabFace.from_record(r) for r in faces["top"]],
+                    [SlabFace.from_record(r) for r in faces["bottom"]])
+    top_faces, bottom_faces = _extract_faces(doc_any)
+    if cache is not None:
+        cache.put("faces", "top", [f.to_record() for f in top_faces])
+        cache.put("faces", "bottom", [f.to_record() for f in bottom_faces])
+    return top_faces, bottom_faces
+
+def _extract_faces(doc_any):
     top_faces, bottom_faces = [], []
-    opt = Options()
-    opt.DetailLevel = ViewDetailLevel.Fine
-    opt.ComputeReferences = False
     cats = (BuiltInCategory.OST_Floors, BuiltInCategory.OST_StructuralFoundation)
     for bic in cats:
         try:
@@ -219,66 +417,141 @@ def collect_faces_for_doc(doc_any):
             elems = []
         for fl in elems:
             try:
-                geo = fl.get_Geometry(opt)
-                if not geo:
-                    continue
-                for g in geo:
-                    solid = g if isinstance(g, Solid) else None
-                    if not solid or solid.Volume <= 1e-9:
+                for pf in get_geometry(fl).planar_faces(nested=False):
+                    n = pf.FaceNormal
+                    if abs(n.Z) <= EPS:
+                        continue
+                    face = SlabFace.from_planar_face(pf)
+                    if face is None:
                         continue
-                    for f in solid.Faces:
-                        pf = f if isinstance(f, PlanarFace) else None
-                        if not pf: 
-                            continue
-                        n = pf.FaceNormal
-                        if n.Z > EPS:        # верхняя грань
-                            top_faces.append(pf)
-                        elif n.Z < -EPS:     # нижняя грань
-                            bottom_faces.append(pf)
+                    if n.Z > EPS:        # верхняя грань
+                        top_faces.append(face)
+                    else:                # нижняя грань
+                        bottom_faces.append(face)
             except:
                 continue
     return top_faces, bottom_faces
 
-def plane_z_at_xy(planar_face, x, y):
-    n = planar_face.FaceNormal
-    if abs(n.Z) < EPS:
-        return None
-    p0 = planar_face.Origin
-    dz = (n.X * (x - p0.X) + n.Y * (y - p0.Y)) / n.Z
-    return p0.Z - dz
+class SlabFaceIndex(object):
+    """Грани перекрытий в сетке XY; в ячейке грани отсортированы по высоте.
+
+    upward=True — для поиска ближайшей грани выше точки (ключ — низ грани),
+    иначе — ниже точки (ключ — верх грани). Координаты — модели граней.
+    """
+    def __init__(self, faces, upward):
+        self.upward = upward
+        entries = []
+        everywhere = []
+        sizes = []
+        for seq, pf in enumerate(faces):
+            b = pf.bounds()
+            entries.append((b, seq, pf))
+            sizes.append(max(b[2] - b[0], b[3] - b[1]))
+        sizes.sort()
+        self.cell = max(GRID_MIN_CELL_FT, sizes[len(sizes) // 2] if sizes else 0.0)
+
+        cells = {}
+        for b, seq, pf in entries:
+            i0, j0 = self._cell_of(b[0], b[1])
+            i1, j1 = self._cell_of(b[2], b[3])
+            item = (b[4], b[5], seq, pf)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > GRID_MAX_ROOM_CELLS:
+                everywhere.append(item)
+                continue
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    cells.setdefault((i, j), []).append(item)
+        self.cells = dict((k, self._bucket(v)) for k, v in cells.items())
+        self.everywhere = self._bucket(everywhere)
+
+    def _cell_of(self, x, y):
+        return int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+
+    def _bucket(self, items):
+        """(ключи, грани, наибольшая разница высот) — ключ по направлению поиска"""
+        pos = 0 if self.upward else 1
+        items = sorted(items, key=lambda it: it[pos])
+        span = max([it[1] - it[0] for it in items] or [0.0])
+        return [it[pos] for it in items], items, span
+
+    def _walk(self, bucket, z):
+        keys, items, span = bucket
+        if self.upward:
+            # низ грани по возрастанию, пропуская грани целиком не выше z
+            for k in range(bisect_left(keys, z - span - EPS), len(items)):
+                zmin, zmax, seq, pf = items[k]
+                if zmax > z - EPS:
+                    yield zmin, seq, pf
+        else:
+            # верх грани по убыванию, пропуская грани целиком не ниже z
+            for k in range(bisect_right(keys, z + span + EPS) - 1, -1, -1):
+                zmin, zmax, seq, pf = items[k]
+                if zmin < z + EPS:
+                    yield -zmax, seq, pf
+
+    def candidates(self, x, y, z):
+        """Грани, которые могут быть выше (ниже) точки, от ближних по высоте к дальним.
+
+        Отдаются пары (граница, грань), где граница — низ (для ниже — минус
+        верх) грани: найденная высота не ближе этой границы.
+        """
+        walks = [self._walk(self.everywhere, z)]
+        bucket = self.cells.get(self._cell_of(x, y))
+        if bucket is not None:
+            walks.append(self._walk(bucket, z))
+        # Номер грани в ключе: при равной высоте грани не сравниваются между собой
+        for bound, seq, pf in heapq.merge(*walks):
+            yield bound, pf
+
+def _keeps_vertical(transform):
+    try:
+        return abs(transform.BasisZ.Z - 1.0) < 1e-9
+    except:
+        return False
 
 class FloorSet(object):
-    __slots__ = ("name", "to_link", "from_link", "top_faces", "bottom_faces")
+    __slots__ = ("name", "to_link", "from_link", "top_faces", "bottom_faces",
+                 "above_index", "below_index")
     def __init__(self, name, to_link, from_link, top_faces, bottom_faces):
         self.name = name
         self.to_link = to_link      # host -> link
         self.from_link = from_link  # link -> host
         self.top_faces = top_faces              # для нижней границы (ищем ниже)
         self.bottom_faces = bottom_faces        # для верхней границы (ищем выше)
+        # Индексы по высоте возможны, если переход в ссылку не наклоняет ось Z
+        if _keeps_vertical(to_link):
+            self.above_index = SlabFaceIndex(bottom_faces, upward=True)
+            self.below_index = SlabFaceIndex(top_faces, upward=False)
+        else:
+            self.above_index = self.below_index = None
 
 def _face_host_z_at_xy(fs, pf, host_x, host_y):
     try:
         pt_l = fs.to_link.OfPoint(XYZ(host_x, host_y, 0.0))
         xL = pt_l.X; yL = pt_l.Y
-        zL = plane_z_at_xy(pf, xL, yL)
+        zL = pf.z_at(xL, yL)
         if zL is None:
             return None
-        pL = XYZ(xL, yL, zL)
-        proj = pf.Project(pL)
-        if proj is None:
-            return None
-        uv = proj.UVPoint
-        if not pf.IsInside(uv):
-            return None
-        pH = fs.from_link.OfPoint(pL)
+        pH = fs.from_link.OfPoint(XYZ(xL, yL, zL))
         return pH.Z
     except:
         return None
 
+def _slab_candidates(fs, index, faces, host_x, host_y, host_z):
+    """(граница в Z модели, грань) для перебора; без индекса — все грани"""
+    if index is None:
+        return None, [(None, pf) for pf in faces]
+    pt_l = fs.to_link.OfPoint(XYZ(host_x, host_y, host_z))
+    return host_z - pt_l.Z, index.candidates(pt_l.X, pt_l.Y, pt_l.Z)
+
 def nearest_slab_hostZ_above_hostZ(fsets, host_x, host_y, min_host_z):
     best = None
     for fs in fsets:
-        for pf in fs.bottom_faces:
+        dz, cands = _slab_candidates(fs, fs.above_index, fs.bottom_faces, host_x, host_y, min_host_z)
+        for bound, pf in cands:
+            # Дальше по списку грани только выше уже найденной
+            if bound is not None and best is not None and bound + dz >= best:
+                break
             zH = _face_host_z_at_xy(fs, pf, host_x, host_y)
             if zH is None or zH <= min_host_z + EPS:
                 continue
@@ -289,7 +562,11 @@ def nearest_slab_hostZ_above_hostZ(fsets, host_x, host_y, min_host_z):
 def nearest_slab_hostZ_below_hostZ(fsets, host_x, host_y, max_host_z):
     best = None
     for fs in fsets:
-        for pf in fs.top_faces:
+        dz, cands = _slab_candidates(fs, fs.below_index, fs.top_faces, host_x, host_y, max_host_z)
+        for bound, pf in cands:
+            # Дальше по списку грани только ниже уже найденной
+            if bound is not None and best is not None and -bound + dz <= best:
+                break
             zH = _face_host_z_at_xy(fs, pf, host_x, host_y)
             if zH is None or zH >= max_host_z - EPS:
                 continue
@@ -358,6 +635,7 @@ class RealZRoomTester(object):
 
         self.floor_sets  = floor_sets
         self.host_levels = host_levels_sorted
+        self.grid = RoomGrid(room_wraps)
         self.stats = {
             "top_slab_cap": 0, "top_level_cap": 0, "top_no_cap": 0,
             "bot_slab_cap": 0, "bot_level_cap": 0, "bot_no_cap": 0,
@@ -378,25 +656,91 @@ class RealZRoomTester(object):
                 baseH, topH = baseZ, topZ0
             self.roomZ[key] = (baseZ, topZ0, baseH, topH)
 
-    def elem_point_in_room(self, rw, pt_host):
+    def candidate_rooms_for_element(self, el):
+        """Помещения, чей габарит пересекает габарит элемента (None — габарита нет)"""
+        bb = el.get_BoundingBox(None)
+        if bb is None:
+            return None
+        xs, ys = [], []
+        for x in (bb.Min.X, bb.Max.X):
+            for y in (bb.Min.Y, bb.Max.Y):
+                p = self.to_room_link.OfPoint(XYZ(x, y, bb.Min.Z))
+                xs.append(p.X); ys.append(p.Y)
+        return self.grid.candidates_in_box(min(xs), min(ys), max(xs), max(ys))
+
+    def candidate_rooms(self, pt_host):
+        """(точка в координатах помещений, помещения-кандидаты из сетки)"""
         try:
             pt_room = self.to_room_link.OfPoint(pt_host)
         except:
-            return False
+            return None, []
+        return pt_room, self.grid.candidates(pt_room.X, pt_room.Y)
 
-        baseZ, topZ0, baseH, topH = self.roomZ.get(
+    def _room_z(self, rw):
+        return self.roomZ.get(
             rw.room.Id.IntegerValue,
             (rw.baseZ, rw.topZ0,
              self.from_room_link.OfPoint(XYZ(0,0,rw.baseZ)).Z,
              self.from_room_link.OfPoint(XYZ(0,0,rw.topZ0)).Z)
         )
 
+    def _xy_in_room(self, rw, pt_room, code):
+        """Итог по коду контура: у самой границы (или без контура) спрашиваем API"""
+        if code == INSIDE:
+            return True
+        if code == NEAR:
+            return xy_inside_room_api(rw.room, self._room_z(rw)[0], pt_room, z_hint=pt_room.Z)
+        return False
+
+    def rooms_for_points(self, pts_host):
+        """Помещения, в которые попадает хотя бы одна точка элемента.
+
+        Точки раскладываются по помещениям-кандидатам из сетки, контур
+        каждого помещения проверяется сразу для всех его точек. Порядок —
+        как при переборе точка за точкой.
+        """
+        per_point = []
+        per_room = {}
+        for i, pt_host in enumerate(pts_host):
+            pt_room, candidates = self.candidate_rooms(pt_host)
+            per_point.append((pt_host, candidates))
+            for rw in candidates:
+                if rw.bbox_contains_xy(pt_room):
+                    per_room.setdefault(rw, []).append((i, pt_room))
+
+        inside = set()
+        for rw, items in per_room.items():
+            codes = rw.edges.classify_many([(p.X, p.Y) for i, p in items])
+            for (i, pt_room), code in zip(items, codes):
+                if self._xy_in_room(rw, pt_room, code):
+                    inside.add((rw, i))
+
+        found = []
+        seen = set()
+        for i, (pt_host, candidates) in enumerate(per_point):
+            for rw in candidates:
+                if rw in seen or (rw, i) not in inside:
+                    continue
+                if self._z_in_room(rw, pt_host):
+                    seen.add(rw)
+                    found.append(rw)
+        return found
+
+    def elem_point_in_room(self, rw, pt_host, pt_room=None):
+        if pt_room is None:
+            try:
+                pt_room = self.to_room_link.OfPoint(pt_host)
+            except:
+                return False
         if not rw.bbox_contains_xy(pt_room):
             return False
-        if not xy_inside_room_api(rw.room, baseZ, pt_room, z_hint=pt_room.Z):
-            if not rw.contains_xy_fallback(pt_room):
-                return False
+        if not self._xy_in_room(rw, pt_room, rw.edges.classify(pt_room.X, pt_room.Y)):
+            return False
+        return self._z_in_room(rw, pt_host)
 
+    def _z_in_room(self, rw, pt_host):
+        """Высота точки между реальными низом и верхом помещения (перекрытия/уровни)"""
+        baseZ, topZ0, baseH, topH = self._room_z(rw)
         xH, yH, zH = pt_host.X, pt_host.Y, pt_host.Z
 
         slab_topH = nearest_slab_hostZ_above_hostZ(self.floor_sets, xH, yH, topH)
@@ -464,32 +808,12 @@ def _dense_points_on_curve(crv):
     return pts
 
 def floor_sample_points(fl):
-    pts = []
     try:
-        opt = Options()
-        opt.DetailLevel = ViewDetailLevel.Fine
-        opt.IncludeNonVisibleObjects = False
-        geo = fl.get_Geometry(opt)
+        faces = [pf for pf in get_geometry(fl).planar_faces(nested=False) if pf.FaceNormal.Z > EPS]
     except:
-        geo = None
-    if not geo:
-        return pts
-
-    faces = []
-    for g in geo:
-        try:
-            solid = g if isinstance(g, Solid) else None
-            if not solid or solid.Volume <= 1e-9:
-                continue
-            for f in solid.Faces:
-                pf = f if isinstance(f, PlanarFace) else None
-                if not pf:
-                    continue
-                n = pf.FaceNormal
-                if n.Z > EPS:
-                    faces.append(pf)
-        except:
-            pass
+        faces = []
+    if not faces:
+        return []
 
     uniq, seen = [], set()
     def _push(p):
@@ -669,7 +993,7 @@ def choose_target_param_from_elems(elems, default_name=u"ADSK_Помещение
         script.exit()
     return to_str(picked)
 
-def build_floor_sets_selected(doc_host, selected_link_inst):
+def build_floor_sets_selected(doc_host, selected_link_inst, cache=None):
     fsets = []
     if INCLUDE_HOST_FLOORS:
         top_h, bot_h = collect_faces_for_doc(doc_host)
@@ -677,7 +1001,7 @@ def build_floor_sets_selected(doc_host, selected_link_inst):
             ident = Transform.Identity
             fsets.append(FloorSet(u"[HOST]", ident.Inverse, ident, top_h, bot_h))
     ldoc = selected_link_inst.GetLinkDocument()
-    top_l, bot_l = collect_faces_for_doc(ldoc)
+    top_l, bot_l = collect_faces_for_doc(ldoc, cache)
     if top_l or bot_l:
         T = selected_link_inst.GetTotalTransform()
         fsets.append(FloorSet(selected_link_inst.Name, T.Inverse, T, top_l, bot_l))
@@ -691,6 +1015,49 @@ def build_floor_sets_host_only(doc_host):
         fsets.append(FloorSet(u"[HOST]", ident.Inverse, ident, top_h, bot_h))
     return fsets
 
+def _transform_key(T):
+    return [_r(v) for p in (T.Origin, T.BasisX, T.BasisY, T.BasisZ) for v in (p.X, p.Y, p.Z)]
+
+def run_signature(mode, room_link_inst, src_room_param, tgt_elem_param, floor_sets, host_levels):
+    """Подпись всего, что влияет на результат любого элемента"""
+    link_key = None
+    if room_link_inst is not None:
+        link_doc = room_link_inst.GetLinkDocument()
+        link_key = [link_doc.PathName or link_doc.Title, _transform_key(room_link_inst.GetTotalTransform())]
+    slabs = [[fs.name, _transform_key(fs.from_link),
+              [f.to_record() for f in fs.top_faces], [f.to_record() for f in fs.bottom_faces]]
+             for fs in floor_sets]
+    levels = [_r(L.Elevation) for L in host_levels]
+    return digest([mode, link_key, src_room_param, tgt_elem_param, GEOMETRY_CACHE_FORMAT,
+                   OUTSIDE_TXT, STEP_FT, API_NEAR_FT, digest(slabs), levels])
+
+def assigned_value(tester, el, src_room_param):
+    """Значение для элемента: помещения его точек через запятую или OUTSIDE_TXT"""
+    pts = element_sample_points(el)
+    if not pts:
+        return OUTSIDE_TXT
+
+    room_ids = set()
+    rooms_found = []
+    for rw in tester.rooms_for_points(pts):
+        rid = rw.room.Id.IntegerValue
+        if rid not in room_ids:
+            room_ids.add(rid)
+            rooms_found.append(rw.room)
+
+    if not rooms_found:
+        if DEBUG:
+            OUT.print_md(u"- Элемент {}: вне помещения ({} точек)".format(el.Id.IntegerValue, len(pts)))
+        return OUTSIDE_TXT
+
+    vals, seen_vals = [], set()
+    for r in rooms_found:
+        v = room_param_to_string(r, src_room_param).strip()
+        if v and v not in seen_vals:
+            seen_vals.add(v)
+            vals.append(v)
+    return u", ".join(vals) if vals else OUTSIDE_TXT
+
 def main():
     doc = revit.doc
 
@@ -708,6 +1075,8 @@ def main():
     set_ok = 0
     set_out = 0
     set_fail = 0
+    skipped = 0     # положение и помещения-кандидаты не менялись
+    same = 0        # пересчитано, но значение уже было верным
 
     if mode == MODE_IOS:
         ar_link = pick_ar_link(doc)
@@ -719,13 +1088,19 @@ def main():
         tgt_elem_param = choose_target_param_from_elems(elems, u"ADSK_Помещение")
 
         rooms = FilteredElementCollector(link_doc).OfCategory(BuiltInCategory.OST_Rooms)            .WhereElementIsNotElementType().ToElements()
-        wraps = [RoomWrap(link_doc, r) for r in rooms]
+        # Геометрия связи меняется редко: контуры и грани — из локального кэша
+        geo_cache = GeometryCache(link_doc, GEOMETRY_CACHE_FORMAT)
+        wraps = build_room_wraps(link_doc, rooms, geo_cache)
         if not wraps:
             forms.alert(u"Помещения в выбранной ссылке не найдены.", exitscript=True)
 
-        floor_sets = build_floor_sets_selected(doc, ar_link)
+        floor_sets = build_floor_sets_selected(doc, ar_link, geo_cache)
+        geo_cache.save()
+        if geo_cache.warm:
+            OUT.print_md(u"*Геометрия помещений и перекрытий связи взята из кэша.*")
         host_levels = get_sorted_host_levels(doc)
         tester = RealZRoomTester(doc, ar_link, wraps, floor_sets, host_levels)
+        room_link_inst = ar_link
         txname = u"ИОС: Помещение → MEP (AR link + Floors/Levels)"
     else:
         link_doc = doc
@@ -736,67 +1111,70 @@ def main():
         tgt_elem_param = choose_target_param_from_elems(elems, u"ADSK_Помещение")
 
         rooms = FilteredElementCollector(doc).OfCategory(BuiltInCategory.OST_Rooms)            .WhereElementIsNotElementType().ToElements()
-        wraps = [RoomWrap(doc, r) for r in rooms]
+        wraps = build_room_wraps(doc, rooms)
         if not wraps:
             forms.alert(u"Помещения в активной модели не найдены.", exitscript=True)
 
         floor_sets = build_floor_sets_host_only(doc)
         host_levels = get_sorted_host_levels(doc)
         tester = RealZRoomTester(doc, None, wraps, floor_sets, host_levels)
+        room_link_inst = None
         txname = u"АР: Помещение → Перекрытия (Host Rooms + Floors/Levels)"
 
+    # Повторный запуск: пересчитываются только элементы, у которых изменились
+    # положение, помещения вокруг или значение параметра с прошлого прогона
+    room_hash = dict((rw.room.Id.IntegerValue,
+                      digest([rw.to_record(), room_param_to_string(rw.room, src_room_param)]))
+                     for rw in wraps)
+    state = AssignmentState(doc, u"{0}|{1}".format(mode, tgt_elem_param), run_signature(
+        mode, room_link_inst, src_room_param, tgt_elem_param, floor_sets, host_levels))
+
     t = Transaction(doc, txname)
     t.Start()
     try:
         for el in elems:
             total += 1
-            pts = element_sample_points(el)
-            if not pts:
-                if set_elem_param_str(el, tgt_elem_param, OUTSIDE_TXT):
-                    set_out += 1
-                else:
-                    set_fail += 1
-                continue
-
-            room_ids = set()
-            rooms_found = []
-            for pth in pts:
-                for rw in wraps:
-                    if tester.elem_point_in_room(rw, pth):
-                        rid = rw.room.Id.IntegerValue
-                        if rid not in room_ids:
-                            room_ids.add(rid)
-                            rooms_found.append(rw.room)
-
-            if not rooms_found:
-                if DEBUG:
-                    OUT.print_md(u"- Элемент {}: вне помещения ({} точек)".format(el.Id.IntegerValue, len(pts)))
-                if set_elem_param_str(el, tgt_elem_param, OUTSIDE_TXT):
-                    set_out += 1
-                else:
-                    set_fail += 1
-                continue
-
-            vals, seen_vals = [], set()
-            for r in rooms_found:
-                v = room_param_to_string(r, src_room_param).strip()
-                if v and v not in seen_vals:
-                    seen_vals.add(v)
-                    vals.append(v)
-            joined = u", ".join(vals) if vals else OUTSIDE_TXT
+            eid = el.Id.IntegerValue
+            loc_key = element_location_key(el)
+            cands = tester.candidate_rooms_for_element(el) if loc_key is not None else None
+            record = None
+            if cands is not None:
+                cand_key = digest([room_hash.get(rw.room.Id.IntegerValue) for rw in cands])
+                record = [loc_key, cand_key, get_elem_param_str(el, tgt_elem_param)]
+                if state.unchanged(eid, record):
+                    state.keep(eid, record)
+                    skipped += 1
+                    continue
 
-            if set_elem_param_str(el, tgt_elem_param, joined):
-                set_ok += 1
+            value = assigned_value(tester, el, src_room_param)
+            if get_elem_param_str(el, tgt_elem_param) == value:
+                same += 1
+                ok = True
             else:
+                ok = set_elem_param_str(el, tgt_elem_param, value)
+            if not ok:
                 set_fail += 1
+                continue
+            if value == OUTSIDE_TXT:
+                set_out += 1
+            else:
+                set_ok += 1
+            if record is not None:
+                record[2] = value
+                state.keep(eid, record)
     finally:
         t.Commit()
+    state.save()
 
     OUT.print_md(u"### Готово")
     OUT.print_md(u"*Режим:* **{0}**".format(mode))
     OUT.print_md(u"*Всего элементов:* **{0}**".format(total))
     OUT.print_md(u"*Заполнено значением комнаты:* **{0}**".format(set_ok))
     OUT.print_md(u"*Поставлено \"{0}\":* **{1}**".format(OUTSIDE_TXT, set_out))
+    if skipped:
+        OUT.print_md(u"*Без изменений с прошлого запуска (не пересчитывались):* **{0}**".format(skipped))
+    if same:
+        OUT.print_md(u"*Пересчитано, значение уже было верным (не записывалось):* **{0}**".format(same))
     if set_fail:
         OUT.print_md(u"*Не удалось записать параметр (read-only/нет параметра):* **{0}**".format(set_fail))
 
@@ -8,12 +8,14 @@
 # Тип высотной отметки берется жестко: ADSK_Схема_Проектная_Отметка снизу_Вверх
 # Выноска горизонтальная, длина ~10 мм на листе.
 # Сторона (влево/вправо) выбирается по соседним МЭП-элементам на виде:
-# выноска ставится туда, где рядом меньше соседних элементов (без анализа аннотаций).
+# выноска ставится туда, где рядом меньше соседних элементов и уже поставленных отметок.
 #
 # Поддержка "Переместить элементы" (Displace Elements) на 3D виде:
 # Если элементы смещены для разнесённого вида, отметки ставятся с учётом смещения,
 # но значение отметки берётся от реальной позиции элемента.
 
+import math
+
 from Autodesk.Revit.DB import (
     XYZ,
     FilteredElementCollector,
@@ -26,21 +28,27 @@ from Autodesk.Revit.DB import (
     BuiltInCategory,
     ElementId,
     DisplacementElement,
-    View3D,
     AnnotationSymbol,
     IndependentTag,
     TagMode,
     TagOrientation,
-    Options,
-    Solid,
-    GeometryInstance,
+    Transaction,
+    TransactionGroup,
+    TransactionStatus,
+    SubTransaction,
+    IFailuresPreprocessor,
+    FailureProcessingResult,
+    FailureSeverity,
 )
 from Autodesk.Revit.DB.Plumbing import Pipe
 from Autodesk.Revit.DB.Mechanical import Duct
 from Autodesk.Revit.DB.Electrical import CableTray
 from Autodesk.Revit.UI import Selection
 from System.Collections.Generic import List
-from pyrevit import revit, forms
+from pyrevit import revit, forms, script
+
+from element_geometry import get_geometry
+from view_displacement import get_view_displacements
 
 doc = revit.doc
 uidoc = revit.uidoc
@@ -49,6 +57,9 @@ active_view = doc.ActiveView
 TOL = 1e-6
 SPOT_TYPE_NAME = u"ADSK_Схема_Проектная_Отметка снизу_Вверх"
 PAPER_LEADER_MM = 10.0  # длина выноски на листе, мм
+NEIGHBOR_SEARCH_FACTOR = 4.0  # радиус поиска соседей, в длинах выноски
+CHUNK_SIZE = 50  # отметок в одной транзакции
+REPORT_INLINE = 3  # сколько ошибок показывать в окне; полный список — в выводе
 
 # Имена марок для смещённых элементов (DisplacementElement)
 TAG_PIPE_NAME = u"ADSK_M_Трубы_Высотная отметка"
@@ -64,151 +75,6 @@ MEP_NEIGHBOR_CAT_IDS = set([
 
 # Кэш для смещений элементов на 3D виде (DisplacementElement)
 displacement_cache = {}  # element_id -> XYZ displacement
-displacement_elements_cache = {}  # displacement_element_id -> XYZ displacement
-displacement_error = None
-
-
-def build_displacement_cache():
-    """Построить словарь смещений для DisplacementElement на активном 3D виде."""
-    global displacement_cache, displacement_elements_cache, displacement_error
-    displacement_cache = {}
-    displacement_elements_cache = {}
-    displacement_error = None
-    
-    # Работает только на 3D видах
-    if not isinstance(active_view, View3D):
-        return
-    
-    view_id = active_view.Id
-    found_count = 0
-    debug_info = []
-    
-    try:
-        # Ищем все DisplacementElement в документе
-        all_elements = FilteredElementCollector(doc).WhereElementIsNotElementType().ToElements()
-        
-        for elem in all_elements:
-            disp_elem = None
-            try:
-                if elem.GetType().Name == "DisplacementElement":
-                    disp_elem = elem
-            except:
-                pass
-            
-            if disp_elem is None:
-                continue
-            
-            found_count += 1
-            disp_id = disp_elem.Id.IntegerValue
-            
-            try:
-                # Проверяем, принадлежит ли этот DisplacementElement нашему виду
-                try:
-                    owner_view_id = disp_elem.OwnerViewId
-                    if owner_view_id.IntegerValue != view_id.IntegerValue:
-                        continue
-                except:
-                    pass  # Если не удалось проверить - берём всё равно
-                
-                # Получаем смещение из параметров
-                disp_x = 0.0
-                disp_y = 0.0
-                disp_z = 0.0
-                
-                for p in disp_elem.Parameters:
-                    try:
-                        pname = p.Definition.Name
-                        if pname in [u"Смещение X", "Displacement X"]:
-                            disp_x = p.AsDouble()
-                        elif pname in [u"Смещение Y", "Displacement Y"]:
-                            disp_y = p.AsDouble()
-                        elif pname in [u"Смещение Z", "Displacement Z"]:
-                            disp_z = p.AsDouble()
-                    except:
-                        continue
-                
-                if abs(disp_x) < TOL and abs(disp_y) < TOL and abs(disp_z) < TOL:
-                    continue
-                
-                total_displacement = XYZ(disp_x, disp_y, disp_z)
-                displacement_elements_cache[disp_id] = total_displacement
-                
-                debug_info.append(u"DE#{0}: ({1:.1f}, {2:.1f}, {3:.1f})m".format(
-                    disp_id, disp_x * 0.3048, disp_y * 0.3048, disp_z * 0.3048))
-                        
-            except Exception as inner_ex:
-                debug_info.append(u"DE#{0}: error={1}".format(disp_id, str(inner_ex)))
-                continue
-        
-        if found_count == 0:
-            displacement_error = u"DisplacementElement не найдены"
-        else:
-            displacement_error = u"Найдено DE: {0}, с смещением: {1}\n{2}".format(
-                found_count, len(displacement_elements_cache), "\n".join(debug_info))
-                
-    except Exception as ex:
-        displacement_error = str(ex)
-
-
-def find_element_displacement(element):
-    """
-    Найти смещение для конкретного элемента, сравнивая его BoundingBox 
-    на виде с реальным положением.
-    """
-    if not displacement_elements_cache:
-        return XYZ(0, 0, 0)
-    
-    # Получаем реальное положение элемента (из Location)
-    real_pos = None
-    try:
-        loc = element.Location
-        if loc:
-            curve = getattr(loc, 'Curve', None)
-            if curve:
-                real_pos = curve.GetEndPoint(1)  # Конец элемента
-            else:
-                point = getattr(loc, 'Point', None)
-                if point:
-                    real_pos = point
-    except:
-        pass
-    
-    if real_pos is None:
-        return XYZ(0, 0, 0)
-    
-    # Получаем BoundingBox на виде (может быть смещён)
-    try:
-        bb = element.get_BoundingBox(active_view)
-        if bb and bb.Max:
-            view_pos = bb.Max  # Используем Max как приблизительную позицию
-            
-            # Вычисляем разницу (смещение)
-            diff = view_pos - real_pos
-            
-            # Проверяем, совпадает ли это смещение с каким-то DisplacementElement
-            for de_id, de_disp in displacement_elements_cache.items():
-                # Сравниваем с погрешностью
-                if (abs(diff.X - de_disp.X) < 0.1 and 
-                    abs(diff.Y - de_disp.Y) < 0.1 and 
-                    abs(diff.Z - de_disp.Z) < 0.1):
-                    return de_disp
-            
-            # Если точного совпадения нет, но есть значительное смещение - 
-            # берём ближайшее из имеющихся
-            if diff.GetLength() > 1.0:  # Больше ~30 см
-                best_match = None
-                best_dist = float('inf')
-                for de_id, de_disp in displacement_elements_cache.items():
-                    dist = (diff - de_disp).GetLength()
-                    if dist < best_dist:
-                        best_dist = dist
-                        best_match = de_disp
-                if best_match and best_dist < 10:  # В пределах ~3м погрешности
-                    return best_match
-    except:
-        pass
-    
-    return XYZ(0, 0, 0)
 
 
 def get_element_displacement(element_id):
@@ -354,11 +220,71 @@ def get_selected_elements():
     return elements
 
 
+class NeighborGrid(object):
+    """
+    Точки соседей в координатах вида (вдоль RightDirection / UpDirection),
+    разложенные по ячейкам хеш-сетки. Размер ячейки равен радиусу поиска,
+    поэтому запрос смотрит только соседние ячейки, а не весь список.
+    Поставленные отметки добавляются сюда же, чтобы следующие их обходили.
+    """
+    def __init__(self, view, cell):
+        right, up = view_axes(view)
+        self.right = (right.X, right.Y, right.Z)
+        self.up = (up.X, up.Y, up.Z)
+        self.cell = cell if cell > TOL else 1.0
+        self.cells = {}
+        self.log = []  # ключи ячеек в порядке добавления (для отката)
+
+    def _project(self, pt):
+        rx, ry, rz = self.right
+        ux, uy, uz = self.up
+        return (pt.X * rx + pt.Y * ry + pt.Z * rz,
+                pt.X * ux + pt.Y * uy + pt.Z * uz)
+
+    def _key(self, u, v):
+        return (int(math.floor(u / self.cell)), int(math.floor(v / self.cell)))
+
+    def add(self, nid, pt):
+        """nid — Id элемента (None для поставленных отметок)."""
+        u, v = self._project(pt)
+        key = self._key(u, v)
+        self.cells.setdefault(key, []).append((nid, u, v))
+        self.log.append(key)
+
+    def checkpoint(self):
+        return len(self.log)
+
+    def rollback(self, checkpoint):
+        """Убрать точки, добавленные после checkpoint (отметки откатанной транзакции)."""
+        while len(self.log) > checkpoint:
+            self.cells[self.log.pop()].pop()
+
+    def count_sides(self, origin, element_id, half):
+        """Число соседей слева и справа от origin в квадрате ±half на виде."""
+        ou, ov = self._project(origin)
+        i0, j0 = self._key(ou - half, ov - half)
+        i1, j1 = self._key(ou + half, ov + half)
+        left = right = 0
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for nid, u, v in self.cells.get((i, j), ()):
+                    if nid is not None and nid == element_id:
+                        continue
+                    du = u - ou
+                    if abs(du) > half or abs(v - ov) > half:
+                        continue
+                    if du > 0:
+                        right += 1
+                    elif du < 0:
+                        left += 1
+        return left, right
+
+
 def build_neighbor_points():
     """Собираем центры соседних МЭП-элементов на активном виде (для выбора стороны выноски)."""
-    neighbors = []
     if active_view is None:
-        return neighbors
+        return None
+    neighbors = NeighborGrid(active_view, leader_offset_ft(active_view) * NEIGHBOR_SEARCH_FACTOR)
 
     col = FilteredElementCollector(doc, active_view.Id).WhereElementIsNotElementType().ToElements()
 
@@ -375,7 +301,7 @@ def build_neighbor_points():
         if not isinstance(bb, BoundingBoxXYZ) or bb.Min is None or bb.Max is None:
             continue
         center = (bb.Min + bb.Max) * 0.5
-        neighbors.append((el.Id, center))
+        neighbors.add(el.Id, center)
     return neighbors
 
 
@@ -423,65 +349,42 @@ def get_bottom_face_reference(element, target_point):
     Возвращает (reference, point_on_face) или (None, None).
     """
     try:
-        opt = Options()
-        opt.ComputeReferences = True
-        opt.IncludeNonVisibleObjects = False
-
-        geom = element.get_Geometry(opt)
-        if geom is None:
+        geometry = get_geometry(element, fine=False, references=True)
+        if geometry.empty:
             return None, None
 
-        # Используем словарь для хранения результата (вместо nonlocal)
-        result = {'best_ref': None, 'best_point': None, 'best_z': float('inf')}
-
-        def process_solid(solid):
-            if solid is None:
-                return
-
-            faces = solid.Faces
-            for face in faces:
-                try:
-                    # Получаем BoundingBox грани
-                    bb = face.GetBoundingBox()
-                    if bb is None:
-                        continue
-
-                    # Получаем UV-параметры центра грани
-                    uv_min = bb.Min
-                    uv_max = bb.Max
-                    uv_mid = (uv_min + uv_max) * 0.5
+        best_ref, best_point, best_z = None, None, float('inf')
+        for face in geometry.faces():
+            try:
+                # Получаем BoundingBox грани
+                bb = face.GetBoundingBox()
+                if bb is None:
+                    continue
 
-                    # Получаем 3D точку на грани
-                    pt = face.Evaluate(uv_mid)
-                    if pt is None:
-                        continue
+                # Получаем UV-параметры центра грани
+                uv_mid = (bb.Min + bb.Max) * 0.5
 
-                    # Проверяем, что точка близка к target_point по X,Y
-                    dist_xy = ((pt.X - target_point.X)**2 + (pt.Y - target_point.Y)**2)**0.5
-                    if dist_xy > 1.0:  # ~30 см допуск
-                        continue
+                # Получаем 3D точку на грани
+                pt = face.Evaluate(uv_mid)
+                if pt is None:
+                    continue
 
-                    # Ищем грань с минимальной Z (самая нижняя)
-                    if pt.Z < result['best_z']:
-                        ref = face.Reference
-                        if ref is not None:
-                            result['best_z'] = pt.Z
-                            result['best_ref'] = ref
-                            result['best_point'] = pt
-                except:
+                # Проверяем, что точка близка к target_point по X,Y
+                dist_xy = ((pt.X - target_point.X)**2 + (pt.Y - target_point.Y)**2)**0.5
+                if dist_xy > 1.0:  # ~30 см допуск
                     continue
 
-        for geom_obj in geom:
-            if isinstance(geom_obj, Solid):
-                process_solid(geom_obj)
-            elif isinstance(geom_obj, GeometryInstance):
-                inst_geom = geom_obj.GetInstanceGeometry()
-                if inst_geom:
-                    for inst_obj in inst_geom:
-                        if isinstance(inst_obj, Solid):
-                            process_solid(inst_obj)
-
-        return result['best_ref'], result['best_point']
+                # Ищем грань с минимальной Z (самая нижняя)
+                if pt.Z < best_z:
+                    ref = face.Reference
+                    if ref is not None:
+                        best_z = pt.Z
+                        best_ref = ref
+                        best_point = pt
+            except:
+                continue
+
+        return best_ref, best_point
     except:
         return None, None
 
@@ -757,8 +660,8 @@ def project_point_to_view_plane(point, view):
     return point
 
 
-def choose_side_by_neighbors(view, origin, element_id, neighbors, offset_ft):
-    """Определяем, куда ставить выноску (влево/вправо) по соседним элементам."""
+def view_axes(view):
+    """Нормализованные направления вида вправо и вверх."""
     try:
         right = view.RightDirection
         up = view.UpDirection
@@ -771,29 +674,31 @@ def choose_side_by_neighbors(view, origin, element_id, neighbors, offset_ft):
     if up.GetLength() < TOL:
         up = XYZ(0, 1, 0)
 
-    right = right.Normalize()
-    up = up.Normalize()
+    return right.Normalize(), up.Normalize()
 
-    # Радиус поиска соседей — несколько длин выноски
-    search_half = offset_ft * 4.0
 
-    left_count = 0
-    right_count = 0
+def leader_offset_ft(view):
+    """Длина выноски PAPER_LEADER_MM на листе в футах модели для масштаба вида."""
+    try:
+        scale = view.Scale
+    except:
+        scale = 100
 
-    for nid, cpt in neighbors:
-        if nid == element_id:
-            continue
-        v = cpt - origin
-        dx = v.DotProduct(right)
-        dy = v.DotProduct(up)
+    offset_m = (PAPER_LEADER_MM / 1000.0) * float(scale)
+    return offset_m / 0.3048
 
-        if abs(dx) > search_half or abs(dy) > search_half:
-            continue
 
-        if dx > 0:
-            right_count += 1
-        elif dx < 0:
-            left_count += 1
+def choose_side_by_neighbors(view, origin, element_id, neighbors, offset_ft):
+    """Определяем, куда ставить выноску (влево/вправо) по соседним элементам."""
+    right, up = view_axes(view)
+
+    # Радиус поиска соседей — несколько длин выноски
+    search_half = offset_ft * NEIGHBOR_SEARCH_FACTOR
+
+    left_count = 0
+    right_count = 0
+    if neighbors is not None:
+        left_count, right_count = neighbors.count_sides(origin, element_id, search_half)
 
     # Сторона с меньшим количеством соседей
     if left_count < right_count:
@@ -806,16 +711,16 @@ def choose_side_by_neighbors(view, origin, element_id, neighbors, offset_ft):
     return right, side_sign
 
 
+def remember_mark(neighbors, point):
+    """Добавить поставленную отметку в сетку соседей."""
+    if neighbors is not None and point is not None:
+        neighbors.add(None, point)
+
+
 def get_leader_points(view, origin, element_id, neighbors, extra_offset_vec=None):
     # Горизонтальная выноска длиной ~10 мм на листе.
     # extra_offset_vec - дополнительное смещение (напр. от края воздуховода)
-    try:
-        scale = view.Scale
-    except:
-        scale = 100
-
-    offset_m = (PAPER_LEADER_MM / 1000.0) * float(scale)
-    offset_ft = offset_m / 0.3048
+    offset_ft = leader_offset_ft(view)
 
     right, side_sign = choose_side_by_neighbors(view, origin, element_id, neighbors, offset_ft)
     right_norm = right.Normalize()
@@ -843,28 +748,38 @@ def get_leader_points(view, origin, element_id, neighbors, extra_offset_vec=None
     return bend, end, side_sign
 
 
+_tag_symbols = {}  # имя семейства -> FamilySymbol (или None)
+
+
 def get_annotation_symbol_by_name(family_name):
     """Найти типоразмер аннотационного семейства по имени семейства."""
     if not family_name:
         return None
-    
-    # Ищем среди всех FamilySymbol
-    collector = FilteredElementCollector(doc).OfClass(FamilySymbol).ToElements()
-    
-    for symbol in collector:
+
+    if family_name not in _tag_symbols:
+        found = None
+        # Ищем среди всех FamilySymbol — один раз за запуск
+        collector = FilteredElementCollector(doc).OfClass(FamilySymbol).ToElements()
+        for symbol in collector:
+            try:
+                # Проверяем имя семейства
+                family = symbol.Family
+                if family and family.Name == family_name:
+                    found = symbol
+                    break
+            except:
+                continue
+        _tag_symbols[family_name] = found
+
+    symbol = _tag_symbols[family_name]
+    # Активируем, если не активен (активация могла откатиться вместе с транзакцией)
+    if symbol is not None and not symbol.IsActive:
         try:
-            # Проверяем имя семейства
-            family = symbol.Family
-            if family and family.Name == family_name:
-                # Активируем, если не активен
-                if not symbol.IsActive:
-                    symbol.Activate()
-                    doc.Regenerate()
-                return symbol
+            symbol.Activate()
+            doc.Regenerate()
         except:
-            continue
-    
-    return None
+            return None
+    return symbol
 
 
 def get_tag_symbol_for_element(element):
@@ -930,6 +845,7 @@ def create_elevation_annotation(view, element, point, neighbors, failed_elements
                 tag.TagHeadPosition = end
             except:
                 pass
+            remember_mark(neighbors, end)
         
         return tag
     except Exception as e:
@@ -995,6 +911,7 @@ def create_spot_elevation(view, spot_type, element, point, neighbors, failed_ele
         ref_pt = base_origin
 
     spot = None
+    placed_at = None
     
     # Для смещённых элементов - создаём БЕЗ выноски, иначе выноска пойдёт к реальной геометрии
     if is_displaced:
@@ -1009,6 +926,7 @@ def create_spot_elevation(view, spot_type, element, point, neighbors, failed_ele
                 ref_pt,  # точка отсчёта высоты
                 False    # hasLeader = False
             )
+            placed_at = origin
         except Exception as e:
             if failed_elements is not None:
                 failed_elements.append((element, u"Ошибка (displaced): {}".format(str(e))))
@@ -1025,6 +943,7 @@ def create_spot_elevation(view, spot_type, element, point, neighbors, failed_ele
                 ref_pt,
                 True  # hasLeader
             )
+            placed_at = end
         except Exception as e1:
             # fallback: без выноски
             try:
@@ -1037,6 +956,7 @@ def create_spot_elevation(view, spot_type, element, point, neighbors, failed_ele
                     ref_pt,
                     False
                 )
+                placed_at = origin
             except Exception as e2:
                 if failed_elements is not None:
                     cat_name = u"?"
@@ -1052,9 +972,133 @@ def create_spot_elevation(view, spot_type, element, point, neighbors, failed_ele
     except:
         pass
 
+    # Следующие отметки будут обходить эту
+    remember_mark(neighbors, placed_at)
+
     return spot
 
 
+class MarkFailuresPreprocessor(IFailuresPreprocessor):
+    """
+    Предупреждения удаляем, чтобы транзакция не поднимала диалоги.
+    При ошибке откатываем порцию без диалога — её отметки повторяются поштучно.
+    """
+    def PreprocessFailures(self, accessor):
+        has_errors = False
+        for f in list(accessor.GetFailureMessages()):
+            if f.GetSeverity() == FailureSeverity.Warning:
+                accessor.DeleteWarning(f)
+            else:
+                has_errors = True
+        if has_errors:
+            return FailureProcessingResult.ProceedWithRollBack
+        return FailureProcessingResult.Continue
+
+
+def place_mark(view, spot_type, job, neighbors, failed_elements):
+    """Поставить одну отметку: марку для смещённого элемента, иначе SpotElevation."""
+    el, pt, extra_offset, use_bottom_ref, real_z = job
+    if el.Id.IntegerValue in displacement_cache:
+        # Для смещённых элементов используем аннотационную марку с выноской
+        return create_elevation_annotation(view, el, pt, neighbors, failed_elements)
+    return create_spot_elevation(view, spot_type, el, pt, neighbors, failed_elements,
+                                 extra_offset, use_bottom_ref, real_z, False)
+
+
+def run_chunk(view, spot_type, jobs, neighbors):
+    """
+    Поставить порцию отметок в одной транзакции.
+    Каждая отметка — в своей подтранзакции: исключение откатывает только её.
+    Возвращает (порция зафиксирована, [Id созданных], [(элемент, причина)]).
+    """
+    created = []
+    failed_elements = []
+    checkpoint = neighbors.checkpoint() if neighbors is not None else 0
+
+    t = Transaction(doc, u"Высотные отметки Spot Elevation")
+    t.Start()
+    fho = t.GetFailureHandlingOptions()
+    fho.SetFailuresPreprocessor(MarkFailuresPreprocessor())
+    fho.SetClearAfterRollback(True)
+    t.SetFailureHandlingOptions(fho)
+    try:
+        for job in jobs:
+            st = SubTransaction(doc)
+            st.Start()
+            try:
+                mark = place_mark(view, spot_type, job, neighbors, failed_elements)
+            except Exception as e:
+                mark = None
+                failed_elements.append((job[0], u"Ошибка: {}".format(str(e))))
+            if mark is not None:
+                st.Commit()
+                created.append(mark.Id)
+            else:
+                st.RollBack()
+        status = t.Commit()
+    except Exception:
+        if t.HasStarted() and not t.HasEnded():
+            t.RollBack()
+        status = TransactionStatus.RolledBack
+
+    committed = status == TransactionStatus.Committed
+    if not committed and neighbors is not None:
+        # Отметки откатанной порции не должны отталкивать следующие
+        neighbors.rollback(checkpoint)
+    return committed, created, failed_elements
+
+
+def place_marks(view, spot_type, jobs, neighbors):
+    """
+    Поставить все отметки порциями по CHUNK_SIZE внутри одной группы транзакций
+    (в истории отмены — одно действие). Если Revit отклонил порцию при фиксации,
+    её отметки повторяются поштучно, и пропускается только проблемная.
+    Возвращает ([Id созданных], [(элемент, причина)]).
+    """
+    created = []
+    failed_elements = []
+    pending = [jobs[i:i + CHUNK_SIZE] for i in range(0, len(jobs), CHUNK_SIZE)]
+
+    tg = TransactionGroup(doc, u"Высотные отметки Spot Elevation")
+    tg.Start()
+    try:
+        while pending:
+            chunk = pending.pop(0)
+            committed, ids, errors = run_chunk(view, spot_type, chunk, neighbors)
+            if committed:
+                created.extend(ids)
+                failed_elements.extend(errors)
+            elif len(chunk) > 1:
+                pending[0:0] = [[job] for job in chunk]
+            else:
+                failed_elements.extend(errors or [
+                    (chunk[0][0], u"Revit отклонил отметку при фиксации транзакции")])
+    finally:
+        if created:
+            tg.Assimilate()
+        else:
+            tg.RollBack()
+
+    return created, failed_elements
+
+
+def report_failures(failed_elements):
+    """Полный список пропущенных отметок — в окне вывода pyRevit."""
+    output = script.get_output()
+    rows = []
+    for el, reason in failed_elements:
+        try:
+            link = output.linkify(el.Id)
+        except:
+            link = u"?"
+        rows.append([link, reason])
+    output.print_table(
+        table_data=rows,
+        title=u"Пропущенные высотные отметки",
+        columns=[u"Элемент", u"Причина"]
+    )
+
+
 def main():
     if active_view is None:
         forms.alert(u"Нет активного вида.", exitscript=True)
@@ -1078,92 +1122,79 @@ def main():
         mode = m
 
     # Строим кэш смещений для 3D вида (DisplacementElement)
-    build_displacement_cache()
-    
-    # Для каждого выбранного элемента определяем его смещение
+    displacements = get_view_displacements(doc, active_view)
+
+    # Для каждого выбранного элемента берём его смещение
     for el in elements:
-        disp = find_element_displacement(el)
-        if disp.GetLength() > TOL:
+        disp = displacements.get(el.Id)
+        if disp is not None:
             displacement_cache[el.Id.IntegerValue] = disp
     
     # Подсчитываем, сколько выбранных элементов смещены
     displaced_count = sum(1 for el in elements if el.Id.IntegerValue in displacement_cache)
 
-    # Список соседей для всех элементов на виде
+    # Сетка соседей для всех элементов на виде (пополняется поставленными отметками)
     neighbors = build_neighbor_points()
 
-    created_count = 0
-    created_ids = []
-    failed_elements = []
+    # Сначала собираем точки всех отметок (только чтение модели),
+    # затем ставим их порциями
+    jobs = []  # (элемент, point, extra_offset_info, use_bottom_ref, real_z)
     skipped_no_point = 0
 
-    with revit.Transaction(u"Высотные отметки Spot Elevation"):
-        for el in elements:
-            pts_data = []  # Список кортежей (point, extra_offset_info, use_bottom_ref, real_z)
-            use_bottom = (mode == 'bottom')  # Для труб в режиме "низ"
-
-            if isinstance(el, Pipe):
-                # Для труб: возвращает кортежи (displaced_point, real_z)
-                pipe_pts = get_pipe_points(el, mode)
-                for item in pipe_pts:
-                    if isinstance(item, tuple) and len(item) == 2:
-                        pt, real_z = item
-                        pts_data.append((pt, None, use_bottom, real_z))
-                    else:
-                        # Обратная совместимость (если старый формат)
-                        pts_data.append((item, None, use_bottom, None))
-            elif isinstance(el, Duct):
-                # Для воздуховодов:
-                # Круглые: (displaced_point, real_z)
-                # Прямоугольные: (displaced_point, perp, offset, real_z)
-                duct_result = get_duct_points(el)
-                for item in duct_result:
-                    if isinstance(item, tuple) and len(item) == 4:
-                        # Прямоугольный воздуховод: (point, perp, offset, real_z)
-                        pt, perp, offset, real_z = item
-                        pts_data.append((pt, (perp, offset), True, real_z))
-                    elif isinstance(item, tuple) and len(item) == 2:
-                        # Круглый воздуховод: (displaced_point, real_z)
-                        pt, real_z = item
-                        pts_data.append((pt, None, True, real_z))
-                    else:
-                        # Обратная совместимость
-                        pts_data.append((item, None, True, None))
-            elif isinstance(el, CableTray):
-                # Для кабельных лотков: (displaced_point, perp, offset, real_z)
-                tray_result = get_cable_tray_points(el)
-                for item in tray_result:
-                    if isinstance(item, tuple) and len(item) == 4:
-                        pt, perp, offset, real_z = item
-                        pts_data.append((pt, (perp, offset), True, real_z))
-                    elif isinstance(item, tuple) and len(item) == 3:
-                        # Старый формат без real_z
-                        pt, perp, offset = item
-                        pts_data.append((pt, (perp, offset), True, None))
-                    else:
-                        pts_data.append((item, None, True, None))
-
-            for pt_info in pts_data:
-                if pt_info is None:
-                    continue
-                pt, extra_offset, use_bottom_ref, real_z = pt_info
-                if pt is None:
-                    continue
-                # Проверяем, смещён ли элемент
-                is_displaced = el.Id.IntegerValue in displacement_cache
-                
-                if is_displaced:
-                    # Для смещённых элементов используем аннотационную марку с выноской
-                    annotation = create_elevation_annotation(active_view, el, pt, neighbors, failed_elements)
-                    if annotation:
-                        created_count += 1
-                        created_ids.append(annotation.Id)
+    for el in elements:
+        pts_data = []  # Список кортежей (point, extra_offset_info, use_bottom_ref, real_z)
+        use_bottom = (mode == 'bottom')  # Для труб в режиме "низ"
+
+        if isinstance(el, Pipe):
+            # Для труб: возвращает кортежи (displaced_point, real_z)
+            pipe_pts = get_pipe_points(el, mode)
+            for item in pipe_pts:
+                if isinstance(item, tuple) and len(item) == 2:
+                    pt, real_z = item
+                    pts_data.append((pt, None, use_bottom, real_z))
+                else:
+                    # Обратная совместимость (если старый формат)
+                    pts_data.append((item, None, use_bottom, None))
+        elif isinstance(el, Duct):
+            # Для воздуховодов:
+            # Круглые: (displaced_point, real_z)
+            # Прямоугольные: (displaced_point, perp, offset, real_z)
+            duct_result = get_duct_points(el)
+            for item in duct_result:
+                if isinstance(item, tuple) and len(item) == 4:
+                    # Прямоугольный воздуховод: (point, perp, offset, real_z)
+                    pt, perp, offset, real_z = item
+                    pts_data.append((pt, (perp, offset), True, real_z))
+                elif isinstance(item, tuple) and len(item) == 2:
+                    # Круглый воздуховод: (displaced_point, real_z)
+                    pt, real_z = item
+                    pts_data.append((pt, None, True, real_z))
                 else:
-                    # Для обычных элементов используем SpotElevation
-                    spot = create_spot_elevation(active_view, spot_type, el, pt, neighbors, failed_elements, extra_offset, use_bottom_ref, real_z, is_displaced)
-                    if spot:
-                        created_count += 1
-                        created_ids.append(spot.Id)
+                    # Обратная совместимость
+                    pts_data.append((item, None, True, None))
+        elif isinstance(el, CableTray):
+            # Для кабельных лотков: (displaced_point, perp, offset, real_z)
+            tray_result = get_cable_tray_points(el)
+            for item in tray_result:
+                if isinstance(item, tuple) and len(item) == 4:
+                    pt, perp, offset, real_z = item
+                    pts_data.append((pt, (perp, offset), True, real_z))
+                elif isinstance(item, tuple) and len(item) == 3:
+                    # Старый формат без real_z
+                    pt, perp, offset = item
+                    pts_data.append((pt, (perp, offset), True, None))
+                else:
+                    pts_data.append((item, None, True, None))
+
+        for pt_info in pts_data:
+            if pt_info is None or pt_info[0] is None:
+                skipped_no_point += 1
+                continue
+            pt, extra_offset, use_bottom_ref, real_z = pt_info
+            jobs.append((el, pt, extra_offset, use_bottom_ref, real_z))
+
+    created_ids, failed_elements = place_marks(active_view, spot_type, jobs, neighbors)
+    created_count = len(created_ids)
 
     # Выделяем созданные отметки, чтобы было проще их найти
     if created_ids:
@@ -1181,15 +1212,16 @@ def main():
         msg += u"\nПропущено (не удалось определить точку): {0}".format(skipped_no_point)
     if failed_elements:
         msg += u"\nНе удалось создать отметку для {0} элементов:".format(len(failed_elements))
-        # Показываем первые 3 ошибки
-        for i, (el, reason) in enumerate(failed_elements[:3]):
+        # Показываем первые ошибки, полный список — в окне вывода
+        for i, (el, reason) in enumerate(failed_elements[:REPORT_INLINE]):
             try:
                 el_id = el.Id.IntegerValue
             except:
                 el_id = "?"
             msg += u"\n  - ID {}: {}".format(el_id, reason)
-        if len(failed_elements) > 3:
-            msg += u"\n  ... и ещё {}".format(len(failed_elements) - 3)
+        if len(failed_elements) > REPORT_INLINE:
+            msg += u"\n  ... и ещё {} (список — в окне вывода)".format(len(failed_elements) - REPORT_INLINE)
+            report_failures(failed_elements)
 
     forms.alert(msg)
 
@@ -9,13 +9,15 @@ clr.AddReference("RevitAPI")
 clr.AddReference("RevitAPIUI")
 
 from Autodesk.Revit.DB import (
-    FilteredElementCollector, BuiltInCategory, ViewType, View3D, XYZ, Level,
+    FilteredElementCollector, BuiltInCategory, ViewType, XYZ, Level,
     Transaction, ElementCategoryFilter, ConnectorType, ElementTransformUtils,
     UnitUtils, UnitTypeId, FamilyInstance, BuiltInParameter, DisplacementElement
 )
 from Autodesk.Revit.UI.Selection import ISelectionFilter, ObjectType
 from pyrevit import revit, forms
 
+from view_displacement import get_view_displacements
+
 uidoc = __revit__.ActiveUIDocument  # noqa
 doc = uidoc.Document
 view = doc.ActiveView
@@ -37,7 +39,6 @@ FAMILY_NAME = u"ТипАн_Мрк_B4E_Уровень"
 # Кэш для смещений элементов (DisplacementElement)
 TOL = 1e-6
 displacement_cache = {}  # element_id -> XYZ displacement
-displacement_elements_cache = {}  # displacement_element_id -> XYZ displacement
 
 
 def in_any_category(elem, cats):
@@ -47,120 +48,6 @@ def in_any_category(elem, cats):
         return False
 
 
-def build_displacement_cache():
-    """Построить словарь смещений для DisplacementElement на активном 3D виде."""
-    global displacement_cache, displacement_elements_cache
-    displacement_cache = {}
-    displacement_elements_cache = {}
-    
-    if not isinstance(view, View3D):
-        return
-    
-    view_id = view.Id
-    
-    try:
-        all_elements = FilteredElementCollector(doc).WhereElementIsNotElementType().ToElements()
-        
-        for elem in all_elements:
-            disp_elem = None
-            try:
-                if elem.GetType().Name == "DisplacementElement":
-                    disp_elem = elem
-            except:
-                pass
-            
-            if disp_elem is None:
-                continue
-            
-            disp_id = disp_elem.Id.IntegerValue
-            
-            try:
-                try:
-                    owner_view_id = disp_elem.OwnerViewId
-                    if owner_view_id.IntegerValue != view_id.IntegerValue:
-                        continue
-                except:
-                    pass
-                
-                disp_x = 0.0
-                disp_y = 0.0
-                disp_z = 0.0
-                
-                for p in disp_elem.Parameters:
-                    try:
-                        pname = p.Definition.Name
-                        if pname in [u"Смещение X", "Displacement X"]:
-                            disp_x = p.AsDouble()
-                        elif pname in [u"Смещение Y", "Displacement Y"]:
-                            disp_y = p.AsDouble()
-                        elif pname in [u"Смещение Z", "Displacement Z"]:
-                            disp_z = p.AsDouble()
-                    except:
-                        continue
-                
-                if abs(disp_x) < TOL and abs(disp_y) < TOL and abs(disp_z) < TOL:
-                    continue
-                
-                total_displacement = XYZ(disp_x, disp_y, disp_z)
-                displacement_elements_cache[disp_id] = total_displacement
-                        
-            except:
-                continue
-                
-    except:
-        pass
-
-
-def find_element_displacement(element):
-    """Найти смещение для элемента, сравнивая BoundingBox на виде с реальным положением."""
-    if not displacement_elements_cache:
-        return XYZ(0, 0, 0)
-    
-    real_pos = None
-    try:
-        loc = element.Location
-        if loc:
-            curve = getattr(loc, 'Curve', None)
-            if curve:
-                real_pos = curve.GetEndPoint(1)
-            else:
-                point = getattr(loc, 'Point', None)
-                if point:
-                    real_pos = point
-    except:
-        pass
-    
-    if real_pos is None:
-        return XYZ(0, 0, 0)
-    
-    try:
-        bb = element.get_BoundingBox(view)
-        if bb and bb.Max:
-            view_pos = bb.Max
-            diff = view_pos - real_pos
-            
-            for de_id, de_disp in displacement_elements_cache.items():
-                if (abs(diff.X - de_disp.X) < 0.1 and 
-                    abs(diff.Y - de_disp.Y) < 0.1 and 
-                    abs(diff.Z - de_disp.Z) < 0.1):
-                    return de_disp
-            
-            if diff.GetLength() > 1.0:
-                best_match = None
-                best_dist = float('inf')
-                for de_id, de_disp in displacement_elements_cache.items():
-                    dist = (diff - de_disp).GetLength()
-                    if dist < best_dist:
-                        best_dist = dist
-                        best_match = de_disp
-                if best_match and best_dist < 10:
-                    return best_match
-    except:
-        pass
-    
-    return XYZ(0, 0, 0)
-
-
 def get_element_displacement(element_id):
     """Получить вектор смещения для элемента."""
     if element_id.IntegerValue in displacement_cache:
@@ -439,12 +326,12 @@ def main():
     levels = get_levels_user_choice()
 
     # Строим кэш смещений для DisplacementElement
-    build_displacement_cache()
-    
-    # Для каждого элемента определяем его смещение
+    displacements = get_view_displacements(doc, view)
+
+    # Для каждого элемента берём его смещение
     for el in elements:
-        disp = find_element_displacement(el)
-        if disp.GetLength() > TOL:
+        disp = displacements.get(el.Id)
+        if disp is not None:
             displacement_cache[el.Id.IntegerValue] = disp
 
     placed = 0
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+clash_clusters.py — пространственная кластеризация коллизий Navisworks по точке конфликта.
+
+Тысячи коллизий в отчёте часто являются одной проблемой трассировки: один
+воздуховод пересекает десяток труб на одном участке. Модуль группирует
+близкие коллизии с одинаковой парой элементов (или парой категорий) в один
+кластер, который можно просмотреть как один пункт.
+
+Алгоритм — равномерная сетка (spatial hash) + система непересекающихся
+множеств. Размер ячейки r/√3, поэтому любые две точки одной ячейки лежат
+в пределах радиуса и объединяются без попарных проверок; соседние ячейки
+(±2 по каждой оси) проверяются только пока их множества не слились.
+Время работы почти линейно по числу коллизий.
+
+Модуль не зависит от Revit API и работает в IronPython и CPython.
+"""
+
+import math
+
+# Режимы группировки
+MODE_PAIR = 'pair'            # одна и та же пара элементов
+MODE_CATEGORY = 'category'    # одна и та же пара категорий
+
+DEFAULT_RADIUS = 0.5          # в единицах отчёта (обычно метры)
+
+# Смещения соседних ячеек: при размере ячейки r/√3 точки в пределах r
+# могут отстоять не более чем на 2 ячейки по каждой оси
+_NEIGHBOR_OFFSETS = [
+    (dx, dy, dz)
+    for dx in (-2, -1, 0, 1, 2)
+    for dy in (-2, -1, 0, 1, 2)
+    for dz in (-2, -1, 0, 1, 2)
+    if (dx, dy, dz) > (0, 0, 0)
+]
+
+
+class _DisjointSet(object):
+    """Система непересекающихся множеств со сжатием путей."""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+
+    def find(self, i):
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return ra
+        if self.rank[ra] < self.rank[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        if self.rank[ra] == self.rank[rb]:
+            self.rank[ra] += 1
+        return ra
+
+
+def parse_point(x, y, z):
+    """Преобразует атрибуты pos3f в кортеж (x, y, z) или None."""
+    try:
+        return (float(x), float(y), float(z))
+    except (TypeError, ValueError):
+        return None
+
+
+def pair_key(id_a, id_b):
+    """Ключ пары элементов без учёта порядка."""
+    a = u'{}'.format(id_a if id_a is not None else u'')
+    b = u'{}'.format(id_b if id_b is not None else u'')
+    return (a, b) if a <= b else (b, a)
+
+
+def category_key(cat_a, cat_b):
+    """Ключ пары категорий без учёта порядка и регистра."""
+    a = (cat_a or u'').strip().lower()
+    b = (cat_b or u'').strip().lower()
+    return (a, b) if a <= b else (b, a)
+
+
+def cluster_points(points, keys, radius=DEFAULT_RADIUS):
+    """
+    Группирует точки с одинаковым ключом, лежащие ближе radius друг к другу.
+
+    points — список (x, y, z) или None; keys — список хешируемых ключей той же длины.
+    Возвращает список номеров кластеров (0..N-1) в порядке входных точек.
+    Точки без координат образуют собственные кластеры.
+    """
+    count = len(points)
+    dsu = _DisjointSet(count)
+    if radius and radius > 0:
+        cell_size = float(radius) / math.sqrt(3.0)
+        radius_sq = float(radius) * float(radius)
+
+        # Ячейка -> индекс первой точки (все точки ячейки сразу объединяются)
+        cells = {}
+        for i in range(count):
+            pt = points[i]
+            if pt is None:
+                continue
+            cell = (keys[i],
+                    int(math.floor(pt[0] / cell_size)),
+                    int(math.floor(pt[1] / cell_size)),
+                    int(math.floor(pt[2] / cell_size)))
+            members = cells.get(cell)
+            if members is None:
+                cells[cell] = [i]
+            else:
+                dsu.union(members[0], i)
+                members.append(i)
+
+        for cell, members in cells.items():
+            key, cx, cy, cz = cell
+            for dx, dy, dz in _NEIGHBOR_OFFSETS:
+                other = cells.get((key, cx + dx, cy + dy, cz + dz))
+                if other is None:
+                    continue
+                _link_cells(dsu, points, members, other, radius_sq)
+
+    roots = {}
+    labels = []
+    for i in range(count):
+        root = dsu.find(i)
+        label = roots.get(root)
+        if label is None:
+            label = len(roots)
+            roots[root] = label
+        labels.append(label)
+    return labels
+
+
+def _link_cells(dsu, points, members, other, radius_sq):
+    """Объединяет две ячейки, если в них есть пара точек ближе радиуса."""
+    if dsu.find(members[0]) == dsu.find(other[0]):
+        return
+    for i in members:
+        xi, yi, zi = points[i]
+        for j in other:
+            xj, yj, zj = points[j]
+            dx = xi - xj
+            dy = yi - yj
+            dz = zi - zj
+            if dx * dx + dy * dy + dz * dz <= radius_sq:
+                dsu.union(i, j)
+                return
+
+
+def cluster_rows(rows, point_of, key_of, radius=DEFAULT_RADIUS):
+    """
+    Кластеризует строки отчёта.
+
+    point_of(row) -> (x, y, z) или None, key_of(row) -> ключ группировки.
+    Возвращает список кластеров (списков строк), отсортированный по убыванию
+    размера; порядок строк внутри кластера сохраняется.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    labels = cluster_points([point_of(r) for r in rows], [key_of(r) for r in rows], radius)
+
+    clusters = {}
+    order = []
+    for row, label in zip(rows, labels):
+        bucket = clusters.get(label)
+        if bucket is None:
+            bucket = clusters[label] = []
+            order.append(label)
+        bucket.append(row)
+
+    result = [clusters[label] for label in order]
+    result.sort(key=lambda c: -len(c))
+    return result
+
+
+def cluster_centroid(points):
+    """Центр масс непустых точек кластера или None."""
+    pts = [p for p in points if p is not None]
+    if not pts:
+        return None
+    n = float(len(pts))
+    return (sum(p[0] for p in pts) / n,
+            sum(p[1] for p in pts) / n,
+            sum(p[2] for p in pts) / n)
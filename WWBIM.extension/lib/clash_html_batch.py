@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+clash_html_batch.py — пакетная сборка HTML-отчётов по коллизиям вне Revit.
+
+Обходит папку с XML-отчётами Navisworks и для каждого строит HTML-отчёт
+с динамикой (то же, что кнопка «Анализ отчёта HTML»). Работает в обычном
+CPython (Windows/Linux), отчёты собираются параллельно в нескольких
+процессах. Неизменившиеся отчёты пропускаются: подпись (размер и дата XML
+плюс набор исторических отчётов) и агрегаты истории хранятся в
+.clash_html_batch.json в корне папки.
+
+    python clash_html_batch.py <папка> [--workers N] [--history N] [--force]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from clash_html_report import find_history_paths, generate_report, history_cache_key
+
+MANIFEST_NAME = '.clash_html_batch.json'
+MANIFEST_VERSION = 1
+
+
+def _load_manifest(path):
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == MANIFEST_VERSION:
+            return data
+    except Exception:
+        pass
+    return {'version': MANIFEST_VERSION, 'reports': {}, 'history': {}}
+
+
+def _save_manifest(path, data):
+    tmp = path + '.tmp'
+    with io.open(tmp, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, ensure_ascii=False, indent=1))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+def find_reports(root):
+    """Все XML-отчёты в папке (рекурсивно)."""
+    found = []
+    for folder, dirs, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith('.xml'):
+                found.append(os.path.join(folder, name))
+    found.sort()
+    return found
+
+
+def report_signature(xml_path, history_paths):
+    """Подпись отчёта: меняется при изменении XML или набора истории."""
+    st = os.stat(xml_path)
+    parts = [u'{0}:{1}'.format(st.st_size, st.st_mtime)]
+    parts.extend(history_cache_key(p, mt) for p, mt in history_paths)
+    return u'\n'.join(parts)
+
+
+def _output_path(xml_path):
+    return os.path.splitext(xml_path)[0] + u'_report.html'
+
+
+def _build_one(task):
+    """Задача рабочего процесса: собрать один отчёт."""
+    xml_path, history_limit, cached = task
+    cache = dict(cached)
+    started = time.time()
+    try:
+        outpath, rows, history = generate_report(xml_path, history_limit, history_cache=cache)
+    except Exception as ex:
+        return xml_path, None, u'{0}'.format(ex), {}, time.time() - started
+    new_entries = dict((k, v) for k, v in cache.items() if k not in cached)
+    return xml_path, outpath, None, new_entries, time.time() - started
+
+
+def run(root, workers=None, history_limit=5, force=False):
+    root = os.path.abspath(root)
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    reports = manifest['reports']
+    history_cache = manifest['history']
+
+    tasks = []
+    signatures = {}
+    skipped = 0
+    for xml_path in find_reports(root):
+        rel = os.path.relpath(xml_path, root)
+        history_paths = find_history_paths(xml_path, history_limit)
+        sig = report_signature(xml_path, history_paths)
+        known = reports.get(rel)
+        if (not force and known and known.get('sig') == sig
+                and (known.get('html') is None or os.path.exists(_output_path(xml_path)))):
+            skipped += 1
+            continue
+        signatures[xml_path] = sig
+        keys = [history_cache_key(p, mt) for p, mt in history_paths]
+        cached = dict((k, history_cache[k]) for k in keys if k in history_cache)
+        tasks.append((xml_path, history_limit, cached))
+
+    print(u'Отчётов: {0}, к сборке: {1}, без изменений: {2}'.format(
+        len(tasks) + skipped, len(tasks), skipped))
+    if not tasks:
+        return 0
+
+    workers = max(1, min(workers or multiprocessing.cpu_count(), len(tasks)))
+    failed = 0
+    if workers == 1:
+        results = map(_build_one, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_build_one, tasks)
+
+    try:
+        for xml_path, outpath, error, new_entries, elapsed in results:
+            rel = os.path.relpath(xml_path, root)
+            history_cache.update(new_entries)
+            if error:
+                failed += 1
+                print(u'[ОШИБКА] {0}: {1}'.format(rel, error))
+                continue
+            if outpath is None:
+                # Не отчёт о коллизиях или пустой отчёт — запоминаем, чтобы не разбирать снова
+                reports[rel] = {'sig': signatures[xml_path], 'html': None}
+                print(u'[ПУСТО] {0}'.format(rel))
+                continue
+            reports[rel] = {'sig': signatures[xml_path], 'html': os.path.relpath(outpath, root)}
+            print(u'[OK] {0} ({1:.1f} с)'.format(rel, elapsed))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _save_manifest(manifest_path, manifest)
+
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Пакетная сборка HTML-отчётов по коллизиям Navisworks.')
+    parser.add_argument('folder', help=u'папка с XML-отчётами (обходится рекурсивно)')
+    parser.add_argument('--workers', type=int, default=None, help=u'число процессов (по умолчанию — число ядер)')
+    parser.add_argument('--history', type=int, default=5, help=u'сколько последних отчётов брать в динамику')
+    parser.add_argument('--force', action='store_true', help=u'пересобрать все отчёты')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.folder):
+        parser.error(u'папка не найдена: {0}'.format(args.folder))
+    return run(args.folder, args.workers, args.history, args.force)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+clash_images.py — кэш превью снимков коллизий, адресуемый по содержимому.
+
+Navisworks кладёт к каждому отчёту по снимку на коллизию, и с каждой новой
+датой отчёта их становится всё больше. Кэш хранит уменьшенные превью в
+общей папке рядом с папками-датами (.clash_thumbs), имя превью — хеш
+содержимого исходного снимка. Одинаковые снимки из разных прогонов
+превращаются в одно превью, повторно превью не строятся, а полноразмерный
+снимок отчёт загружает только по клику.
+
+Хеш файла запоминается в index.json по (путь, размер, дата изменения),
+поэтому неизменные снимки при повторных прогонах не перечитываются.
+Уменьшение — System.Drawing в IronPython или Pillow в CPython; если ни
+одного нет, превью не создаётся и отчёт показывает исходный снимок.
+"""
+
+import hashlib
+import io
+import json
+import os
+
+CACHE_DIR_NAME = '.clash_thumbs'
+INDEX_NAME = 'index.json'
+THUMB_SIZE = 240        # максимальная сторона превью, px
+THUMB_QUALITY = 80      # качество JPEG
+
+
+def default_cache_dir(xml_path):
+    """Общая папка кэша: рядом с папками-датами отчётов (…/Отчёт/<дата>/report.xml)."""
+    report_dir = os.path.dirname(os.path.abspath(xml_path))
+    return os.path.join(os.path.dirname(report_dir), CACHE_DIR_NAME)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-1 содержимого файла."""
+    digest = hashlib.sha1()
+    with io.open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _resize_dotnet(src_path, dst_path, size, quality):
+    import clr
+    clr.AddReference('System.Drawing')
+    from System.Drawing import Bitmap, Graphics, Image
+    from System.Drawing.Drawing2D import InterpolationMode
+    from System.Drawing.Imaging import Encoder, EncoderParameter, EncoderParameters, ImageCodecInfo
+    from System import Int64
+
+    src = Image.FromFile(src_path)
+    try:
+        scale = min(1.0, float(size) / max(src.Width, src.Height))
+        width = max(1, int(src.Width * scale))
+        height = max(1, int(src.Height * scale))
+        thumb = Bitmap(width, height)
+        try:
+            graphics = Graphics.FromImage(thumb)
+            try:
+                graphics.InterpolationMode = InterpolationMode.HighQualityBicubic
+                graphics.DrawImage(src, 0, 0, width, height)
+            finally:
+                graphics.Dispose()
+            codec = [c for c in ImageCodecInfo.GetImageEncoders() if c.MimeType == 'image/jpeg'][0]
+            params = EncoderParameters(1)
+            params.Param[0] = EncoderParameter(Encoder.Quality, Int64(quality))
+            thumb.Save(dst_path, codec, params)
+        finally:
+            thumb.Dispose()
+    finally:
+        src.Dispose()
+
+
+def _resize_pillow(src_path, dst_path, size, quality):
+    from PIL import Image
+    img = Image.open(src_path)
+    try:
+        img.thumbnail((size, size))
+        img.convert('RGB').save(dst_path, 'JPEG', quality=quality)
+    finally:
+        img.close()
+
+
+def _pick_resizer():
+    try:
+        import clr  # noqa: F401
+        return _resize_dotnet
+    except ImportError:
+        pass
+    try:
+        import PIL  # noqa: F401
+        return _resize_pillow
+    except ImportError:
+        return None
+
+
+class ThumbnailCache(object):
+    """Кэш превью снимков: thumbnail_for(path) -> путь к превью или None."""
+
+    def __init__(self, cache_dir, size=THUMB_SIZE, quality=THUMB_QUALITY):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.quality = quality
+        self._resize = _pick_resizer()
+        self._index_path = os.path.join(cache_dir, INDEX_NAME)
+        self._index = self._load_index()
+        self._dirty = False
+
+    @property
+    def available(self):
+        return self._resize is not None
+
+    def _load_index(self):
+        try:
+            with io.open(self._index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save(self):
+        """Сохраняет индекс хешей (объединяя с записями других процессов)."""
+        if not self._dirty:
+            return
+        merged = self._load_index()
+        merged.update(self._index)
+        tmp = self._index_path + '.{0}.tmp'.format(os.getpid())
+        try:
+            with io.open(tmp, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(merged, ensure_ascii=False))
+            if os.path.exists(self._index_path):
+                os.remove(self._index_path)
+            os.rename(tmp, self._index_path)
+            self._dirty = False
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+
+    def digest_for(self, image_path):
+        """Хеш снимка; повторно файл читается только если изменились размер или дата."""
+        st = os.stat(image_path)
+        key = u'{0}|{1}|{2}'.format(os.path.normcase(os.path.abspath(image_path)), st.st_size, st.st_mtime)
+        digest = self._index.get(key)
+        if digest is None:
+            digest = file_digest(image_path)
+            self._index[key] = digest
+            self._dirty = True
+        return digest
+
+    def thumbnail_for(self, image_path):
+        """Путь к превью снимка (создаётся один раз на уникальное содержимое)."""
+        if not self.available or not image_path or not os.path.isfile(image_path):
+            return None
+        try:
+            digest = self.digest_for(image_path)
+        except Exception:
+            return None
+
+        thumb_dir = os.path.join(self.cache_dir, digest[:2])
+        thumb_path = os.path.join(thumb_dir, digest + '.jpg')
+        if os.path.exists(thumb_path):
+            return thumb_path
+
+        try:
+            if not os.path.isdir(thumb_dir):
+                os.makedirs(thumb_dir)
+        except OSError:
+            if not os.path.isdir(thumb_dir):
+                return None
+
+        # Пишем во временный файл: параллельные прогоны не увидят недописанное превью
+        tmp = thumb_path + '.{0}.tmp'.format(os.getpid())
+        try:
+            self._resize(image_path, tmp, self.size, self.quality)
+            if not os.path.exists(thumb_path):
+                os.rename(tmp, thumb_path)
+        except Exception:
+            # Параллельный прогон мог записать то же превью между проверкой и rename
+            return thumb_path if os.path.exists(thumb_path) else None
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except Exception:
+                    pass
+        return thumb_path
+
+
+def relative_uri(target_path, base_dir):
+    """Ссылка на файл относительно папки HTML (или file:/// при другом диске)."""
+    try:
+        rel = os.path.relpath(target_path, base_dir)
+        return rel.replace('\\', '/')
+    except ValueError:
+        return u'file:///' + os.path.abspath(target_path).replace('\\', '/')
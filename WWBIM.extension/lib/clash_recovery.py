@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+clash_recovery.py — терпимый к ошибкам разбор XML-отчётов Navisworks.
+
+Используется, когда XML-парсер отказывается читать повреждённый отчёт.
+Вместо регулярных выражений с DOTALL по всему тексту (которые на больших
+битых файлах уходят в возвраты на минуты) текст читается одним проходом
+по тегам: токенизатор находит очередной тег, конечный автомат держит
+текущие clashtest / clashresult / clashobject. Незакрытые блоки
+закрываются при открытии следующего такого же блока, лишние закрывающие
+теги и мусор пропускаются. Время работы линейно по размеру текста.
+
+Модуль не зависит от Revit API и работает в IronPython и CPython.
+Запуск как скрипта — замер на синтетических повреждённых отчётах:
+
+    python clash_recovery.py [число_коллизий]
+"""
+
+import re
+from collections import namedtuple
+
+# Тег: <name attrs>, </name>, <name/>; комментарии и <?xml?> не совпадают
+_TAG = re.compile(r'<(/?)([A-Za-z_][\w:.\-]*)([^<>]*)>')
+_ATTR = re.compile(r'([\w:.\-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_ENTITY = re.compile(r'&(#x[0-9A-Fa-f]+|#\d+|amp|lt|gt|quot|apos);')
+
+_NAMED_ENTITIES = {'amp': u'&', 'lt': u'<', 'gt': u'>', 'quot': u'"', 'apos': u"'"}
+
+# Имена атрибутов с ID объекта (в нижнем регистре)
+DEFAULT_ID_NAMES = frozenset([
+    u'объект id', u'object id', u'object 1 id', u'object 2 id',
+    u'id объекта', u'ид объекта', u'id обьекта'
+])
+
+RecoveredObject = namedtuple('RecoveredObject', ['element_id', 'nodes'])
+RecoveredClash = namedtuple('RecoveredClash', [
+    'test_name', 'name', 'status', 'result_status', 'href', 'point', 'objects'
+])
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+
+def _unescape(text):
+    def _sub(match):
+        ent = match.group(1)
+        if ent[0] == '#':
+            try:
+                code = int(ent[2:], 16) if ent[1] in 'xX' else int(ent[1:])
+                return _unichr(code)
+            except (ValueError, OverflowError):
+                return match.group(0)
+        return _NAMED_ENTITIES[ent]
+    if '&' not in text:
+        return text
+    return _ENTITY.sub(_sub, text)
+
+
+def _attrs(raw):
+    result = {}
+    if not raw:
+        return result
+    for match in _ATTR.finditer(raw):
+        value = match.group(2)
+        if value is None:
+            value = match.group(3)
+        result[match.group(1).lower()] = _unescape(value)
+    return result
+
+
+def _inner_text(text, start, end):
+    """Текст между тегами; вложенные (ошибочные) теги отбрасываются."""
+    chunk = text[start:end]
+    if '<' in chunk:
+        chunk = _TAG.sub(u'', chunk)
+    return _unescape(chunk).strip()
+
+
+class _ObjectState(object):
+    __slots__ = ('smarttag_id', 'attribute_id', 'nodes', 'paths')
+
+    def __init__(self):
+        self.smarttag_id = None
+        self.attribute_id = None
+        self.nodes = []
+        self.paths = []
+
+    def build(self):
+        element_id = self.smarttag_id or self.attribute_id
+        return RecoveredObject(element_id=element_id, nodes=self.nodes or self.paths)
+
+
+class _ResultState(object):
+    __slots__ = ('test_name', 'name', 'status', 'result_status', 'href', 'point', 'objects')
+
+    def __init__(self, attrs, test_name):
+        self.test_name = (attrs.get('testname') or attrs.get('test') or
+                          attrs.get('groupname') or test_name)
+        self.name = attrs.get('name') or u''
+        self.status = attrs.get('status') or u''
+        self.href = attrs.get('href') or u''
+        self.result_status = u''
+        self.point = None
+        self.objects = []
+
+    def build(self):
+        return RecoveredClash(
+            test_name=self.test_name, name=self.name, status=self.status,
+            result_status=self.result_status, href=self.href,
+            point=self.point, objects=self.objects
+        )
+
+
+class RecoveryParser(object):
+    """Однопроходный разбор отчёта по тегам.
+
+    parse(text) — генератор RecoveredClash; после прохода в test_names
+    лежат имена всех встреченных проверок (включая пустые).
+    """
+
+    DEFAULT_TEST_NAME = u'(Без названия проверки)'
+
+    def __init__(self, id_names=DEFAULT_ID_NAMES):
+        self.id_names = frozenset(n.lower() for n in id_names)
+        self.test_names = []
+
+    def parse(self, text):
+        self.test_names = []
+        seen_tests = set()
+        test_name = self.DEFAULT_TEST_NAME
+
+        result = None       # текущий clashresult
+        obj = None          # текущий clashobject
+        pair_kind = None    # 'smarttag' / 'objectattribute' / 'property'
+        pair_name = None
+        pair_value = None
+        in_pathlink = False
+        in_clashpoint = False
+        text_start = 0      # начало текста после последнего открывающего тега
+
+        for match in _TAG.finditer(text):
+            closing = match.group(1)
+            tag = match.group(2).lower()
+            raw_attrs = match.group(3)
+            self_closing = raw_attrs.endswith('/')
+
+            if not closing:
+                text_start = match.end()
+
+                if tag in ('clashtest', 'test'):
+                    attrs = _attrs(raw_attrs)
+                    name = attrs.get('name') or attrs.get('displayname')
+                    if name:
+                        test_name = name
+                        if name not in seen_tests:
+                            seen_tests.add(name)
+                            self.test_names.append(name)
+
+                elif tag == 'clashresult':
+                    if result is not None:
+                        # Предыдущий clashresult не закрыт — закрываем сами
+                        if obj is not None:
+                            result.objects.append(obj.build())
+                        yield result.build()
+                    result = _ResultState(_attrs(raw_attrs), test_name)
+                    obj = None
+                    in_pathlink = in_clashpoint = False
+                    if self_closing:
+                        yield result.build()
+                        result = None
+
+                elif result is None:
+                    continue
+
+                elif tag == 'clashobject':
+                    if obj is not None:
+                        result.objects.append(obj.build())
+                    obj = _ObjectState()
+                    in_pathlink = False
+
+                elif tag == 'clashpoint':
+                    in_clashpoint = not self_closing
+
+                elif tag == 'pos3f' and in_clashpoint and result.point is None:
+                    attrs = _attrs(raw_attrs)
+                    try:
+                        result.point = (float(attrs['x']), float(attrs['y']), float(attrs['z']))
+                    except (KeyError, ValueError):
+                        pass
+
+                elif tag == 'pathlink' and obj is not None:
+                    in_pathlink = not self_closing
+
+                elif tag in ('smarttag', 'objectattribute', 'property') and obj is not None:
+                    pair_kind = tag
+                    pair_name = pair_value = None
+
+                continue
+
+            # Закрывающие теги
+            if result is None:
+                if tag in ('clashtest', 'test'):
+                    test_name = self.DEFAULT_TEST_NAME
+                continue
+
+            if tag == 'clashresult':
+                if obj is not None:
+                    result.objects.append(obj.build())
+                yield result.build()
+                result = obj = None
+                pair_kind = None
+                in_pathlink = in_clashpoint = False
+
+            elif tag in ('clashtest', 'test'):
+                # Проверка закрылась раньше своего clashresult
+                if obj is not None:
+                    result.objects.append(obj.build())
+                yield result.build()
+                result = obj = None
+                pair_kind = None
+                in_pathlink = in_clashpoint = False
+                test_name = self.DEFAULT_TEST_NAME
+
+            elif tag == 'resultstatus':
+                result.result_status = _inner_text(text, text_start, match.start())
+
+            elif tag == 'clashpoint':
+                in_clashpoint = False
+
+            elif obj is None:
+                continue
+
+            elif tag == 'clashobject':
+                result.objects.append(obj.build())
+                obj = None
+                in_pathlink = False
+
+            elif tag == 'pathlink':
+                in_pathlink = False
+
+            elif tag == 'node' and in_pathlink:
+                value = _inner_text(text, text_start, match.start())
+                if value:
+                    obj.nodes.append(value)
+
+            elif tag == 'path' and in_pathlink:
+                value = _inner_text(text, text_start, match.start())
+                if value:
+                    obj.paths.append(value)
+
+            elif tag == 'name' and pair_kind:
+                pair_name = _inner_text(text, text_start, match.start())
+
+            elif tag == 'value' and pair_kind:
+                pair_value = _inner_text(text, text_start, match.start())
+
+            elif tag == pair_kind:
+                if pair_name and pair_value and pair_name.lower() in self.id_names:
+                    if pair_kind == 'smarttag':
+                        if obj.smarttag_id is None:
+                            obj.smarttag_id = pair_value
+                    elif obj.attribute_id is None:
+                        obj.attribute_id = pair_value
+                pair_kind = None
+
+        # Текст оборвался внутри clashresult
+        if result is not None:
+            if obj is not None:
+                result.objects.append(obj.build())
+            yield result.build()
+
+
+def parse_text(text, id_names=DEFAULT_ID_NAMES):
+    """Удобная обёртка: возвращает (test_names, [RecoveredClash, ...])."""
+    parser = RecoveryParser(id_names)
+    clashes = list(parser.parse(text))
+    return parser.test_names, clashes
+
+
+# =============================================================================
+# ЗАМЕР НА СИНТЕТИЧЕСКИХ ПОВРЕЖДЁННЫХ ОТЧЁТАХ
+# =============================================================================
+
+_SYNTH_OBJECT = (
+    u'<clashobject><objectattribute><name>ID объекта</name><value>{oid}</value></objectattribute>'
+    u'<pathlink><node>Файл</node><node>Файл</node><node>Model_{m}.nwc</node>'
+    u'<node>{lvl}_Этаж</node><node>Трубы</node><node>Труба &amp; изоляция {oid}</node></pathlink>'
+    u'<smarttags><smarttag><name>Объект Id</name><value>{oid}</value></smarttag></smarttags>'
+    u'</clashobject>'
+)
+_SYNTH_RESULT = (
+    u'<clashresult name="Конфликт{n}" status="active" href="img/{n}.jpg">'
+    u'<resultstatus>Активн.</resultstatus>'
+    u'<clashpoint><pos3f x="{x}" y="{y}" z="{z}"/></clashpoint>'
+    u'<clashobjects>{a}{b}</clashobjects></clashresult>'
+)
+
+
+def make_synthetic_report(clash_count, corruption=0.02, seed=1):
+    """Синтетический отчёт с долей повреждённых фрагментов."""
+    import random
+    rnd = random.Random(seed)
+    parts = [u'<?xml version="1.0" encoding="UTF-8"?><exchange><batchtest><clashtests>']
+    per_test = max(1, clash_count // 5)
+    for n in range(clash_count):
+        if n % per_test == 0:
+            if n:
+                parts.append(u'</clashresults></clashtest>')
+            parts.append(u'<clashtest name="Проверка {}"><clashresults>'.format(n // per_test))
+        fragment = _SYNTH_RESULT.format(
+            n=n, x=rnd.uniform(0, 100), y=rnd.uniform(0, 100), z=rnd.uniform(0, 30),
+            a=_SYNTH_OBJECT.format(oid=100000 + n, m=u'ОВ', lvl=n % 20),
+            b=_SYNTH_OBJECT.format(oid=200000 + n, m=u'ВК', lvl=n % 20)
+        )
+        if rnd.random() < corruption:
+            kind = rnd.randint(0, 3)
+            if kind == 0:      # потерян закрывающий тег
+                fragment = fragment.replace(u'</clashresult>', u'', 1)
+            elif kind == 1:    # оборванный фрагмент
+                fragment = fragment[:rnd.randint(1, len(fragment) - 1)]
+            elif kind == 2:    # мусор и неэкранированные символы
+                fragment = fragment.replace(u'<resultstatus>', u'<< & <resultstatus', 1)
+            else:              # потерян </value>
+                fragment = fragment.replace(u'</value>', u'', 1)
+        parts.append(fragment)
+    parts.append(u'</clashresults></clashtest></clashtests></batchtest></exchange>')
+    return u''.join(parts)
+
+
+def _benchmark(clash_count):
+    import time
+    for corruption in (0.0, 0.02, 0.2):
+        text = make_synthetic_report(clash_count, corruption)
+        started = time.time()
+        tests, clashes = parse_text(text)
+        elapsed = time.time() - started
+        with_ids = sum(1 for c in clashes if len(c.objects) >= 2 and all(o.element_id for o in c.objects))
+        print(u'clashes={} corruption={:.0%} size={:.1f} MB: {:.2f} s, recovered {} ({} with both ids), tests {}'.format(
+            clash_count, corruption, len(text) / 1e6, elapsed, len(clashes), with_ids, len(tests)))
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+element_geometry.py — общий кэш геометрии элементов: тела, грани, габарит по Z.
+
+Обход get_Geometry (с вложенными GeometryInstance) делается один раз на
+элемент и набор параметров Options; тела, плоские грани, объединённое
+тело и высотный габарит считаются из него по первому запросу.
+
+Записи хранятся между запусками кнопок в данных AppDomain (как снимки
+Суперфильтра) и сверяются со штампом версии элемента:
+  * Element.VersionGuid (Revit 2023+) — меняется при изменении элемента;
+  * для связей — штамп файла связи (меняется только при перезагрузке).
+Если штамп определить нельзя (элементы модели до Revit 2023), геометрия
+считается заново и не хранится. Записи документа удаляются при его
+закрытии (superfilter_index.register_document_store).
+
+Тела и грани возвращаются в координатах документа элемента.
+"""
+
+from Autodesk.Revit.DB import (
+    BooleanOperationsType, BooleanOperationsUtils, GeometryElement,
+    GeometryInstance, Mesh, Options, PlanarFace, Solid, ViewDetailLevel
+)
+
+from room_geometry_cache import document_stamp
+from superfilter_index import document_key, register_document_store
+
+_STORE_KEY = 'WWBIM.ElementGeometry'
+MAX_ENTRIES = 50000     # при переполнении кэш сессии очищается целиком
+MIN_VOLUME = 1e-9
+
+
+def _store():
+    from System import AppDomain
+    domain = AppDomain.CurrentDomain
+    store = domain.GetData(_STORE_KEY)
+    if store is None:
+        store = {}
+        domain.SetData(_STORE_KEY, store)
+    register_document_store(_STORE_KEY)
+    return store
+
+
+def element_stamp(el):
+    """Штамп версии геометрии элемента или None."""
+    try:
+        return u'v:{0}'.format(el.VersionGuid)
+    except Exception:
+        pass
+    doc = el.Document
+    if doc.IsLinked:
+        stamp = document_stamp(doc)
+        return u'l:{0}'.format(stamp) if stamp else None
+    # Счётчик изменений документа после переоткрытия начинается заново —
+    # по нему одному кэш мог бы отдать геометрию до правки
+    return None
+
+
+class ElementGeometry(object):
+    """Геометрия одного элемента при заданных Options."""
+
+    def __init__(self, geo):
+        self.solids = []        # тела с ненулевым объёмом, включая вложенные
+        self.own_solids = []    # только тела верхнего уровня (без GeometryInstance)
+        self.thin_solids = []   # тела с нулевым объёмом: граней нет, но рёбра бывают
+        self.meshes = []
+        self._faces = None
+        self._planar = None
+        self._own_planar = None
+        self._union = None
+        self._extents = None
+        if geo is not None:
+            self._walk(geo)
+
+    def _walk(self, geo, nested=False):
+        for g in geo:
+            if isinstance(g, Solid):
+                if g.Volume > MIN_VOLUME:
+                    self.solids.append(g)
+                    if not nested:
+                        self.own_solids.append(g)
+                else:
+                    self.thin_solids.append(g)
+            elif isinstance(g, Mesh):
+                self.meshes.append(g)
+            elif isinstance(g, GeometryInstance):
+                try:
+                    sub = g.GetInstanceGeometry()
+                except Exception:
+                    sub = None
+                if sub is not None:
+                    self._walk(sub, True)
+            elif isinstance(g, GeometryElement):
+                self._walk(g, nested)
+
+    @property
+    def empty(self):
+        return not self.solids and not self.thin_solids and not self.meshes
+
+    def faces(self):
+        """Все грани тел."""
+        if self._faces is None:
+            self._faces = []
+            for solid in self.solids:
+                try:
+                    self._faces.extend(solid.Faces)
+                except Exception:
+                    continue
+        return self._faces
+
+    def planar_faces(self, nested=True):
+        """Плоские грани тел; nested=False — только тел верхнего уровня."""
+        if not nested:
+            if self._own_planar is None:
+                self._own_planar = []
+                for solid in self.own_solids:
+                    try:
+                        self._own_planar.extend(f for f in solid.Faces if isinstance(f, PlanarFace))
+                    except Exception:
+                        continue
+            return self._own_planar
+        if self._planar is None:
+            self._planar = [f for f in self.faces() if isinstance(f, PlanarFace)]
+        return self._planar
+
+    def union(self):
+        """Объединение тел в одно (или None, если тел нет)."""
+        if self._union is None and self.solids:
+            cur = None
+            for solid in self.solids:
+                cur = solid if cur is None else BooleanOperationsUtils.ExecuteBooleanOperation(
+                    cur, solid, BooleanOperationsType.Union)
+            self._union = cur
+        return self._union
+
+    def extents(self):
+        """(zmin, zmax) по вершинам триангуляции граней, рёбрам и сеткам, или None."""
+        if self._extents is None:
+            acc = [None, None]
+
+            def _acc(p):
+                z = p.Z
+                if acc[0] is None or z < acc[0]:
+                    acc[0] = z
+                if acc[1] is None or z > acc[1]:
+                    acc[1] = z
+
+            for solid in self.solids + self.thin_solids:
+                for f in solid.Faces:
+                    try:
+                        m = f.Triangulate()
+                        for i in range(m.NumVertices):
+                            _acc(m.get_Vertex(i))
+                    except Exception:
+                        pass
+                try:
+                    for e in solid.Edges:
+                        for p in e.Tessellate():
+                            _acc(p)
+                except Exception:
+                    pass
+            for m in self.meshes:
+                try:
+                    for i in range(m.NumVertices):
+                        _acc(m.get_Vertex(i))
+                except Exception:
+                    pass
+            self._extents = tuple(acc) if acc[0] is not None else ()
+        return self._extents or None
+
+
+def _options(fine, references, non_visible, view):
+    opt = Options()
+    if fine:
+        try:
+            opt.DetailLevel = ViewDetailLevel.Fine
+        except Exception:
+            pass
+    opt.ComputeReferences = bool(references)
+    opt.IncludeNonVisibleObjects = bool(non_visible)
+    if view is not None:
+        try:
+            opt.View = view
+        except Exception:
+            pass
+    return opt
+
+
+def get_geometry(el, fine=True, references=False, non_visible=False, view=None):
+    """Геометрия элемента (ElementGeometry) — из кэша сессии или новым обходом.
+
+    Параметры соответствуют Options: детализация Fine, ComputeReferences,
+    IncludeNonVisibleObjects и вид.
+    """
+    view_id = view.Id.IntegerValue if view is not None else None
+    stamp = element_stamp(el)
+    if stamp is not None and view is not None:
+        # Геометрия на виде зависит и от самого вида (детализация, подрезка)
+        view_stamp = element_stamp(view)
+        stamp = u'{0}|{1}'.format(stamp, view_stamp) if view_stamp else None
+    key = (document_key(el.Document), el.Id.IntegerValue,
+           bool(fine), bool(references), bool(non_visible), view_id)
+    store = _store() if stamp is not None else None
+    if store is not None:
+        cached = store.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    try:
+        geo = el.get_Geometry(_options(fine, references, non_visible, view))
+    except Exception:
+        geo = None
+    result = ElementGeometry(geo)
+    if store is not None:
+        if len(store) >= MAX_ENTRIES:
+            store.clear()
+        store[key] = (stamp, result)
+    return result
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+room_assign_state.py — результаты прошлого прогона «Элементы внутри помещения».
+
+Для каждого элемента хранится запись (хеш положения, хеш помещений-
+кандидатов, записанное значение). Если при повторном запуске запись
+совпала, элемент не пересчитывается и не записывается. Всё, что влияет
+на результат целиком (связь и её положение, перекрытия, уровни, выбранные
+параметры), входит в подпись прогона: при её смене состояние сбрасывается.
+
+Файл — в %LOCALAPPDATA%/WWBIM/room_assign/, один на документ и режим.
+"""
+
+import hashlib
+import io
+import json
+import os
+
+STATE_DIR_NAME = 'room_assign'
+
+
+def state_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('APPDATA') or os.path.expanduser('~')
+    return os.path.join(base, 'WWBIM', STATE_DIR_NAME)
+
+
+def digest(obj):
+    """Короткий хеш JSON-совместимого значения."""
+    text = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()[:20]
+
+
+class AssignmentState(object):
+    """Записи по элементам: прошлый прогон (previous) и текущий (current)."""
+
+    def __init__(self, doc, scope, signature, directory=None):
+        key = u'{0}|{1}'.format(doc.PathName or doc.Title, scope)
+        name = hashlib.sha1(key.lower().encode('utf-8')).hexdigest() + '.json'
+        self.file = os.path.join(directory or state_dir(), name)
+        self.signature = signature
+        self.previous = self._load()
+        self.current = {}
+
+    def _load(self):
+        try:
+            with io.open(self.file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        if data.get('signature') != self.signature:
+            return {}
+        return data.get('elements') or {}
+
+    def unchanged(self, eid, record):
+        return self.previous.get(str(eid)) == record
+
+    def keep(self, eid, record):
+        self.current[str(eid)] = record
+
+    def save(self):
+        """Сохраняет записи текущего прогона (удалённые элементы выпадают)."""
+        folder = os.path.dirname(self.file)
+        tmp = self.file + '.{0}.tmp'.format(os.getpid())
+        payload = {'signature': self.signature, 'elements': self.current}
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with io.open(tmp, 'w', encoding='utf-8') as f:
+                f.write(u'{0}'.format(json.dumps(payload, separators=(',', ':'))))
+            if os.path.exists(self.file):
+                os.remove(self.file)
+            os.rename(tmp, self.file)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+room_geometry_cache.py — локальный кэш геометрии помещений и перекрытий связей.
+
+Контуры помещений и грани перекрытий из связанной модели АР меняются
+редко, а извлекаются из Revit дольше всего остального. Кэш хранит их
+плоскими списками чисел в %LOCALAPPDATA%/WWBIM/room_geometry/ — файл на
+путь связи. Запись действительна, пока совпадает штамп документа
+(версия сохранения Revit, размер и дата файла) и формат кэша.
+
+Формат записей задаёт вызывающий код; модуль отвечает за штамп,
+хранение и проверку актуальности.
+"""
+
+import hashlib
+import io
+import json
+import os
+
+CACHE_DIR_NAME = 'room_geometry'
+
+
+def cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('APPDATA') or os.path.expanduser('~')
+    return os.path.join(base, 'WWBIM', CACHE_DIR_NAME)
+
+
+def document_stamp(doc):
+    """Штамп версии документа или None, если версию определить нельзя."""
+    parts = []
+    try:
+        from Autodesk.Revit.DB import Document
+        version = Document.GetDocumentVersion(doc)
+        parts.append(u'{0}:{1}'.format(version.VersionGUID, version.NumberOfSaves))
+    except Exception:
+        pass
+    try:
+        st = os.stat(doc.PathName)
+        parts.append(u'{0}:{1}'.format(st.st_size, st.st_mtime))
+    except Exception:
+        pass
+    return u'|'.join(parts) or None
+
+
+class GeometryCache(object):
+    """Записи геометрии одной связи: rooms (Id -> запись) и произвольные разделы."""
+
+    def __init__(self, doc, fmt, directory=None):
+        self.path_key = doc.PathName or doc.Title
+        self.stamp = document_stamp(doc)
+        self.fmt = fmt
+        digest = hashlib.sha1(self.path_key.lower().encode('utf-8')).hexdigest()
+        self.file = os.path.join(directory or cache_dir(), digest + '.json')
+        self.data = self._load()
+        self.warm = self.data is not None
+        if self.data is None:
+            self.data = {}
+        self._dirty = False
+
+    @property
+    def enabled(self):
+        return self.stamp is not None
+
+    def _load(self):
+        if not self.enabled:
+            return None
+        try:
+            with io.open(self.file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        if data.get('format') != self.fmt or data.get('stamp') != self.stamp:
+            return None
+        return data.get('sections') or {}
+
+    def section(self, name):
+        """Раздел кэша (dict), создаётся пустым при первом обращении."""
+        sec = self.data.get(name)
+        if sec is None:
+            sec = self.data[name] = {}
+        return sec
+
+    def put(self, name, key, record):
+        self.section(name)[key] = record
+        self._dirty = True
+
+    def save(self):
+        if not self.enabled or not self._dirty:
+            return
+        payload = {'format': self.fmt, 'stamp': self.stamp, 'path': self.path_key,
+                   'sections': self.data}
+        folder = os.path.dirname(self.file)
+        tmp = self.file + '.{0}.tmp'.format(os.getpid())
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with io.open(tmp, 'w', encoding='utf-8') as f:
+                f.write(u'{0}'.format(json.dumps(payload, separators=(',', ':'))))
+            if os.path.exists(self.file):
+                os.remove(self.file)
+            os.rename(tmp, self.file)
+            self._dirty = False
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+room_polygons.py — пакетная проверка попадания точек в контур помещения.
+
+Контур помещения (внешний контур и отверстия, правило чёт-нечет) хранится
+массивами рёбер, разложенными по горизонтальным полосам: для точки
+проверяются только рёбра её полосы, а не весь контур. Результат точки —
+INSIDE (внутри или на ребре с допуском), OUTSIDE или NEAR (снаружи, но
+ближе near к границе — здесь решение оставляют за Room.IsPointInRoom).
+
+Модуль не зависит от Revit API и работает в обычном Python:
+
+    python room_polygons.py [--rooms N] [--points N]
+
+сверяет результаты с простым лучевым алгоритмом на синтетических
+планировках и печатает время.
+"""
+from __future__ import division, print_function
+
+import math
+from bisect import bisect_right
+
+OUTSIDE = 0
+INSIDE = 1
+NEAR = 2
+
+MAX_SLABS = 256
+
+
+class EdgeSlabs(object):
+    """Рёбра контуров помещения, разложенные по полосам Y.
+
+    loops — замкнутые или незамкнутые списки точек (x, y); tol — допуск
+    «на ребре», near — зона у границы снаружи, где ответ NEAR.
+    """
+
+    def __init__(self, loops, tol=1e-3, near=0.0):
+        self.tol2 = tol * tol
+        self.near2 = max(near, tol) ** 2
+        pad = max(near, tol)
+        ax, ay, bx, by, k = [], [], [], [], []
+        for loop in loops:
+            pts = list(loop)
+            if len(pts) < 3:
+                continue
+            if pts[0] != pts[-1]:
+                pts.append(pts[0])
+            for i in range(len(pts) - 1):
+                (x0, y0), (x1, y1) = pts[i], pts[i + 1]
+                if x0 == x1 and y0 == y1:
+                    continue
+                ax.append(x0); ay.append(y0); bx.append(x1); by.append(y1)
+                k.append((x1 - x0) / (y1 - y0) if y1 != y0 else 0.0)
+        self.ax, self.ay, self.bx, self.by, self.k = ax, ay, bx, by, k
+        self.empty = not ax
+        if self.empty:
+            return
+
+        self.xmin = min(min(ax), min(bx)) - pad
+        self.xmax = max(max(ax), max(bx)) + pad
+        self.ymin = min(min(ay), min(by)) - pad
+        ymax = max(max(ay), max(by)) + pad
+        count = max(1, min(MAX_SLABS, len(ax) // 2))
+        self.height = (ymax - self.ymin) / count or 1.0
+        slabs = [[] for _ in range(count)]
+        for i in range(len(ax)):
+            lo = min(ay[i], by[i]) - pad
+            hi = max(ay[i], by[i]) + pad
+            s0 = max(0, int((lo - self.ymin) / self.height))
+            s1 = min(count - 1, int((hi - self.ymin) / self.height))
+            for s in range(s0, s1 + 1):
+                slabs[s].append(i)
+        self.slabs = slabs
+        self.bounds = [self.ymin + self.height * s for s in range(1, count)]
+
+    def classify(self, x, y):
+        return self.classify_many(((x, y),))[0]
+
+    def classify_many(self, points):
+        """Коды INSIDE / OUTSIDE / NEAR для списка точек (x, y)."""
+        if self.empty:
+            return [NEAR] * len(points)
+        ax, ay, bx, by, k = self.ax, self.ay, self.bx, self.by, self.k
+        slabs, bounds = self.slabs, self.bounds
+        xmin, xmax = self.xmin, self.xmax
+        ymin, ymax = self.ymin, self.ymin + self.height * len(slabs)
+        tol2, near2 = self.tol2, self.near2
+        result = []
+        append = result.append
+        for x, y in points:
+            if x < xmin or x > xmax or y < ymin or y > ymax:
+                append(OUTSIDE)
+                continue
+            inside = on_edge = False
+            best = near2
+            for i in slabs[bisect_right(bounds, y)]:
+                x0 = ax[i]; y0 = ay[i]; x1 = bx[i]; y1 = by[i]
+                # расстояние до ребра
+                vx = x1 - x0; vy = y1 - y0
+                wx = x - x0; wy = y - y0
+                c1 = vx * wx + vy * wy
+                if c1 <= 0.0:
+                    d2 = wx * wx + wy * wy
+                else:
+                    c2 = vx * vx + vy * vy
+                    if c2 <= c1:
+                        dx = x - x1; dy = y - y1
+                        d2 = dx * dx + dy * dy
+                    else:
+                        t = c1 / c2
+                        dx = wx - t * vx; dy = wy - t * vy
+                        d2 = dx * dx + dy * dy
+                if d2 < best:
+                    best = d2
+                    if d2 <= tol2:
+                        on_edge = True
+                        break
+                # пересечение луча вправо
+                if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * k[i]:
+                    inside = not inside
+            if on_edge or inside:
+                append(INSIDE)
+            elif best < near2:
+                append(NEAR)
+            else:
+                append(OUTSIDE)
+        return result
+
+
+# =============================================================================
+# САМОПРОВЕРКА
+# =============================================================================
+
+def _reference_contains(loops, x, y, tol):
+    """Простой лучевой алгоритм по всем рёбрам (эталон для сверки)."""
+    tol2 = tol * tol
+    closed = [list(l) + [l[0]] if l[0] != l[-1] else list(l) for l in loops]
+    for loop in closed:
+        for i in range(len(loop) - 1):
+            (ax, ay), (bx, by) = loop[i], loop[i + 1]
+            vx = bx - ax; vy = by - ay
+            wx = x - ax; wy = y - ay
+            c1 = vx * wx + vy * wy
+            c2 = vx * vx + vy * vy
+            if c1 <= 0.0:
+                d2 = wx * wx + wy * wy
+            elif c2 <= c1:
+                d2 = (x - bx) ** 2 + (y - by) ** 2
+            else:
+                t = c1 / c2
+                d2 = (wx - t * vx) ** 2 + (wy - t * vy) ** 2
+            if d2 <= tol2:
+                return True
+    inside = False
+    for loop in closed:
+        for i in range(len(loop) - 1):
+            (ax, ay), (bx, by) = loop[i], loop[i + 1]
+            if (ay > y) != (by > y):
+                if x < (bx - ax) * (y - ay) / (by - ay) + ax:
+                    inside = not inside
+    return inside
+
+
+def _synthetic_rooms(count, rnd):
+    """Планировка: прямоугольники, Г-образные, с отверстием и круглые помещения."""
+    rooms = []
+    side = int(math.ceil(math.sqrt(count)))
+    for n in range(count):
+        x0 = (n % side) * 30.0
+        y0 = (n // side) * 30.0
+        w = rnd.uniform(8.0, 25.0)
+        h = rnd.uniform(8.0, 25.0)
+        kind = n % 4
+        if kind == 0:
+            loops = [[(x0, y0), (x0 + w, y0), (x0 + w, y0 + h), (x0, y0 + h)]]
+        elif kind == 1:
+            loops = [[(x0, y0), (x0 + w, y0), (x0 + w, y0 + h / 2), (x0 + w / 2, y0 + h / 2),
+                      (x0 + w / 2, y0 + h), (x0, y0 + h)]]
+        elif kind == 2:
+            loops = [[(x0, y0), (x0 + w, y0), (x0 + w, y0 + h), (x0, y0 + h)],
+                     [(x0 + w / 3, y0 + h / 3), (x0 + w / 3, y0 + 2 * h / 3),
+                      (x0 + 2 * w / 3, y0 + 2 * h / 3), (x0 + 2 * w / 3, y0 + h / 3)]]
+        else:
+            r = min(w, h) / 2
+            cx, cy = x0 + r, y0 + r
+            loops = [[(cx + r * math.cos(2 * math.pi * i / 64), cy + r * math.sin(2 * math.pi * i / 64))
+                      for i in range(64)]]
+        rooms.append(loops)
+    return rooms
+
+
+def _self_check(room_count=300, point_count=200, seed=1):
+    import random
+    import time
+    rnd = random.Random(seed)
+    rooms = _synthetic_rooms(room_count, rnd)
+    tol = 1e-3
+
+    started = time.time()
+    kernels = [EdgeSlabs(loops, tol, near=0.25) for loops in rooms]
+    built = time.time() - started
+
+    samples = []
+    for loops in rooms:
+        xs = [p[0] for l in loops for p in l]
+        ys = [p[1] for l in loops for p in l]
+        pts = [(rnd.uniform(min(xs) - 2, max(xs) + 2), rnd.uniform(min(ys) - 2, max(ys) + 2))
+               for _ in range(point_count)]
+        # точки на рёбрах и вершинах
+        pts.extend(loops[0][:4])
+        samples.append(pts)
+
+    started = time.time()
+    fast = [kernel.classify_many(pts) for kernel, pts in zip(kernels, samples)]
+    fast_time = time.time() - started
+
+    started = time.time()
+    slow = [[_reference_contains(loops, x, y, tol) for x, y in pts] for loops, pts in zip(rooms, samples)]
+    slow_time = time.time() - started
+
+    mismatches = 0
+    for codes, refs in zip(fast, slow):
+        for code, ref in zip(codes, refs):
+            if (code == INSIDE) != ref:
+                mismatches += 1
+    total = sum(len(pts) for pts in samples)
+    print(u'помещений: {0}, точек: {1}, расхождений: {2}'.format(room_count, total, mismatches))
+    print(u'построение: {0:.3f} с, полосы: {1:.3f} с, перебор рёбер: {2:.3f} с'.format(
+        built, fast_time, slow_time))
+    return mismatches == 0
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description=u'Самопроверка и замер пакетной проверки контуров.')
+    parser.add_argument('--rooms', type=int, default=300)
+    parser.add_argument('--points', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(0 if _self_check(args.rooms, args.points, args.seed) else 1)
@@ -0,0 +1,789 @@
+# -*- coding: utf-8 -*-
+"""
+superfilter_index.py — инвертированный индекс значений параметров для Суперфильтра.
+
+Параметр индексируется при первом обращении одним проходом по элементам:
+значение -> множество Id элементов. Параметры типа читаются один раз на
+тип (memo), а не на каждый экземпляр. После этого списки значений и
+подсчёт совпадений — поиск в словаре и операции над множествами.
+
+Семантика условий совпадает с match_condition Суперфильтра: параметр
+ищется у экземпляра, а если его там нет — у типа.
+
+Кроме =, !=, пусто/не пусто поддерживаются диапазоны (<, >, между) — по
+отсортированному списку числовых значений колонки (bisect) — и текстовые
+условия (содержит, начинается с, рег. выражение) по различным значениям,
+а не по элементам. Числа из условий вводятся в единицах проекта и
+переводятся во внутренние единицы параметра.
+
+Снимок документа (get_snapshot) хранит кандидатов всей модели и уже
+построенные колонки между запусками кнопки (в данных AppDomain). Событие
+DocumentChanged только запоминает добавленные/изменённые/удалённые Id;
+при следующем открытии фильтра переиндексируются лишь они.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+
+from Autodesk.Revit.DB import ElementId, StorageType, UnitUtils
+
+_STORE_KEY = 'WWBIM.SuperFilter.Snapshots'
+_HANDLERS_KEY = '__handlers__'
+_CHANGES_KEY = '__changes__'
+_SESSIONS_KEY = '__sessions__'
+_DOCUMENT_STORES_KEY = '__document_stores__'
+_SAVING_AS_KEY = '__saving_as__'
+
+OP_EQ = u'='
+OP_NE = u'!='
+OP_EMPTY = u'пусто'
+OP_NOT_EMPTY = u'не пусто'
+OP_LT = u'<'
+OP_GT = u'>'
+OP_BETWEEN = u'между'
+OP_CONTAINS = u'содержит'
+OP_STARTS = u'начинается с'
+OP_REGEX = u'рег. выражение'
+
+OPS = [OP_EQ, OP_NE, OP_EMPTY, OP_NOT_EMPTY, OP_LT, OP_GT, OP_BETWEEN,
+       OP_CONTAINS, OP_STARTS, OP_REGEX]
+RANGE_OPS = (OP_LT, OP_GT, OP_BETWEEN)
+TEXT_OPS = (OP_CONTAINS, OP_STARTS, OP_REGEX)
+NUMERIC_STORAGES = (StorageType.Integer, StorageType.Double)
+NUMERIC_EPS = 1e-6      # допуск сравнения во внутренних единицах
+
+_NUMBER = re.compile(r'[-+]?\d+(?:[.,]\d+)?')
+_RANGE_SEP = re.compile(u'\\.\\.|;|…|—|–')
+_RANGE_DASH = re.compile(r'^\s*(\d+(?:[.,]\d+)?)\s*-\s*(\d+(?:[.,]\d+)?)')
+_UNKNOWN = object()
+
+
+# =============================================================================
+# РАЗБОР ЗНАЧЕНИЙ УСЛОВИЙ
+# =============================================================================
+
+def parse_number(text):
+    """Первое число в тексте ('50', '50,5 мм') или None."""
+    match = _NUMBER.search(text or u'')
+    if match is None:
+        return None
+    return float(match.group(0).replace(u',', u'.'))
+
+
+def parse_range(op, text):
+    """Диапазон (lo, hi, strict) для <, >, между или None; числа в единицах проекта.
+
+    Для «между» границы разделяются «..», «;», тире или «-»: 50..110, 50-110.
+    """
+    if op == OP_BETWEEN:
+        match = _RANGE_DASH.match(text or u'')
+        if match:
+            parts = [match.group(1), match.group(2)]
+        else:
+            parts = [t for t in _RANGE_SEP.split(text or u'') if t.strip()]
+        if len(parts) != 2:
+            return None
+        lo, hi = parse_number(parts[0]), parse_number(parts[1])
+        if lo is None or hi is None:
+            return None
+        if lo > hi:
+            lo, hi = hi, lo
+        return lo, hi, False
+    value = parse_number(text)
+    if value is None:
+        return None
+    if op == OP_LT:
+        return None, value, True
+    if op == OP_GT:
+        return value, None, True
+    return None
+
+
+def unit_of(p):
+    """Единицы отображения параметра (ForgeTypeId в 2021+, DisplayUnitType в 2020)."""
+    try:
+        return p.GetUnitTypeId()
+    except Exception:
+        pass
+    try:
+        return p.DisplayUnitType
+    except Exception:
+        return None
+
+
+def to_internal(value, unit):
+    if value is None or unit is None:
+        return value
+    try:
+        return UnitUtils.ConvertToInternalUnits(value, unit)
+    except Exception:
+        return value
+
+
+def range_to_internal(rng, unit):
+    lo, hi, strict = rng
+    return to_internal(lo, unit), to_internal(hi, unit), strict
+
+
+def in_range(value, rng):
+    lo, hi, strict = rng
+    if lo is not None:
+        if strict and not value > lo + NUMERIC_EPS:
+            return False
+        if not strict and value < lo - NUMERIC_EPS:
+            return False
+    if hi is not None:
+        if strict and not value < hi - NUMERIC_EPS:
+            return False
+        if not strict and value > hi + NUMERIC_EPS:
+            return False
+    return True
+
+
+def text_matches(op, text, pattern):
+    """содержит / начинается с — без учёта регистра; рег. выражение — re.search."""
+    if text is None or not pattern:
+        return False
+    if op == OP_REGEX:
+        try:
+            return re.search(pattern, text, re.IGNORECASE | re.UNICODE) is not None
+        except re.error:
+            return False
+    if op == OP_CONTAINS:
+        return pattern.lower() in text.lower()
+    if op == OP_STARTS:
+        return text.lower().startswith(pattern.lower())
+    return False
+
+
+def read_value(p):
+    """(StorageType, ключ значения, пусто ли, отображение) параметра."""
+    st = p.StorageType
+    try:
+        if st == StorageType.String:
+            val = p.AsString()
+            if val is None:
+                val = p.AsValueString()
+            val = val or u''
+            return st, val, val == u'', val
+        if st == StorageType.Integer:
+            if not getattr(p, 'HasValue', True):
+                return st, None, True, None
+            ival = int(p.AsInteger())
+            return st, ival, False, p.AsValueString() or u'{0}'.format(ival)
+        if st == StorageType.Double:
+            if not getattr(p, 'HasValue', True):
+                return st, None, True, None
+            dval = float(p.AsDouble())
+            return st, dval, False, p.AsValueString() or u'{0}'.format(dval)
+        if st == StorageType.ElementId:
+            eid = p.AsElementId()
+            if eid == ElementId.InvalidElementId:
+                return st, None, True, None
+            # Отображение ElementId строит вызывающий (имя категории/типа)
+            return st, eid.IntegerValue, False, None
+    except Exception:
+        pass
+    return st, None, True, None
+
+
+def raw_key(raw):
+    """Ключ индекса для значения из условия."""
+    if isinstance(raw, ElementId):
+        return raw.IntegerValue
+    return raw
+
+
+class ParamColumn(object):
+    """Значения одного параметра по всем индексированным элементам."""
+
+    def __init__(self, name):
+        self.name = name
+        self.by_value = {}      # ключ -> set(Id элементов)
+        self.present = set()    # у кого параметр найден (у экземпляра или типа)
+        self.empty = set()      # у кого параметр пуст
+        self.storages = {}      # ключ -> StorageType
+        self.display = {}       # ключ -> отображаемое значение
+        self.listed = []        # ключи для выпадающего списка (в порядке появления)
+        self.key_of = {}        # Id элемента -> ключ его значения
+        self.unit = _UNKNOWN    # единицы числового параметра (ищутся по запросу)
+        self.has_ids = False    # есть значения ElementId (их текст строит вызывающий)
+        self._listed_keys = set()
+        self._numeric = None    # отсортированные числовые ключи
+        self._texts = None      # (отсортированные строки в нижнем регистре, их ключи)
+
+    def add(self, eid, record):
+        present, st, key, is_empty, disp, listed = record
+        if not present:
+            return
+        self.present.add(eid)
+        if is_empty:
+            self.empty.add(eid)
+            if st != StorageType.String:
+                return
+        ids = self.by_value.get(key)
+        if ids is None:
+            ids = self.by_value[key] = set()
+            self.storages[key] = st
+            self.display[key] = disp
+            self._numeric = self._texts = None
+            if st == StorageType.ElementId:
+                self.has_ids = True
+        ids.add(eid)
+        self.key_of[eid] = key
+        if listed and not is_empty and key not in self._listed_keys:
+            self._listed_keys.add(key)
+            self.listed.append(key)
+
+    def ids_for(self, keys):
+        result = set()
+        for key in keys:
+            result |= self.by_value[key]
+        return result
+
+    def range_keys(self, rng):
+        """Числовые ключи в диапазоне (bisect по отсортированному списку)."""
+        if self._numeric is None:
+            self._numeric = sorted(k for k, st in self.storages.items() if st in NUMERIC_STORAGES)
+        keys = self._numeric
+        lo, hi, strict = rng
+        start, end = 0, len(keys)
+        if lo is not None:
+            start = bisect_right(keys, lo + NUMERIC_EPS) if strict else bisect_left(keys, lo - NUMERIC_EPS)
+        if hi is not None:
+            end = bisect_left(keys, hi - NUMERIC_EPS) if strict else bisect_right(keys, hi + NUMERIC_EPS)
+        return keys[start:end]
+
+    def prefix_keys(self, prefix):
+        """Ключи, отображение которых начинается с prefix (без учёта регистра)."""
+        if self._texts is None:
+            pairs = sorted((d.lower(), k) for k, d in self.display.items() if d is not None)
+            self._texts = ([p[0] for p in pairs], [p[1] for p in pairs])
+        lowers, keys = self._texts
+        prefix = prefix.lower()
+        result = []
+        i = bisect_left(lowers, prefix)
+        while i < len(lowers) and lowers[i].startswith(prefix):
+            result.append(keys[i])
+            i += 1
+        return result
+
+    def discard(self, eid):
+        """Убирает элемент из колонки."""
+        self.present.discard(eid)
+        self.empty.discard(eid)
+        if eid in self.key_of:
+            ids = self.by_value.get(self.key_of.pop(eid))
+            if ids is not None:
+                ids.discard(eid)
+
+
+_MISSING = (False, None, None, True, None, False)
+
+
+class ParamValueIndex(object):
+    """Индекс значений параметров по набору элементов-кандидатов.
+
+    include(p) -> bool решает, попадает ли значение в выпадающий список
+    (например, без параметров семейства); на подсчёт совпадений не влияет.
+    """
+
+    def __init__(self, doc, elements, include=None):
+        self.doc = doc
+        self.include = include
+        self.include_token = None
+        self.ids = set()
+        self._elements = {}
+        self._type_of = {}
+        self._columns = {}
+        self._partial = {}      # недостроенные колонки: ключ -> [колонка, обработано]
+        self._order = None
+        self._type_memo = {}
+        for el in elements:
+            self._add_element(el)
+
+    def set_include(self, include, token):
+        """Меняет фильтр значений списка; при смене token колонки строятся заново."""
+        if token != self.include_token:
+            self._columns.clear()
+            self._partial.clear()
+            self._type_memo.clear()
+            self.include_token = token
+        self.include = include
+
+    def elements(self, scope=None):
+        """Элементы индекса (в пределах scope, если задан)."""
+        if scope is None:
+            return list(self._elements.values())
+        return [el for eid, el in self._elements.items() if eid in scope]
+
+    def type_ids(self):
+        return set(self._type_of.values())
+
+    def remove(self, eid):
+        if eid not in self.ids:
+            return
+        self.ids.discard(eid)
+        self._elements.pop(eid, None)
+        self._type_of.pop(eid, None)
+        self._order = None
+        self._partial.clear()
+        for col in self._columns.values():
+            col.discard(eid)
+
+    def update(self, el):
+        """Добавляет или переиндексирует элемент во всех построенных колонках."""
+        eid = el.Id.IntegerValue
+        self.remove(eid)
+        self._add_element(el)
+        self._reindex(eid)
+
+    def _reindex(self, eid):
+        for (name, include_type), col in self._columns.items():
+            col.discard(eid)
+            col.add(eid, self._element_record(eid, name, include_type))
+
+    def invalidate_types(self, type_ids):
+        """Типы изменились: сбрасывает их memo и переиндексирует экземпляры."""
+        type_ids = set(type_ids)
+        if not type_ids:
+            return
+        for memo_key in [k for k in self._type_memo if k[0] in type_ids]:
+            del self._type_memo[memo_key]
+        self._partial.clear()
+        for eid, tid in list(self._type_of.items()):
+            if tid in type_ids:
+                self._reindex(eid)
+
+    def _add_element(self, el):
+        eid = el.Id.IntegerValue
+        if eid not in self.ids:
+            self._order = None
+            self._partial.clear()
+        self.ids.add(eid)
+        self._elements[eid] = el
+        try:
+            self._type_of[eid] = el.GetTypeId().IntegerValue
+        except Exception:
+            self._type_of[eid] = -1
+
+    def _record(self, p):
+        st, key, is_empty, disp = read_value(p)
+        listed = self.include(p) if self.include is not None else True
+        return True, st, key, is_empty, disp, listed
+
+    def _type_record(self, tid, name):
+        memo_key = (tid, name)
+        record = self._type_memo.get(memo_key)
+        if record is None:
+            record = _MISSING
+            if tid != -1:
+                try:
+                    typ = self.doc.GetElement(ElementId(tid))
+                    p = typ.LookupParameter(name) if typ else None
+                    if p is not None:
+                        record = self._record(p)
+                except Exception:
+                    pass
+            self._type_memo[memo_key] = record
+        return record
+
+    def _lookup(self, eid, name, include_type):
+        try:
+            p = self._elements[eid].LookupParameter(name)
+            if p is None and include_type:
+                typ = self.doc.GetElement(ElementId(self._type_of.get(eid, -1)))
+                p = typ.LookupParameter(name) if typ else None
+            return p
+        except Exception:
+            return None
+
+    def column_storage(self, name, include_type=True):
+        """Тип хранения параметра по его значениям (None, если значений нет)."""
+        col = self.column(name, include_type)
+        for st in col.storages.values():
+            return st
+        return None
+
+    def column_unit(self, name, include_type=True):
+        """Единицы числового параметра по первому элементу, у которого он есть."""
+        col = self.column(name, include_type)
+        if col.unit is _UNKNOWN:
+            col.unit = None
+            for eid in col.present:
+                p = self._lookup(eid, name, include_type)
+                if p is not None and p.StorageType == StorageType.Double:
+                    col.unit = unit_of(p)
+                    break
+        return col.unit
+
+    def _element_record(self, eid, name, include_type):
+        el = self._elements[eid]
+        try:
+            p = el.LookupParameter(name)
+        except Exception:
+            p = None
+        if p is not None:
+            return self._record(p)
+        if include_type:
+            return self._type_record(self._type_of.get(eid, -1), name)
+        return _MISSING
+
+    def element_order(self):
+        """Порядок обхода элементов при построении колонок (общий для порций)."""
+        if self._order is None:
+            self._order = list(self._elements)
+        return self._order
+
+    def build_steps(self, names, include_type=True, chunk=2000):
+        """Строит недостающие колонки порциями, по одним и тем же элементам.
+
+        Генератор отдаёт число обработанных элементов (префикс element_order).
+        Прерванное построение продолжается с того же места при следующем вызове.
+        """
+        order = self.element_order()
+        todo = []
+        for name in names:
+            col_key = (name, bool(include_type))
+            if col_key in self._columns:
+                continue
+            part = self._partial.get(col_key)
+            if part is None:
+                part = self._partial[col_key] = [ParamColumn(name), 0]
+            todo.append((col_key, part))
+        if not todo:
+            return
+        pos = min(part[1] for _, part in todo)
+        total = len(order)
+        while pos < total:
+            end = min(pos + chunk, total)
+            for (name, include), part in todo:
+                col, done = part
+                if done >= end:
+                    continue
+                for eid in order[done:end]:
+                    col.add(eid, self._element_record(eid, name, include))
+                part[1] = end
+            pos = end
+            yield pos
+        for col_key, part in todo:
+            self._columns[col_key] = part[0]
+            self._partial.pop(col_key, None)
+
+    def column(self, name, include_type=True):
+        """Колонка параметра; строится одним проходом при первом обращении."""
+        col_key = (name, bool(include_type))
+        if col_key not in self._columns:
+            for _ in self.build_steps([name], include_type, chunk=len(self._elements) or 1):
+                pass
+        return self._columns[col_key]
+
+    def peek_column(self, name, include_type=True):
+        """Готовая или частично построенная колонка (без достройки)."""
+        col_key = (name, bool(include_type))
+        col = self._columns.get(col_key)
+        if col is None:
+            part = self._partial.get(col_key)
+            col = part[0] if part is not None else ParamColumn(name)
+        return col
+
+    def condition_ids(self, name, op, raw, include_type=True, scope=None, display=None, partial=False):
+        """Множество Id элементов, подходящих под одно условие.
+
+        display(key, storage) -> текст значения для текстовых условий, если
+        колонка его не хранит (ElementId). partial=True — по уже обработанной
+        части колонки (scope тогда должен ограничивать обработанные элементы).
+        """
+        if partial:
+            col = self.peek_column(name, include_type)
+        else:
+            col = self.column(name, include_type)
+        if op in RANGE_OPS:
+            return col.ids_for(col.range_keys(raw)) if raw else set()
+        if op in TEXT_OPS:
+            if op == OP_STARTS and not col.has_ids:
+                return col.ids_for(col.prefix_keys(raw or u''))
+            keys = []
+            for key, st in col.storages.items():
+                text = col.display.get(key)
+                if text is None and display is not None:
+                    text = display(key, st)
+                if text_matches(op, text, raw):
+                    keys.append(key)
+            return col.ids_for(keys)
+        if op == OP_EMPTY:
+            universe = self.ids if scope is None else (self.ids & scope)
+            return universe - (col.present - col.empty)
+        if op == OP_NOT_EMPTY:
+            return col.present - col.empty
+        equal = col.by_value.get(raw_key(raw), set())
+        if op == OP_EQ:
+            return equal
+        if op == OP_NE:
+            return col.present - equal
+        return set()
+
+    def matching_ids(self, conditions, use_or, include_type=True, scope=None, display=None,
+                     partial=False):
+        """Id элементов по списку условий (ИЛИ — объединение, И — пересечение)."""
+        result = None
+        for (name, op, raw) in conditions:
+            ids = self.condition_ids(name, op, raw, include_type, scope, display, partial)
+            if result is None:
+                result = set(ids)
+            elif use_or:
+                result |= ids
+            else:
+                result &= ids
+            if not use_or and not result:
+                break
+        if result is None:
+            return set()
+        if scope is not None:
+            result &= scope
+        return result
+
+
+# =============================================================================
+# СНИМОК ДОКУМЕНТА МЕЖДУ ЗАПУСКАМИ
+# =============================================================================
+
+class DocumentSnapshot(object):
+    """Индекс кандидатов документа и накопленные с прошлого запуска изменения."""
+
+    def __init__(self, doc, elements):
+        self.index = ParamValueIndex(doc, elements)
+        self._changed = set()
+        self._deleted = set()
+
+    def mark_changed(self, added, modified, deleted):
+        for eid in added:
+            self._changed.add(eid.IntegerValue)
+        for eid in modified:
+            self._changed.add(eid.IntegerValue)
+        for eid in deleted:
+            self._deleted.add(eid.IntegerValue)
+
+    def refresh(self, doc, is_candidate):
+        """Применяет накопленные изменения. Возвращает число обработанных Id."""
+        index = self.index
+        index.doc = doc
+        deleted, self._deleted = self._deleted, set()
+        changed, self._changed = self._changed - deleted, set()
+        for eid in deleted:
+            index.remove(eid)
+        if not changed:
+            return len(deleted)
+
+        known_types = index.type_ids()
+        for eid in changed:
+            el = doc.GetElement(ElementId(eid))
+            if el is not None and is_candidate(el):
+                index.update(el)
+            else:
+                index.remove(eid)
+        index.invalidate_types(changed & known_types)
+        return len(deleted) + len(changed)
+
+
+def _store():
+    from System import AppDomain
+    domain = AppDomain.CurrentDomain
+    store = domain.GetData(_STORE_KEY)
+    if store is None:
+        store = {}
+        domain.SetData(_STORE_KEY, store)
+    return store
+
+
+def document_key(doc):
+    return doc.PathName or doc.Title
+
+
+def _counters(store):
+    """(счётчики изменений по документам, документы, открытые после подписки)"""
+    counters = store.get(_CHANGES_KEY)
+    if counters is None:
+        counters = store[_CHANGES_KEY] = ({}, set())
+    return counters
+
+
+def _sessions(store):
+    """Метки открытия документов: новая при каждом открытии."""
+    sessions = store.get(_SESSIONS_KEY)
+    if sessions is None:
+        sessions = store[_SESSIONS_KEY] = {}
+    return sessions
+
+
+def _on_document_changed(sender, args):
+    try:
+        store = _store()
+        key = document_key(args.GetDocument())
+        changes = _counters(store)[0]
+        changes[key] = changes.get(key, 0) + 1
+        snapshot = store.get(key)
+        if snapshot is not None:
+            snapshot.mark_changed(args.GetAddedElementIds(),
+                                  args.GetModifiedElementIds(),
+                                  args.GetDeletedElementIds())
+    except Exception:
+        pass
+
+
+def _on_document_opened(sender, args):
+    try:
+        from System import Guid
+        store = _store()
+        key = document_key(args.Document)
+        _counters(store)[1].add(key)
+        _sessions(store)[key] = str(Guid.NewGuid())
+    except Exception:
+        pass
+
+
+def _on_document_closing(sender, args):
+    try:
+        store = _store()
+        key = document_key(args.Document)
+        store.pop(key, None)
+        changes, tracked = _counters(store)
+        changes.pop(key, None)
+        tracked.discard(key)
+        _sessions(store).pop(key, None)
+        _purge_document_stores(store, key)
+    except Exception:
+        pass
+
+
+def _on_document_saving_as(sender, args):
+    # После «Сохранить как» ключ документа (путь) меняется — запоминаем прежний
+    try:
+        saving = _store().setdefault(_SAVING_AS_KEY, {})
+        saving[args.PathName] = document_key(args.Document)
+    except Exception:
+        pass
+
+
+def _on_document_saved_as(sender, args):
+    try:
+        store = _store()
+        new_key = document_key(args.Document)
+        old_key = store.setdefault(_SAVING_AS_KEY, {}).pop(new_key, None) or args.OriginalPath
+        if old_key and old_key != new_key:
+            _move_document(store, old_key, new_key)
+    except Exception:
+        pass
+
+
+def _move_document(store, old_key, new_key):
+    """Переносит снимок, счётчики и записи кэшей документа на новый ключ.
+
+    Иначе они остались бы под старым путём до конца сеанса: при закрытии
+    чистится только текущий ключ.
+    """
+    snapshot = store.pop(old_key, None)
+    if snapshot is not None:
+        store[new_key] = snapshot
+    changes, tracked = _counters(store)
+    if old_key in changes:
+        changes[new_key] = changes.pop(old_key)
+    if old_key in tracked:
+        tracked.discard(old_key)
+        tracked.add(new_key)
+    sessions = _sessions(store)
+    if old_key in sessions:
+        sessions[new_key] = sessions.pop(old_key)
+    from System import AppDomain
+    domain = AppDomain.CurrentDomain
+    for store_key in store.get(_DOCUMENT_STORES_KEY) or ():
+        data = domain.GetData(store_key)
+        if not data:
+            continue
+        for old in [k for k in data if k[0] == old_key]:
+            data[(new_key,) + tuple(old[1:])] = data.pop(old)
+
+
+def register_document_store(store_key):
+    """Кэш в данных AppDomain с ключами (документ, ...) — чистится при закрытии документа."""
+    stores = _store().get(_DOCUMENT_STORES_KEY)
+    if stores is None:
+        stores = _store()[_DOCUMENT_STORES_KEY] = set()
+    stores.add(store_key)
+
+
+def _purge_document_stores(store, key):
+    from System import AppDomain
+    domain = AppDomain.CurrentDomain
+    for store_key in store.get(_DOCUMENT_STORES_KEY) or ():
+        data = domain.GetData(store_key)
+        if not data:
+            continue
+        for old in [k for k in data if k[0] == key]:
+            del data[old]
+
+
+def ensure_handlers(app):
+    """Подписка на события приложения — один раз за сеанс Revit.
+
+    Вызывается из startup.py, чтобы изменения учитывались с открытия
+    документа; повторный вызов ничего не делает.
+    """
+    store = _store()
+    if store.get(_HANDLERS_KEY):
+        return True
+    try:
+        app.DocumentChanged += _on_document_changed
+        app.DocumentOpened += _on_document_opened
+        app.DocumentCreated += _on_document_opened
+        app.DocumentClosing += _on_document_closing
+        app.DocumentSavingAs += _on_document_saving_as
+        app.DocumentSavedAs += _on_document_saved_as
+    except Exception:
+        return False
+    store[_HANDLERS_KEY] = (_on_document_changed, _on_document_opened, _on_document_closing,
+                            _on_document_saving_as, _on_document_saved_as)
+    return True
+
+
+def change_count(doc):
+    """Число изменений документа за сеанс или None, если документ открыт до подписки."""
+    changes, tracked = _counters(_store())
+    key = document_key(doc)
+    if key not in tracked:
+        return None
+    return changes.get(key, 0)
+
+
+def document_state(doc):
+    """Состояние документа: метка открытия и счётчик изменений, или None.
+
+    Счётчик начинается с нуля при каждом открытии, поэтому сам по себе
+    не отличает документ после «изменить — сохранить — переоткрыть».
+    """
+    changes = change_count(doc)
+    if changes is None:
+        return None
+    session = _sessions(_store()).get(document_key(doc))
+    if session is None:
+        return None
+    return u'{0}:{1}'.format(session, changes)
+
+
+def get_snapshot(doc, collect, is_candidate):
+    """Снимок документа: из кэша (с применением изменений) или новый.
+
+    collect() -> все кандидаты модели, is_candidate(el) -> bool для
+    добавленных и изменённых элементов. Без подписки на события снимок не
+    кэшируется, чтобы не отдавать устаревшие данные.
+    """
+    key = document_key(doc)
+    store = _store()
+    snapshot = store.get(key)
+    if snapshot is not None:
+        snapshot.refresh(doc, is_candidate)
+        return snapshot
+    snapshot = DocumentSnapshot(doc, collect())
+    if ensure_handlers(doc.Application):
+        store[key] = snapshot
+    return snapshot
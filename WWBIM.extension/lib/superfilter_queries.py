@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+superfilter_queries.py — сохранённые запросы Суперфильтра и кэш их результатов.
+
+Запрос хранит строки условий в том виде, в каком их видит пользователь
+(параметр, оператор, текст значения), поэтому один и тот же запрос
+применим к любому документу: значения сопоставляются с индексом
+документа при выполнении. Запросы лежат в Settings/superfilter_queries.json
+рядом с расширением (общие для всех пользователей расширения).
+
+Результаты кэшируются локально у пользователя по отпечатку документа:
+число элементов, дата файла и счётчик изменений за сеанс (события
+DocumentChanged, см. superfilter_index). Если документ не менялся,
+повторное выполнение запроса возвращает сохранённый набор Id сразу.
+"""
+
+import io
+import json
+import os
+from collections import OrderedDict
+
+from Autodesk.Revit.DB import ElementId, FilteredElementCollector, StorageType
+
+from superfilter_index import (
+    OP_EMPTY, OP_NOT_EMPTY, OP_REGEX, RANGE_OPS, TEXT_OPS,
+    document_key, document_state, parse_range, range_to_internal
+)
+
+QUERIES_FILE = 'superfilter_queries.json'
+RESULTS_FILE = 'superfilter_results.json'
+RESULTS_PER_DOCUMENT = 50   # сколько результатов хранить на документ
+
+SCOPE_MODEL = u'model'
+
+
+def _extension_dir():
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def queries_path():
+    return os.path.join(_extension_dir(), 'Settings', QUERIES_FILE)
+
+
+def results_path():
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('APPDATA') or os.path.expanduser('~')
+    return os.path.join(base, 'WWBIM', RESULTS_FILE)
+
+
+def _read_json(path, default):
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+    except Exception:
+        return default
+
+
+def _write_json(path, data):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmp = path + '.tmp'
+    with io.open(tmp, 'w', encoding='utf-8') as f:
+        f.write(u'{0}'.format(json.dumps(data, ensure_ascii=False, indent=1)))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+# =============================================================================
+# ЗАПРОСЫ
+# =============================================================================
+
+class SavedQuery(object):
+    """Именованный запрос: строки (параметр, оператор, текст), логика и область."""
+
+    def __init__(self, name, rows, logic=u'ИЛИ', only_visible=True):
+        self.name = name
+        self.rows = [tuple(r) for r in rows]
+        self.logic = logic
+        self.only_visible = bool(only_visible)
+
+    @property
+    def use_or(self):
+        return self.logic == u'ИЛИ'
+
+    def signature(self):
+        """Меняется при любом изменении условий запроса."""
+        return json.dumps([self.rows, self.logic], ensure_ascii=False)
+
+    def to_json(self):
+        return OrderedDict([
+            ('name', self.name),
+            ('logic', self.logic),
+            ('only_visible', self.only_visible),
+            ('rows', [OrderedDict([('param', p), ('op', o), ('value', v)]) for p, o, v in self.rows]),
+        ])
+
+    @staticmethod
+    def from_json(d):
+        rows = [(r.get('param') or u'', r.get('op') or u'=', r.get('value') or u'')
+                for r in d.get('rows') or []]
+        return SavedQuery(d.get('name') or u'', rows, d.get('logic') or u'ИЛИ',
+                          d.get('only_visible', True))
+
+
+def load_queries(path=None):
+    """Сохранённые запросы: OrderedDict имя -> SavedQuery."""
+    data = _read_json(path or queries_path(), [])
+    result = OrderedDict()
+    for d in data if isinstance(data, list) else []:
+        try:
+            q = SavedQuery.from_json(d)
+        except Exception:
+            continue
+        if q.name:
+            result[q.name] = q
+    return result
+
+
+def save_queries(queries, path=None):
+    _write_json(path or queries_path(), [q.to_json() for q in queries.values()])
+
+
+# =============================================================================
+# СОПОСТАВЛЕНИЕ С ДОКУМЕНТОМ
+# =============================================================================
+
+def resolve_conditions(index, rows, key_display, include_type=True):
+    """Строки запроса -> условия (pname, op, raw) для индекса документа.
+
+    Значения '=' / '!=' ищутся по отображаемому тексту среди значений
+    параметра в документе; числа диапазонов переводятся во внутренние
+    единицы. Строки с некорректным значением пропускаются.
+    """
+    import re
+    conditions = []
+    for pname, op, text in rows:
+        if not pname:
+            continue
+        if op in (OP_EMPTY, OP_NOT_EMPTY):
+            conditions.append((pname, op, None))
+            continue
+        if not text:
+            continue
+        if op in TEXT_OPS:
+            if op == OP_REGEX:
+                try:
+                    re.compile(text)
+                except re.error:
+                    continue
+            conditions.append((pname, op, text))
+            continue
+        if op in RANGE_OPS:
+            storage = index.column_storage(pname, include_type)
+            rng = parse_range(op, text)
+            if rng is None or storage not in (StorageType.Integer, StorageType.Double):
+                continue
+            if storage == StorageType.Double:
+                rng = range_to_internal(rng, index.column_unit(pname, include_type))
+            conditions.append((pname, op, rng))
+            continue
+        conditions.append((pname, op, _resolve_value(index.column(pname, include_type), text, key_display)))
+    return conditions
+
+
+def _resolve_value(col, text, key_display):
+    for key, st in col.storages.items():
+        # Текст ElementId строит вызывающий — так же, как в выпадающем списке
+        disp = key_display(key, st) if st == StorageType.ElementId else col.display.get(key)
+        if disp == text:
+            return ElementId(key) if st == StorageType.ElementId else key
+    # Значения нет в документе: текст не совпадёт ни с одним ключом
+    return text
+
+
+# =============================================================================
+# КЭШ РЕЗУЛЬТАТОВ
+# =============================================================================
+
+def document_fingerprint(doc):
+    """Отпечаток состояния документа или None, если изменения не отслеживаются.
+
+    Включает метку открытия документа: после переоткрытия счётчик
+    изменений снова с нуля, и без метки отпечаток мог бы совпасть.
+    """
+    state = document_state(doc)
+    if state is None:
+        return None
+    count = FilteredElementCollector(doc).WhereElementIsNotElementType().GetElementCount()
+    try:
+        mtime = os.path.getmtime(doc.PathName) if doc.PathName else u''
+    except Exception:
+        mtime = u''
+    return u'{0}|{1}|{2}'.format(count, mtime, state)
+
+
+class ResultCache(object):
+    """Id элементов по (документ, запрос, область) с проверкой отпечатка."""
+
+    def __init__(self, path=None):
+        self.path = path or results_path()
+        self._data = _read_json(self.path, OrderedDict())
+        if not isinstance(self._data, dict):
+            self._data = OrderedDict()
+        self._dirty = False
+
+    def _key(self, query, scope_key):
+        return u'{0}\n{1}\n{2}'.format(query.name, scope_key, query.signature())
+
+    def get(self, doc, query, scope_key, fingerprint):
+        if fingerprint is None:
+            return None
+        entry = self._data.get(document_key(doc), {}).get(self._key(query, scope_key))
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return None
+        return entry.get('ids')
+
+    def put(self, doc, query, scope_key, fingerprint, ids):
+        if fingerprint is None:
+            return
+        per_doc = self._data.setdefault(document_key(doc), OrderedDict())
+        key = self._key(query, scope_key)
+        # Порядок записей — порядок записи (OrderedDict и при чтении файла):
+        # перезаписанная запись переносится в конец
+        per_doc.pop(key, None)
+        per_doc[key] = {'fingerprint': fingerprint, 'ids': sorted(ids)}
+        # Устаревшие отпечатки больше не совпадут — держим только последние записи
+        while len(per_doc) > RESULTS_PER_DOCUMENT:
+            per_doc.popitem(last=False)
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            _write_json(self.path, self._data)
+            self._dirty = False
+        except Exception:
+            pass
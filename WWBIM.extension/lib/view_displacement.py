@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+view_displacement.py — смещения элементов на 3D виде («Переместить элементы»).
+
+Наборы смещения (DisplacementElement) собираются фильтром по классу, а
+не перебором всех элементов модели, и раскладываются в словарь
+Id смещённого элемента -> вектор смещения. Для вложенных наборов берётся
+абсолютное смещение самого глубокого набора, в который входит элемент.
+
+Результат по виду хранится между запусками кнопок в данных AppDomain
+(как снимки Суперфильтра) и перестраивается, только если документ
+изменился: метку открытия и счётчик изменений ведёт superfilter_index
+по событиям DocumentOpened/DocumentChanged, записи документа удаляются
+при его закрытии. Для документов, открытых до подписки на события,
+кэш не используется.
+"""
+
+from Autodesk.Revit.DB import (
+    DisplacementElement, ElementId, FilteredElementCollector, View3D, XYZ
+)
+
+from superfilter_index import document_key, document_state, register_document_store
+
+_STORE_KEY = 'WWBIM.ViewDisplacements'
+
+TOL = 1e-6
+_PARAM_NAMES = (
+    (u"Смещение X", "Displacement X"),
+    (u"Смещение Y", "Displacement Y"),
+    (u"Смещение Z", "Displacement Z"),
+)
+
+
+def _store():
+    from System import AppDomain
+    domain = AppDomain.CurrentDomain
+    store = domain.GetData(_STORE_KEY)
+    if store is None:
+        store = {}
+        domain.SetData(_STORE_KEY, store)
+    register_document_store(_STORE_KEY)
+    return store
+
+
+def _vector(de):
+    """Абсолютное смещение набора (x, y, z) во внутренних единицах."""
+    try:
+        v = de.GetAbsoluteDisplacement()
+        return (v.X, v.Y, v.Z)
+    except Exception:
+        pass
+    # Запасной путь — параметры набора (только собственное смещение)
+    values = [0.0, 0.0, 0.0]
+    for p in de.Parameters:
+        try:
+            pname = p.Definition.Name
+        except Exception:
+            continue
+        for axis, names in enumerate(_PARAM_NAMES):
+            if pname in names:
+                try:
+                    values[axis] = p.AsDouble()
+                except Exception:
+                    pass
+    return tuple(values)
+
+
+def _depth(de_id, parents):
+    depth = 0
+    seen = set()
+    while de_id in parents and de_id not in seen:
+        seen.add(de_id)
+        de_id = parents[de_id]
+        depth += 1
+    return depth
+
+
+class ViewDisplacements(object):
+    """Смещения на одном виде: Id элемента -> (x, y, z)."""
+
+    def __init__(self, doc, view):
+        self.view_id = view.Id.IntegerValue
+        self.sets = {}          # Id набора -> (x, y, z)
+        self.by_element = {}    # Id смещённого элемента -> (x, y, z)
+        self._collect(doc)
+
+    def _collect(self, doc):
+        parents = {}
+        members = {}
+        collector = FilteredElementCollector(doc).OfClass(DisplacementElement)
+        for de in collector:
+            try:
+                if de.OwnerViewId.IntegerValue != self.view_id:
+                    continue
+            except Exception:
+                continue
+            de_id = de.Id.IntegerValue
+            try:
+                parent = de.GetParentDisplacementElementId()
+                if parent is not None and parent != ElementId.InvalidElementId:
+                    parents[de_id] = parent.IntegerValue
+            except Exception:
+                pass
+            vec = _vector(de)
+            if abs(vec[0]) < TOL and abs(vec[1]) < TOL and abs(vec[2]) < TOL:
+                continue
+            self.sets[de_id] = vec
+            try:
+                members[de_id] = [eid.IntegerValue for eid in de.GetDisplacedElementIds()]
+            except Exception:
+                members[de_id] = []
+
+        owner_depth = {}
+        for de_id, ids in members.items():
+            depth = _depth(de_id, parents)
+            for eid in ids:
+                if owner_depth.get(eid, -1) < depth:
+                    owner_depth[eid] = depth
+                    self.by_element[eid] = self.sets[de_id]
+
+    def __len__(self):
+        return len(self.by_element)
+
+    def is_displaced(self, element_id):
+        return element_id.IntegerValue in self.by_element
+
+    def get(self, element_id):
+        """Смещение элемента (XYZ) или None, если элемент не смещён."""
+        vec = self.by_element.get(element_id.IntegerValue)
+        if vec is None:
+            return None
+        return XYZ(vec[0], vec[1], vec[2])
+
+
+def get_view_displacements(doc, view):
+    """Смещения элементов на виде; для не-3D видов — пустой набор.
+
+    Повторный вызов для того же вида возвращает сохранённый результат,
+    пока в документе не было изменений.
+    """
+    if not isinstance(view, View3D):
+        return _EMPTY
+    stamp = document_state(doc)
+    key = (document_key(doc), view.Id.IntegerValue)
+    store = _store()
+    if stamp is not None:
+        cached = store.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    result = ViewDisplacements(doc, view)
+    if stamp is not None:
+        # Записи прошлых состояний документа не копятся
+        for old in [k for k in store if k[0] == key[0] and store[k][0] != stamp]:
+            del store[old]
+        store[key] = (stamp, result)
+    return result
+
+
+class _NoDisplacements(object):
+    sets = {}
+    by_element = {}
+
+    def __len__(self):
+        return 0
+
+    def is_displaced(self, element_id):
+        return False
+
+    def get(self, element_id):
+        return None
+
+
+_EMPTY = _NoDisplacements()
@@ -314,3 +314,16 @@ def _ensure_loaded():
 # Выполняем при старте pyRevit
 logger.info("Starting FamilyManager startup.py...")
 _ensure_loaded()
+
+
+def _start_superfilter_tracking():
+    """Подписка Суперфильтра на изменения документов — с начала сеанса,
+    чтобы кэш результатов сохранённых запросов знал о каждой правке."""
+    try:
+        import superfilter_index
+        superfilter_index.ensure_handlers(HOST_APP.app)
+    except Exception as ex:
+        logger.warning("SuperFilter change tracking not started: {0}".format(ex))
+
+
+_start_superfilter_tracking()